@@ -1,12 +1,19 @@
 import os
-from datetime import datetime
-from flask import Flask, redirect, request, session
+from datetime import date, datetime, timezone
+from flask import Flask, Response, redirect, request, session
 from dotenv import load_dotenv
 
 load_dotenv()
 
-from db import SessionLocal, FitbitConnection, init_db
+from sqlalchemy.exc import IntegrityError
+
+import metrics
+from db import SessionLocal, FitbitConnection, PendingSync, init_db
 from fitbit.oauth import build_authorize_url, exchange_code_for_tokens
+from fitbit.subscriptions import (
+    SUBSCRIBER_VERIFY_CODE, SUBSCRIPTIONS_ENABLED,
+    parse_notifications, subscribe_user, subscribed_users, verify_signature,
+)
 
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", "change-me")
@@ -69,7 +76,80 @@ def fitbit_callback():
     finally:
         db.close()
 
+    # Push notifications for new uploads (the hourly poll still runs as a fallback)
+    if SUBSCRIPTIONS_ENABLED:
+        try:
+            subscribed = subscribe_user(access_token, user_id)
+            print(f"[{user_id}] subscribed to {', '.join(subscribed) or 'nothing'}")
+        except Exception as e:
+            print(f"[ERROR] Subscription failed for {user_id}: {e}")
+
     return "Fitbit connected — you can close this window."
 
+@app.get("/fitbit/webhook")
+def fitbit_webhook_verify():
+    """Subscriber verification: 204 for the right code, 404 otherwise."""
+    code = request.args.get("verify")
+    if SUBSCRIBER_VERIFY_CODE and code == SUBSCRIBER_VERIFY_CODE:
+        return "", 204
+    return "", 404
+
+@app.post("/fitbit/webhook")
+def fitbit_webhook():
+    """
+    Fitbit notification: queue a targeted sync of the collection and day
+    that changed (see jobs/sync_fitbit.py --pending and jobs/daemon.py).
+    Fitbit expects an answer within a few seconds, so nothing is fetched here.
+    """
+    body = request.get_data()
+    if not verify_signature(body, request.headers.get("X-Fitbit-Signature")):
+        metrics.NOTIFICATIONS.inc(outcome="bad_signature")
+        return "", 404
+
+    notifications = parse_notifications(request.get_json(force=True, silent=True))
+    if not notifications:
+        return "", 204
+
+    # Our subscription ids map to the user; ownerId covers the others
+    # (subscriptions created before ids were hashed).
+    subscribed = subscribed_users(sorted({n["subscriptionId"] for n in notifications if n["subscriptionId"]}))
+    db = SessionLocal()
+    try:
+        owners = {n["ownerId"] for n in notifications if n["subscriptionId"] not in subscribed}
+        users = dict(
+            db.query(FitbitConnection.fitbit_user_id, FitbitConnection.user_id)
+            .filter(FitbitConnection.fitbit_user_id.in_(owners))
+            .all()
+        ) if owners else {}
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        for n in notifications:
+            user_id = subscribed.get(n["subscriptionId"]) or users.get(n["ownerId"])
+            try:
+                day = date.fromisoformat(n["date"]).isoformat()
+            except ValueError:
+                continue
+            if user_id is None:
+                metrics.NOTIFICATIONS.inc(outcome="unknown_owner")
+                continue
+            try:
+                with db.begin_nested():
+                    db.add(PendingSync(user_id=user_id, collection=n["collectionType"],
+                                       day=day, created_at=now))
+                metrics.NOTIFICATIONS.inc(outcome="queued")
+            except IntegrityError:
+                metrics.NOTIFICATIONS.inc(outcome="duplicate")  # already queued
+        db.commit()
+    finally:
+        db.close()
+    return "", 204
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """
+    Prometheus metrics of this process (webhook, token exchanges). The sync
+    jobs run elsewhere: they serve METRICS_PORT or write METRICS_FILE.
+    """
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
 if __name__ == "__main__":
     app.run(port=5000, debug=True)
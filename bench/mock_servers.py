@@ -0,0 +1,354 @@
+# bench/mock_servers.py
+#
+# Local stand-ins for the Fitbit Web API and mindLAMP, used by
+# bench/run_bench.py (and handy for manual runs against FITBIT_API_BASE /
+# LAMP_BASE):
+#
+#   python -m bench.mock_servers --fitbit-port 8801 --lamp-port 8802
+#
+# Fitbit: token, profile, devices, sleep, daily heart / HRV / SpO2 ranges
+# and steps, heart, calories, distance and active-zone-minutes intraday
+# (1min, 5min, 15min, whole-day or time-window URLs) built from synthetic
+# 1440-minute days, with per-token rate-limit headers (150 calls/hour by
+# default) and 429 + Retry-After once a token's budget is spent.
+# LAMP: accepts sensor_event POSTs (single object or array) and counts them.
+# GET /_stats returns the counters, POST /_reset clears them.
+
+import re
+import gzip
+import json
+import time
+import zlib
+import argparse
+import threading
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+_DETAIL_MINUTES = {"1min": 1, "5min": 5, "15min": 15}
+_INTRADAY_RE = re.compile(
+    r"^/1/user/-/activities/(?P<res>steps|heart|calories|distance|active-zone-minutes)/date/(?P<d1>[\d-]+)/(?P<d2>1d|[\d-]+)/"
+    r"(?P<detail>1min|5min|15min)(?:/time/(?P<st>\d\d:\d\d)/(?P<et>\d\d:\d\d))?\.json$"
+)
+_SLEEP_RE = re.compile(r"^/1\.2/user/-/sleep/date/(?P<d1>[\d-]+)/(?P<d2>[\d-]+)\.json$")
+_DAILY_RE = re.compile(r"^/1/user/-/(?P<res>activities/heart|hrv|spo2)/date/(?P<d1>[\d-]+)/(?P<d2>[\d-]+)\.json$")
+_LAMP_RE = re.compile(r"^/participant/(?P<user>[^/]+)/sensor_event$")
+
+
+# ---- Synthetic data ----
+
+@lru_cache(maxsize=4096)
+def _minutes(token: str, resource: str, day: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    One synthetic day of minute readings: (values, present mask), stable
+    for a given (token, day). Steps follow a day/night profile with walking
+    bursts; calories, distance and zone minutes follow the steps; heart rate
+    has ~5% of minutes missing (device off the wrist).
+    """
+    if resource in ("calories", "distance", "active-zone-minutes"):
+        steps, present = _minutes(token, "steps", day)
+        if resource == "calories":
+            values = np.round(1.1 + steps * 0.045, 4)
+        elif resource == "distance":
+            values = np.round(steps * 0.00075, 5)
+        else:
+            values = (steps >= 100).astype(np.int64)
+            present = values > 0  # only minutes in a zone are listed
+        return values, present
+    rng = np.random.default_rng(zlib.crc32(f"{token}|{resource}|{day}".encode()))
+    minute = np.arange(1440)
+    awake = (minute >= 7 * 60) & (minute < 23 * 60)
+    if resource == "steps":
+        walking = awake & (rng.random(1440) < 0.25)
+        values = np.where(walking, rng.integers(20, 130, 1440), 0)
+        return values.astype(np.int64), np.ones(1440, dtype=bool)
+    base = np.where(awake, 75, 58) + rng.normal(0, 6, 1440)
+    values = np.clip(np.round(base), 40, 190).astype(np.int64)
+    return values, rng.random(1440) >= 0.05
+
+
+def intraday_dataset(token: str, resource: str, day: str, detail: str,
+                     first_min: int = 0, last_min: int = 1439) -> List[Dict[str, Any]]:
+    """Fitbit-shaped dataset of `day` at `detail`, restricted to [first_min, last_min]."""
+    values, present = _minutes(token, resource, day)
+    step = _DETAIL_MINUTES[detail]
+    out = []
+    for start in range(first_min - first_min % step, last_min + 1, step):
+        sel = slice(max(start, first_min), min(start + step, last_min + 1))
+        v, p = values[sel], present[sel]
+        if not p.any():
+            continue
+        if resource == "heart":
+            value = int(round(float(v[p].mean())))
+        elif v.dtype.kind == "f":
+            value = round(float(v[p].sum()), 5)
+        else:
+            value = int(v[p].sum())
+        out.append({"time": f"{start // 60:02d}:{start % 60:02d}:00", "value": value})
+    return out
+
+
+def _intraday_body(res: str, pieces: List[Tuple[str, List[Dict[str, Any]]]], detail: str) -> Dict[str, Any]:
+    """Response for (day, dataset) pieces: one flat dataset, or per-day minutes for zone minutes."""
+    if res == "active-zone-minutes":
+        return {"activities-active-zone-minutes-intraday": [
+            {"dateTime": day, "minutes": [{"minute": f"{day}T{e['time']}",
+                                           "value": {"activeZoneMinutes": e["value"]}} for e in dataset]}
+            for day, dataset in pieces
+        ]}
+    return {f"activities-{res}": [], f"activities-{res}-intraday": {
+        "dataset": [e for _, dataset in pieces for e in dataset],
+        "datasetInterval": _DETAIL_MINUTES[detail], "datasetType": "minute",
+    }}
+
+
+def _daily_value(token: str, resource: str, day: str) -> float:
+    """Stable per-day summary value: resting HR, HRV (rmssd) or SpO2 average."""
+    h = zlib.crc32(f"{token}|{resource}|{day}".encode())
+    if resource == "activities/heart":
+        return 52 + h % 16
+    if resource == "hrv":
+        return round(20 + (h % 600) / 10, 3)
+    return round(94 + (h % 50) / 10, 1)
+
+
+def _days(first: str, last: str) -> List[str]:
+    d, end = date.fromisoformat(first), date.fromisoformat(last)
+    out = []
+    while d <= end:
+        out.append(d.isoformat())
+        d += timedelta(days=1)
+    return out
+
+
+def _to_minute(hhmm: Optional[str], default: int) -> int:
+    return default if not hhmm else int(hhmm[:2]) * 60 + int(hhmm[3:5])
+
+
+# ---- Servers ----
+
+class MockState:
+    """Counters and rate-limit budgets shared by both servers."""
+
+    def __init__(self, rate_limit: int = 150, fitbit_latency: float = 0.0,
+                 lamp_latency: float = 0.0):
+        self.rate_limit = rate_limit
+        self.fitbit_latency = fitbit_latency
+        self.lamp_latency = lamp_latency
+        self.counts: Counter = Counter()
+        self._used: Counter = Counter()
+        self._hour = 0
+        self._lock = threading.Lock()
+
+    def take_call(self, token: str) -> Tuple[int, int]:
+        """Count one call for `token`: (remaining, seconds until the hourly reset)."""
+        now = time.time()
+        with self._lock:
+            hour = int(now // 3600)
+            if hour != self._hour:
+                self._hour = hour
+                self._used.clear()
+            self._used[token] += 1
+            used = self._used[token]
+        return self.rate_limit - used, 3600 - int(now % 3600)
+
+    def count(self, key: str, n: int = 1) -> None:
+        with self._lock:
+            self.counts[key] += n
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.counts)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counts.clear()
+            self._used.clear()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    state: MockState
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real APIs
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def _send(self, status: int, body: Any, headers: Optional[Dict[str, str]] = None) -> None:
+        raw = json.dumps(body, separators=(",", ":")).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _control(self) -> bool:
+        if self.command == "GET" and self.path == "/_stats":
+            self._send(200, self.state.snapshot())
+            return True
+        if self.command == "POST" and self.path == "/_reset":
+            self._body()
+            self.state.reset()
+            self._send(200, {})
+            return True
+        return False
+
+
+class FitbitHandler(_Handler):
+
+    def do_POST(self) -> None:
+        if self._control():
+            return
+        self._body()
+        if self.path.startswith("/oauth2/token"):
+            self.state.count("fitbit_token")
+            self._send(200, {"access_token": f"bench-{int(time.time() * 1000)}", "refresh_token": "bench-refresh",
+                             "expires_in": 28800, "user_id": "BENCH", "scope": "activity heartrate sleep profile oxygen_saturation",
+                             "token_type": "Bearer"})
+            return
+        if "/apiSubscriptions/" in self.path:
+            self.state.count("fitbit_subscriptions")
+            self._send(201, {})
+            return
+        self._send(404, {"errors": [{"message": self.path}]})
+
+    def do_GET(self) -> None:
+        if self._control():
+            return
+        token = self.headers.get("Authorization", "").removeprefix("Bearer ")
+        remaining, reset = self.state.take_call(token)
+        headers = {
+            "Fitbit-Rate-Limit-Limit": str(self.state.rate_limit),
+            "Fitbit-Rate-Limit-Remaining": str(max(0, remaining)),
+            "Fitbit-Rate-Limit-Reset": str(reset),
+        }
+        if remaining < 0:
+            self.state.count("fitbit_429")
+            self._send(429, {"errors": [{"errorType": "request"}]}, {**headers, "Retry-After": str(reset)})
+            return
+        if self.state.fitbit_latency:
+            time.sleep(self.state.fitbit_latency)
+        path = self.path.split("?")[0]
+        self.state.count("fitbit_calls")
+
+        if path == "/1/user/-/profile.json":
+            self.state.count("fitbit_profile")
+            self._send(200, {"user": {"displayName": f"Bench {token[-6:]}", "offsetFromUTCMillis": 0}}, headers)
+            return
+        if path == "/1/user/-/devices.json":
+            self.state.count("fitbit_devices")
+            last = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000")
+            self._send(200, [{"id": "1", "type": "TRACKER", "deviceVersion": "Charge 6",
+                              "battery": "High", "lastSyncTime": last}], headers)
+            return
+        m = _SLEEP_RE.match(path)
+        if m:
+            self.state.count("fitbit_sleep")
+            sleep = []
+            for day in _days(m["d1"], m["d2"]):
+                h = zlib.crc32(f"{token}|sleep|{day}".encode())
+                sleep.append({"dateOfSleep": day, "duration": (360 + h % 180) * 60000,
+                              "efficiency": 80 + h % 19, "isMainSleep": True})
+            self._send(200, {"sleep": sleep}, headers)
+            return
+        m = _DAILY_RE.match(path)
+        if m:
+            res = m["res"]
+            self.state.count(f"fitbit_daily_{res.replace('activities/', '')}")
+            days = _days(m["d1"], m["d2"])
+            if res == "activities/heart":
+                body: Any = {"activities-heart": [
+                    {"dateTime": d, "value": {"restingHeartRate": _daily_value(token, res, d)}} for d in days]}
+            elif res == "hrv":
+                body = {"hrv": [{"dateTime": d, "value": {"dailyRmssd": _daily_value(token, res, d)}}
+                                for d in days]}
+            else:
+                body = [{"dateTime": d, "value": {"avg": _daily_value(token, res, d)}} for d in days]
+            self._send(200, body, headers)
+            return
+        m = _INTRADAY_RE.match(path)
+        if m:
+            res, detail = m["res"], m["detail"]
+            self.state.count(f"fitbit_intraday_{res}_{detail}")
+            d1 = m["d1"]
+            d2 = d1 if m["d2"] == "1d" else m["d2"]
+            first, last = _to_minute(m["st"], 0), _to_minute(m["et"], 1439)
+            if d1 == d2:
+                pieces = [(d1, intraday_dataset(token, res, d1, detail, first, last))]
+            else:
+                pieces = [(d1, intraday_dataset(token, res, d1, detail, first, 1439)),
+                          (d2, intraday_dataset(token, res, d2, detail, 0, last))]
+            self._send(200, _intraday_body(res, pieces, detail), headers)
+            return
+        self.state.count("fitbit_404")
+        self._send(404, {"errors": [{"message": path}]}, headers)
+
+
+class LampHandler(_Handler):
+
+    def do_GET(self) -> None:
+        if not self._control():
+            self._send(404, {})
+
+    def do_POST(self) -> None:
+        if self._control():
+            return
+        raw = self._body()
+        m = _LAMP_RE.match(self.path.split("?")[0])
+        if not m:
+            self._send(404, {})
+            return
+        if self.headers.get("Content-Encoding") == "gzip":
+            raw = gzip.decompress(raw)
+        body = json.loads(raw)
+        if self.state.lamp_latency:
+            time.sleep(self.state.lamp_latency)
+        self.state.count("lamp_posts")
+        self.state.count("lamp_events", len(body) if isinstance(body, list) else 1)
+        self._send(200, {"data": {}})
+
+
+def start(fitbit_port: int = 0, lamp_port: int = 0, state: Optional[MockState] = None,
+          host: str = "127.0.0.1") -> Tuple[MockState, str, str, List[ThreadingHTTPServer]]:
+    """Start both servers in daemon threads. Returns (state, fitbit_base, lamp_base, servers)."""
+    state = state or MockState()
+    servers = []
+    for port, handler in ((fitbit_port, FitbitHandler), (lamp_port, LampHandler)):
+        cls = type(handler.__name__, (handler,), {"state": state})
+        server = ThreadingHTTPServer((host, port), cls)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name=handler.__name__, daemon=True).start()
+        servers.append(server)
+    fitbit_base, lamp_base = (f"http://{host}:{s.server_address[1]}" for s in servers)
+    return state, fitbit_base, lamp_base, servers
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Local stand-in Fitbit and mindLAMP servers.")
+    parser.add_argument("--fitbit-port", type=int, default=8801)
+    parser.add_argument("--lamp-port", type=int, default=8802)
+    parser.add_argument("--rate-limit", type=int, default=150, help="Fitbit calls per token and hour")
+    parser.add_argument("--fitbit-latency", type=float, default=0.0, help="seconds added to each Fitbit GET")
+    parser.add_argument("--lamp-latency", type=float, default=0.0, help="seconds added to each LAMP POST")
+    args = parser.parse_args(argv)
+
+    state = MockState(args.rate_limit, args.fitbit_latency, args.lamp_latency)
+    _, fitbit_base, lamp_base, _ = start(args.fitbit_port, args.lamp_port, state)
+    # One line, parsed by run_bench.py
+    print(json.dumps({"fitbit": fitbit_base, "lamp": lamp_base}), flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
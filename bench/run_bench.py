@@ -0,0 +1,267 @@
+# bench/run_bench.py
+#
+# Offline throughput benchmark: starts bench/mock_servers.py, then runs each
+# scenario in a fresh child process (own SQLite DB, clean memory figures)
+# against it and reports requests, wall time, CPU and peak memory.
+#
+#   python -m bench.run_bench --users 20 --days 7
+#   python -m bench.run_bench --users 50 --days 14 --freq 1min --json after.json --compare before.json
+#   python -m bench.run_bench --metrics steps,sleep,heartrate,calories,distance,spo2
+#
+# Scenarios:
+#   fetch  every enabled metric (FITBIT_METRICS, or --metrics) for every
+#          user through fitbit.registry (no DB, no LAMP)
+#   job    jobs.sync_fitbit.run_once: pre-check, fetch, outbox, LAMP flush
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from typing import Any, Dict, List, Optional
+
+CURRENT_DIR = os.path.dirname(__file__)
+PROJECT_ROOT = os.path.dirname(CURRENT_DIR)
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+import requests
+
+SCENARIOS = ("fetch", "job")
+FREQS = ("1min", "1h")
+
+# Figures compared between runs (lower is better for all of them)
+_COMPARED = ("wall_s", "cpu_s", "peak_rss_mb", "fitbit_calls", "lamp_posts")
+
+
+# ---- Child: one scenario, one process ----
+
+def _rss_mb() -> float:
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB on Linux
+
+
+def _cpu_s() -> float:
+    import resource
+    r = resource.getrusage(resource.RUSAGE_SELF)
+    return r.ru_utime + r.ru_stime
+
+
+def _bench_fetch(users: int, days: int, workers: int) -> int:
+    from concurrent.futures import ThreadPoolExecutor
+    from datetime import datetime, timedelta
+    from fitbit.registry import ENABLED, groups, iter_group
+
+    last = datetime.combine(datetime.now().date(), datetime.min.time()) - timedelta(days=1)
+    start, end = last - timedelta(days=days - 1), last.replace(hour=23, minute=59)
+
+    def _one(i: int) -> int:
+        token = f"bench-u{i}"
+        points = 0
+        for group in groups(ENABLED):
+            starts = {s.name: start for s in group}
+            for chunk in iter_group(group, token, starts, end):
+                points += sum(len(p) for p in chunk.values())
+        return points
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return sum(pool.map(_one, range(users)))
+
+
+def _seed_users(users: int, days: int) -> None:
+    from datetime import datetime, timedelta, timezone
+    from db import SessionLocal, FitbitConnection, init_db
+
+    init_db()
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    db = SessionLocal()
+    try:
+        for i in range(users):
+            db.add(FitbitConnection(
+                user_id=f"u{i}", fitbit_user_id=f"BENCH{i}", access_token=f"bench-u{i}",
+                refresh_token="bench-refresh", scope="activity heartrate sleep profile",
+                token_type="Bearer", expires_at=now + timedelta(hours=8),
+                last_synced_at=now - timedelta(days=days),
+            ))
+        db.commit()
+    finally:
+        db.close()
+
+
+def _bench_job(workers: int) -> int:
+    from fitbit.registry import ENABLED
+    from jobs.sync_fitbit import run_once
+    from metrics import POINTS
+
+    run_once(workers=workers)
+    return int(sum(POINTS.value(sensor=s.name, outcome=o) for s in ENABLED
+                   for o in ("queued", "sent", "unchanged")))
+
+
+def run_child(scenario: str, users: int, days: int, freq: str, workers: int, trace: bool) -> Dict[str, Any]:
+    import tracemalloc
+    from contextlib import redirect_stdout
+
+    if scenario == "job":
+        _seed_users(users, days)
+    rss_before = _rss_mb()
+    if trace:
+        tracemalloc.start()
+    cpu, started = _cpu_s(), time.perf_counter()
+    with open(os.devnull, "w") as quiet, redirect_stdout(quiet):
+        points = (_bench_fetch(users, days, workers) if scenario == "fetch"
+                  else _bench_job(workers))
+    wall = time.perf_counter() - started
+    result = {
+        "scenario": scenario, "freq": freq, "users": users, "days": days, "workers": workers,
+        "metrics": os.getenv("FITBIT_METRICS", ""),
+        "points": points,
+        "wall_s": round(wall, 3),
+        "cpu_s": round(_cpu_s() - cpu, 3),
+        "peak_rss_mb": round(_rss_mb(), 1),
+        "rss_growth_mb": round(_rss_mb() - rss_before, 1),
+        "points_per_s": round(points / wall) if wall > 0 else 0,
+    }
+    if trace:
+        result["py_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+        tracemalloc.stop()
+    return result
+
+
+# ---- Parent: servers, children, report ----
+
+def _start_servers(rate_limit: int, fitbit_latency: float, lamp_latency: float):
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "bench.mock_servers", "--fitbit-port", "0", "--lamp-port", "0",
+         "--rate-limit", str(rate_limit), "--fitbit-latency", str(fitbit_latency),
+         "--lamp-latency", str(lamp_latency)],
+        cwd=PROJECT_ROOT, stdout=subprocess.PIPE, text=True,
+    )
+    bases = json.loads(proc.stdout.readline())
+    return proc, bases["fitbit"], bases["lamp"]
+
+
+def _run_scenario(scenario: str, freq: str, args, fitbit: str, lamp: str) -> Dict[str, Any]:
+    tmp = tempfile.mkdtemp(prefix="fitbit-bench-")
+    env = {
+        **os.environ,
+        "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+        "FITBIT_API_BASE": fitbit,
+        "LAMP_BASE": lamp,
+        "LAMP_AUTH": "Basic YmVuY2g6YmVuY2g=",
+        "FITBIT_CLIENT_ID": os.getenv("FITBIT_CLIENT_ID") or "bench",
+        "FITBIT_CLIENT_SECRET": os.getenv("FITBIT_CLIENT_SECRET") or "bench",
+        "REDIRECT_URI": os.getenv("REDIRECT_URI") or "http://localhost/callback",
+        "FITBIT_STEPS_FREQ": freq,
+        "FITBIT_HR_FREQ": freq,
+        "FITBIT_CALORIES_FREQ": freq,
+        "FITBIT_DISTANCE_FREQ": freq,
+        "FITBIT_ACTIVE_ZONE_MINUTES_FREQ": freq,
+        "SYNC_WORKERS": str(args.workers),
+        "METRICS_FILE": "",
+        "METRICS_PORT": "0",
+    }
+    if args.metrics:
+        env["FITBIT_METRICS"] = args.metrics
+    for base in (fitbit, lamp):
+        requests.post(f"{base}/_reset", timeout=5)
+    try:
+        out = subprocess.run(
+            [sys.executable, "-m", "bench.run_bench", "--child", scenario, "--freq", freq,
+             "--users", str(args.users), "--days", str(args.days), "--workers", str(args.workers)]
+            + (["--trace"] if args.trace else []),
+            cwd=PROJECT_ROOT, env=env, capture_output=True, text=True, check=True,
+        ).stdout
+    except subprocess.CalledProcessError as e:
+        sys.stderr.write(e.stderr)
+        raise
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    result = json.loads(out.strip().splitlines()[-1])
+    fitbit_stats = requests.get(f"{fitbit}/_stats", timeout=5).json()
+    lamp_stats = requests.get(f"{lamp}/_stats", timeout=5).json()
+    result.update({
+        "fitbit_calls": fitbit_stats.get("fitbit_calls", 0),
+        "fitbit_429": fitbit_stats.get("fitbit_429", 0),
+        "lamp_posts": lamp_stats.get("lamp_posts", 0),
+        "lamp_events": lamp_stats.get("lamp_events", 0),
+    })
+    return result
+
+
+def _print_table(results: List[Dict[str, Any]], baseline: Optional[List[Dict[str, Any]]]) -> None:
+    cols = ("scenario", "freq", "users", "days", "points", "fitbit_calls", "fitbit_429",
+            "lamp_posts", "wall_s", "cpu_s", "peak_rss_mb", "points_per_s")
+    rows = [[str(r.get(c, "")) for c in cols] for r in results]
+    widths = [max(len(c), *(len(row[i]) for row in rows)) for i, c in enumerate(cols)]
+    print("  ".join(c.rjust(w) for c, w in zip(cols, widths)))
+    for row in rows:
+        print("  ".join(v.rjust(w) for v, w in zip(row, widths)))
+
+    if not baseline:
+        return
+    key = lambda r: (r["scenario"], r["freq"], r["users"], r["days"], r.get("metrics", ""))
+    before = {key(r): r for r in baseline}
+    print("\nvs baseline (negative = better):")
+    for r in results:
+        b = before.get(key(r))
+        if b is None:
+            continue
+        deltas = []
+        for c in _COMPARED:
+            if b.get(c):
+                deltas.append(f"{c} {100.0 * (r[c] - b[c]) / b[c]:+.1f}%")
+        print(f"  {r['scenario']:>5} {r['freq']:>4}: " + ", ".join(deltas))
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Offline Fitbit → mindLAMP sync benchmark.")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--days", type=int, default=7, help="days of history per user")
+    parser.add_argument("--freq", action="append", choices=FREQS, help="repeatable (default: both)")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="repeatable (default: all)")
+    parser.add_argument("--workers", type=int, default=4, help="users in parallel")
+    parser.add_argument("--metrics", default=None, help="FITBIT_METRICS for the children (default: env or "
+                        "steps,sleep,heartrate)")
+    parser.add_argument("--rate-limit", type=int, default=150, help="mock Fitbit calls per user and hour")
+    parser.add_argument("--fitbit-latency", type=float, default=0.0, help="seconds added per Fitbit call")
+    parser.add_argument("--lamp-latency", type=float, default=0.0, help="seconds added per LAMP POST")
+    parser.add_argument("--trace", action="store_true", help="also report the Python heap peak (tracemalloc, slower)")
+    parser.add_argument("--json", metavar="PATH", help="save the results")
+    parser.add_argument("--compare", metavar="PATH", help="results of an earlier --json run")
+    parser.add_argument("--child", choices=SCENARIOS, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(run_child(args.child, args.users, args.days, args.freq[0],
+                                   max(1, args.workers), args.trace)))
+        return
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    proc, fitbit, lamp = _start_servers(args.rate_limit, args.fitbit_latency, args.lamp_latency)
+    results = []
+    try:
+        for freq in args.freq or FREQS:
+            for scenario in args.scenario or SCENARIOS:
+                print(f"running {scenario} @ {freq}: {args.users} users × {args.days} days...", flush=True)
+                results.append(_run_scenario(scenario, freq, args, fitbit, lamp))
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    print()
+    _print_table(results, baseline)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
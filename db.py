@@ -1,18 +1,66 @@
 import os
-from sqlalchemy import create_engine, Integer, String, DateTime, Text
+from sqlalchemy import create_engine, event, BigInteger, Index, Integer, String, DateTime, Text, UniqueConstraint
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, sessionmaker
 from datetime import datetime
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///fitbit.db")
 
-engine = create_engine(DATABASE_URL, future=True)
+# ---- Engine configuration ----
+# DB_POOL_SIZE / DB_MAX_OVERFLOW  connections kept open / extra under load
+#                                 (size them to the sync workers + web threads)
+# DB_POOL_TIMEOUT                 seconds to wait for a free connection
+# DB_POOL_RECYCLE                 seconds before a connection is replaced
+#                                 (under the server's idle timeout)
+# DB_POOL_PRE_PING                check connections before use (1/0)
+# DB_ECHO                         log every SQL statement (1/0)
+# SQLITE_BUSY_TIMEOUT_MS          how long SQLite waits for a lock instead of
+#                                 failing with "database is locked"
+# SQLITE_WAL                      WAL journal: readers do not block the writer
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+DB_ECHO = os.getenv("DB_ECHO", "0") == "1"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "10000"))
+SQLITE_WAL = os.getenv("SQLITE_WAL", "1") == "1"
+
+_is_sqlite = DATABASE_URL.startswith("sqlite")
+_in_memory = _is_sqlite and (DATABASE_URL in ("sqlite://", "sqlite:///:memory:") or "mode=memory" in DATABASE_URL)
+
+_engine_options = {"future": True, "echo": DB_ECHO, "pool_pre_ping": DB_POOL_PRE_PING}
+if _is_sqlite:
+    # Connections are shared between worker threads (one session per thread).
+    _engine_options["connect_args"] = {"check_same_thread": False,
+                                       "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}
+if not _in_memory:
+    _engine_options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+                           pool_timeout=DB_POOL_TIMEOUT, pool_recycle=DB_POOL_RECYCLE)
+
+engine = create_engine(DATABASE_URL, **_engine_options)
 SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
 
+if _is_sqlite:
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        cur.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+        if SQLITE_WAL and not _in_memory:
+            # Persistent per database file; NORMAL is durable enough in WAL mode.
+            cur.execute("PRAGMA journal_mode = WAL")
+            cur.execute("PRAGMA synchronous = NORMAL")
+        cur.close()
+
 class Base(DeclarativeBase):
     pass
 
 class FitbitConnection(Base):
     __tablename__ = "fitbit_connections"
+    __table_args__ = (
+        Index("ix_fitbit_connections_fitbit_user_id", "fitbit_user_id"),   # webhook owner lookup
+        Index("ix_fitbit_connections_expires_at", "expires_at"),           # refresh_due()
+        Index("ix_fitbit_connections_next_sync_at", "next_sync_at"),       # due claims
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     # Your internal user id (string for simplicity)
     user_id: Mapped[str] = mapped_column(String(128), unique=True, nullable=False)
@@ -23,6 +71,155 @@ class FitbitConnection(Base):
     token_type: Mapped[str] = mapped_column(String(32), nullable=False)
     expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
     last_synced_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    # Lease: the worker currently syncing this user, until when (UTC), and
+    # when the user is next due for a sync (see jobs/leases.py).
+    lease_owner: Mapped[str | None] = mapped_column(String(128), nullable=True)
+    lease_expires_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    next_sync_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+class FitbitResponseCache(Base):
+    """Raw Fitbit intraday responses for days that can no longer change."""
+    __tablename__ = "fitbit_response_cache"
+    __table_args__ = (
+        UniqueConstraint("user_id", "resource", "day", "detail"),
+        Index("ix_fitbit_response_cache_fetched_at", "fetched_at"),         # prune()
+    )
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    user_id: Mapped[str] = mapped_column(String(128), nullable=False)
+    resource: Mapped[str] = mapped_column(String(32), nullable=False)   # "steps", "heart"
+    day: Mapped[str] = mapped_column(String(10), nullable=False)        # YYYY-MM-DD (user local)
+    detail: Mapped[str] = mapped_column(String(8), nullable=False)      # "1min", "15min"...
+    payload: Mapped[str] = mapped_column(Text, nullable=False)          # response JSON
+    fetched_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+class LampDeliveryDigest(Base):
+    """Digest of the last value delivered to mindLAMP per user, sensor and timestamp."""
+    __tablename__ = "lamp_delivery_digests"
+    __table_args__ = (
+        UniqueConstraint("user_id", "sensor", "timestamp"),
+        Index("ix_lamp_delivery_digests_timestamp", "timestamp"),           # prune_digests()
+    )
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    user_id: Mapped[str] = mapped_column(String(128), nullable=False)
+    sensor: Mapped[str] = mapped_column(String(32), nullable=False)
+    timestamp: Mapped[int] = mapped_column(BigInteger, nullable=False)   # point timestamp (ms)
+    digest: Mapped[str] = mapped_column(String(16), nullable=False)      # 8-byte blake2b, hex
+
+class LampOutbox(Base):
+    """
+    Points waiting for delivery to mindLAMP. One row per (user, sensor,
+    timestamp): re-queueing a point replaces the pending value.
+    """
+    __tablename__ = "lamp_outbox"
+    __table_args__ = (
+        UniqueConstraint("user_id", "sensor", "timestamp"),
+        Index("ix_lamp_outbox_next_attempt_at", "next_attempt_at"),         # due rows
+        Index("ix_lamp_outbox_user_due", "user_id", "next_attempt_at"),     # per-user flush
+    )
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    user_id: Mapped[str] = mapped_column(String(128), nullable=False)
+    sensor: Mapped[str] = mapped_column(String(32), nullable=False)
+    timestamp: Mapped[int] = mapped_column(BigInteger, nullable=False)   # point timestamp (ms)
+    payload: Mapped[str] = mapped_column(Text, nullable=False)           # point JSON
+    digest: Mapped[str] = mapped_column(String(16), nullable=False)      # recorded once delivered
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)   # UTC
+    last_error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    # Flush currently posting the row (jobs/lamp.py flush_outbox); the claim
+    # pushes next_attempt_at forward, so it lapses if that flush dies.
+    claimed_by: Mapped[str | None] = mapped_column(String(32), nullable=True)
+
+class SyncWatermark(Base):
+    """How far each sensor of a user has been delivered (independent per sensor)."""
+    __tablename__ = "sync_watermarks"
+    __table_args__ = (UniqueConstraint("user_id", "sensor"),)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    user_id: Mapped[str] = mapped_column(String(128), nullable=False)
+    sensor: Mapped[str] = mapped_column(String(32), nullable=False)
+    # Start of the last delivered bucket, in the user's local (Fitbit) time.
+    synced_through: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+class PendingSync(Base):
+    """Targeted sync queued by a Fitbit subscription notification."""
+    __tablename__ = "pending_syncs"
+    __table_args__ = (
+        UniqueConstraint("user_id", "collection", "day"),
+        Index("ix_pending_syncs_created_at", "created_at"),
+    )
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    user_id: Mapped[str] = mapped_column(String(128), nullable=False)
+    collection: Mapped[str] = mapped_column(String(32), nullable=False)  # "activities", "sleep"...
+    day: Mapped[str] = mapped_column(String(10), nullable=False)         # YYYY-MM-DD (user local)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+class FitbitSubscription(Base):
+    """
+    Fitbit subscription ids we created (short hashes, Fitbit allows 50
+    characters) and the user and collection each one stands for.
+    """
+    __tablename__ = "fitbit_subscriptions"
+    subscription_id: Mapped[str] = mapped_column(String(50), primary_key=True)
+    user_id: Mapped[str] = mapped_column(String(128), nullable=False)
+    collection: Mapped[str] = mapped_column(String(32), nullable=False)  # "activities", "sleep"...
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+class FitbitDeviceState(Base):
+    """Cached profile and last device upload seen for a user (sync pre-check)."""
+    __tablename__ = "fitbit_device_state"
+    user_id: Mapped[str] = mapped_column(String(128), primary_key=True)
+    display_name: Mapped[str | None] = mapped_column(String(256), nullable=True)
+    offset_ms: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)  # offsetFromUTCMillis
+    profile_fetched_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)  # UTC
+    # Latest device lastSyncTime seen (user local), and the one covered by
+    # the last complete sync.
+    last_upload: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    synced_upload: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    checked_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)  # UTC
+
+class BackfillJob(Base):
+    """Historical backfill of one user over [start_day, end_day], with its checkpoint."""
+    __tablename__ = "backfill_jobs"
+    __table_args__ = (
+        UniqueConstraint("user_id", "start_day", "end_day"),
+        Index("ix_backfill_jobs_status", "status"),
+    )
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    user_id: Mapped[str] = mapped_column(String(128), nullable=False)
+    start_day: Mapped[str] = mapped_column(String(10), nullable=False)   # YYYY-MM-DD
+    end_day: Mapped[str] = mapped_column(String(10), nullable=False)
+    # Checkpoint: first day of the window in progress, and the sensors of
+    # that window already delivered (comma-separated metric names).
+    next_day: Mapped[str] = mapped_column(String(10), nullable=False)
+    done_sensors: Mapped[str] = mapped_column(String(512), nullable=False, default="")
+    status: Mapped[str] = mapped_column(String(16), nullable=False)    # pending, done, failed
+    error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+# ---- Schema ----
+
+_PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+_schema_ready = False
 
 def init_db():
-    Base.metadata.create_all(engine)
+    """
+    Bring the schema up to date with the alembic migrations (migrations/).
+
+    Safe to call at every start: a fresh DB gets every table, an existing
+    one (including DBs created before migrations existed) only what it
+    lacks. Runs once per process.
+    """
+    global _schema_ready
+    if _schema_ready:
+        return
+    from alembic import command
+    from alembic.config import Config
+
+    cfg = Config(os.path.join(_PROJECT_ROOT, "alembic.ini"))
+    cfg.set_main_option("script_location", os.path.join(_PROJECT_ROOT, "migrations"))
+    with engine.begin() as conn:
+        cfg.attributes["connection"] = conn
+        command.upgrade(cfg, "head")
+    _schema_ready = True
@@ -0,0 +1,98 @@
+import os
+import json
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Optional, Set
+
+from sqlalchemy.exc import IntegrityError
+
+from db import SessionLocal, FitbitResponseCache
+
+# -------------------------------------------------------------------
+# Raw response cache for whole intraday days
+#
+# A day is only cached once it can no longer change: fetched at least
+# FITBIT_CACHE_SETTLE_DAYS full UTC days after it (Fitbit days are in the
+# user's timezone, at most 14h away from UTC, and trackers may upload late)
+# and strictly before the day of the tracker's last upload (lastSyncTime):
+# until then Fitbit serves the missing minutes as zeros, not as a gap.
+# Open days ("today", "yesterday") are always revalidated against the API.
+# Responses fetched more than FITBIT_CACHE_RETENTION_DAYS ago are deleted
+# by prune() (daily, from run_once and the daemon).
+# -------------------------------------------------------------------
+
+CACHE_ENABLED = os.getenv("FITBIT_CACHE", "1") == "1"
+CACHE_SETTLE_DAYS = max(1, int(os.getenv("FITBIT_CACHE_SETTLE_DAYS", "1")))
+CACHE_RETENTION_DAYS = int(os.getenv("FITBIT_CACHE_RETENTION_DAYS", "30"))
+
+
+def is_settled(day: str, fetched_at: Optional[datetime] = None) -> bool:
+    """True if data for `day` fetched at `fetched_at` (UTC, default now) is final."""
+    fetched_at = fetched_at or datetime.now(timezone.utc)
+    return date.fromisoformat(day) + timedelta(days=CACHE_SETTLE_DAYS) < fetched_at.date()
+
+
+def cached_days(user_id: str, resource: str, detail: str, first: str, last: str) -> Set[str]:
+    """Days in [first, last] that have a cached response (one query, no payloads)."""
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(FitbitResponseCache.day)
+            .filter_by(user_id=user_id, resource=resource, detail=detail)
+            .filter(FitbitResponseCache.day >= first, FitbitResponseCache.day <= last)
+            .all()
+        )
+        return {day for (day,) in rows}
+    finally:
+        db.close()
+
+
+def load(user_id: str, resource: str, day: str, detail: str) -> Optional[Any]:
+    """Return the cached raw response for one day, or None."""
+    db = SessionLocal()
+    try:
+        row = (
+            db.query(FitbitResponseCache.payload)
+            .filter_by(user_id=user_id, resource=resource, day=day, detail=detail)
+            .one_or_none()
+        )
+        return json.loads(row[0]) if row else None
+    finally:
+        db.close()
+
+
+def store(user_id: str, resource: str, day: str, detail: str, raw: Any,
+          uploaded: Optional[datetime]) -> None:
+    """
+    Cache the raw response of a whole day if that day is settled and the
+    tracker uploaded after it (`uploaded`: last lastSyncTime, user local
+    time; None = unknown, nothing is cached).
+    """
+    now = datetime.now(timezone.utc)
+    if uploaded is None or day >= uploaded.date().isoformat() or not is_settled(day, now):
+        return
+    db = SessionLocal()
+    try:
+        db.add(FitbitResponseCache(
+            user_id=user_id, resource=resource, day=day, detail=detail,
+            payload=json.dumps(raw, separators=(",", ":")),
+            fetched_at=now.replace(tzinfo=None),
+        ))
+        db.commit()
+    except IntegrityError:
+        # Another worker cached the same day first.
+        db.rollback()
+    finally:
+        db.close()
+
+
+def prune(retention_days: Optional[int] = None) -> int:
+    """Delete responses fetched before the retention window. Returns rows deleted."""
+    days = CACHE_RETENTION_DAYS if retention_days is None else retention_days
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=days)
+    db = SessionLocal()
+    try:
+        deleted = db.query(FitbitResponseCache).filter(FitbitResponseCache.fetched_at < cutoff).delete()
+        db.commit()
+        return deleted
+    finally:
+        db.close()
@@ -2,11 +2,14 @@ import os, base64, urllib.parse, requests
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
+from http_client import client
+
 # Load environment variables from the .env file
 load_dotenv()
 
 AUTH_URL = "https://www.fitbit.com/oauth2/authorize"
-TOKEN_URL = "https://api.fitbit.com/oauth2/token"
+# FITBIT_API_BASE: same override as fitbit.sync.API (local stand-in servers)
+TOKEN_URL = os.getenv("FITBIT_API_BASE", "https://api.fitbit.com").rstrip("/") + "/oauth2/token"
 
 # Use os.getenv() so it doesn’t crash if .env isn’t loaded yet
 CLIENT_ID = os.getenv("FITBIT_CLIENT_ID")
@@ -45,10 +48,10 @@ def exchange_code_for_tokens(code: str):
         "redirect_uri": REDIRECT_URI,
         "code": code,
     }
-    r = requests.post(TOKEN_URL,
-                      headers={**_basic_auth_header(),
-                               "Content-Type": "application/x-www-form-urlencoded"},
-                      data=data, timeout=30)
+    r = client.post(TOKEN_URL,
+                    headers={**_basic_auth_header(),
+                             "Content-Type": "application/x-www-form-urlencoded"},
+                    data=data, timeout=30)
     r.raise_for_status()
     payload = r.json()
     payload["expires_at"] = (datetime.utcnow() + timedelta(seconds=payload["expires_in"])).isoformat()
@@ -60,7 +63,7 @@ def refresh_tokens(refresh_token: str):
         "refresh_token": refresh_token,
     }
     try:
-        r = requests.post(
+        r = client.post(
             TOKEN_URL,
             headers={**_basic_auth_header(),
                      "Content-Type": "application/x-www-form-urlencoded"},
@@ -0,0 +1,152 @@
+import os
+import time
+import random
+import threading
+from typing import Callable, Dict, Optional
+
+import requests
+
+import metrics
+
+# -------------------------------------------------------------------
+# Configuration
+# -------------------------------------------------------------------
+# Fitbit allows 150 requests/hour per user and reports the remaining budget
+# on every response (Fitbit-Rate-Limit-Remaining / Fitbit-Rate-Limit-Reset).
+#
+# FITBIT_RATE_RESERVE   calls kept in reserve per user (0 = use the whole quota)
+# FITBIT_RATE_MAX_WAIT  longest pause (s) we accept inside a sync before giving
+#                       the work back to the caller as RateLimitExceeded
+# FITBIT_RATE_RETRIES   how many times a 429 is retried after Retry-After
+# FITBIT_RATE_JITTER    upper bound (s) of the random jitter added to each wait
+
+RATE_RESERVE = max(0, int(os.getenv("FITBIT_RATE_RESERVE", "0")))
+RATE_MAX_WAIT = float(os.getenv("FITBIT_RATE_MAX_WAIT", "120"))
+RATE_RETRIES = max(0, int(os.getenv("FITBIT_RATE_RETRIES", "3")))
+RATE_JITTER = float(os.getenv("FITBIT_RATE_JITTER", "2"))
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a user's budget is spent and the reset is too far away."""
+
+    def __init__(self, key: str, retry_in: float):
+        super().__init__(f"Fitbit rate limit reached, retry in {retry_in:.0f}s")
+        self.key = key
+        self.retry_in = retry_in
+
+
+class _Budget:
+    __slots__ = ("remaining", "reset_at", "lock")
+
+    def __init__(self):
+        self.remaining: Optional[int] = None   # None = unknown, assume available
+        self.reset_at: float = 0.0             # time.monotonic() of the next reset
+        self.lock = threading.Lock()
+
+
+def _header_float(response: requests.Response, name: str) -> Optional[float]:
+    value = response.headers.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+class RateLimiter:
+    """
+    Per-user request budget driven by Fitbit's rate-limit headers.
+
+    Every call goes through request(key, send):
+      - before sending, the user's budget is checked; if it is spent we wait
+        for the reset (plus jitter) when that is short enough, otherwise we
+        raise RateLimitExceeded so the caller can requeue the user;
+      - after the response, the budget is updated from the headers;
+      - a 429 is retried after Retry-After (plus jitter), up to `retries` times.
+    """
+
+    def __init__(self, reserve: int = RATE_RESERVE, max_wait: float = RATE_MAX_WAIT,
+                 retries: int = RATE_RETRIES, jitter: float = RATE_JITTER):
+        self.reserve = reserve
+        self.max_wait = max_wait
+        self.retries = retries
+        self.jitter = jitter
+        self._budgets: Dict[str, _Budget] = {}
+        self._lock = threading.Lock()
+
+    def _budget(self, key: str) -> _Budget:
+        with self._lock:
+            budget = self._budgets.get(key)
+            if budget is None:
+                budget = self._budgets[key] = _Budget()
+            return budget
+
+    def remaining(self, key: str) -> Optional[int]:
+        """Last known remaining calls for `key` (None if unknown)."""
+        budget = self._budget(key)
+        if budget.remaining is not None and time.monotonic() >= budget.reset_at:
+            return None
+        return budget.remaining
+
+    def reset_in(self, key: str) -> float:
+        """Seconds until `key`'s budget resets (0 if unknown or already reset)."""
+        return max(0.0, self._budget(key).reset_at - time.monotonic())
+
+    def acquire(self, key: str) -> None:
+        """Take one call from the user's budget, waiting for the reset if needed."""
+        budget = self._budget(key)
+        with budget.lock:
+            now = time.monotonic()
+            if budget.remaining is not None and now >= budget.reset_at:
+                budget.remaining = None
+            if budget.remaining is not None and budget.remaining <= self.reserve:
+                wait = budget.reset_at - now
+                if wait > self.max_wait:
+                    raise RateLimitExceeded(key, wait)
+                time.sleep(wait + random.uniform(0, self.jitter))
+                budget.remaining = None
+            if budget.remaining is not None:
+                budget.remaining -= 1
+
+    def update(self, key: str, response: requests.Response) -> None:
+        """Refresh the user's budget from the rate-limit headers of `response`."""
+        remaining = _header_float(response, "Fitbit-Rate-Limit-Remaining")
+        reset = _header_float(response, "Fitbit-Rate-Limit-Reset")
+        if response.status_code == 429:
+            retry_after = _header_float(response, "Retry-After")
+            remaining = 0
+            reset = retry_after if retry_after is not None else reset
+            if reset is None:
+                reset = 60.0
+        if remaining is None:
+            return
+        metrics.FITBIT_RATE_REMAINING.observe(remaining)
+        budget = self._budget(key)
+        with budget.lock:
+            budget.remaining = int(remaining)
+            if reset is not None:
+                budget.reset_at = time.monotonic() + reset
+
+    def request(self, key: str, send: Callable[[], requests.Response]) -> requests.Response:
+        """Send a request within the user's budget, retrying 429s."""
+        for attempt in range(self.retries + 1):
+            try:
+                self.acquire(key)
+            except RateLimitExceeded:
+                metrics.FITBIT_RATE_LIMITED.inc(reason="budget")
+                raise
+            response = send()
+            self.update(key, response)
+            if response.status_code != 429:
+                return response
+            metrics.FITBIT_RATE_LIMITED.inc(reason="429")
+            if attempt < self.retries:
+                print(f"[FITBIT] 429 for {key}, backing off (attempt {attempt + 1}/{self.retries})")
+        budget = self._budget(key)
+        metrics.FITBIT_RATE_LIMITED.inc(reason="429_retries")
+        raise RateLimitExceeded(key, max(0.0, budget.reset_at - time.monotonic()))
+
+
+# Shared by every fetch in the process, so parallel workers see one budget per user.
+limiter = RateLimiter()
@@ -0,0 +1,306 @@
+import os
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import metrics
+from fitbit.resample import freq_seconds, resample_day
+from fitbit.series import Points, Series
+from fitbit.sync import API, _DETAIL_LEVELS, _get, _iter_intraday
+
+# -------------------------------------------------------------------
+# Metric registry
+#
+# Every measure synced to mindLAMP is declared once below: the Fitbit
+# source it is read from, how its value is extracted and reduced, and the
+# LAMP sensor / point field it is delivered as. The sync jobs only iterate
+# over the enabled specs, so a new measure is a new entry here.
+#
+# Metrics sharing a source share its requests: one intraday fetch per
+# window of a resource serves all of its metrics (at the finest detail
+# level any of them needs), and one range call serves every daily metric
+# of an endpoint. Fitbit has no multi-resource intraday endpoint, so that
+# is as far as requests can be merged.
+#
+# FITBIT_METRICS   metrics synced, comma-separated (names of SPECS); each
+#                  study enables what it needs. Metrics outside the default
+#                  set may need more OAuth scopes (SCOPES): oxygen_saturation
+#                  for spo2, heartrate for hrv / resting_heartrate.
+# FITBIT_<METRIC>_FREQ / FITBIT_<METRIC>_REDUCER
+#                  output bucket and reducer of an intraday metric
+#                  (FITBIT_STEPS_FREQ, FITBIT_HR_FREQ, FITBIT_CALORIES_FREQ...)
+# FITBIT_HR_APPROX_DETAIL
+#                  1 lets hourly heart rate be averaged from Fitbit's 15min
+#                  averages: the mean of 15min means is not the mean of the
+#                  minutes (buckets hold different numbers of readings), so
+#                  heart rate keeps the 1min detail level unless allowed.
+# -------------------------------------------------------------------
+
+FITBIT_METRICS = [n.strip() for n in os.getenv("FITBIT_METRICS", "steps,sleep,heartrate").split(",")
+                  if n.strip()]
+
+
+@dataclass(frozen=True)
+class Intraday:
+    """
+    A Fitbit intraday resource (/1/user/-/activities/{path}/date/...), one
+    request per window of at most 24 hours.
+
+    `coarse` says what a 5min/15min bucket holds ("sum" or "mean"), i.e.
+    which reducers can be computed from a coarse detail level. `dataset`
+    pulls the [{"time": "HH:MM:SS", "value": ...}] entries out of a
+    response when it is not shaped like activities-{path}-intraday.
+    """
+    path: str
+    coarse: str = "sum"
+    dataset: Optional[Callable[[Dict[str, Any]], List[Dict[str, Any]]]] = None
+
+
+@dataclass(frozen=True)
+class Daily:
+    """A Fitbit range endpoint: one request per `max_days` days, for every metric read from it."""
+    name: str                                  # endpoint label in the metrics
+    url: Callable[[str, str], str]             # (first day, last day) → path under API
+    max_days: int
+
+
+@dataclass(frozen=True)
+class MetricSpec:
+    """
+    One measure synced to mindLAMP.
+
+    name        FITBIT_METRICS entry, LAMP sensor and watermark key
+    field       key of the value in the LAMP points
+    source      Intraday resource or Daily endpoint it is read from
+    collection  subscription collection whose notifications resync it
+    value       intraday: entry → number (default entry["value"]);
+                daily: response → {YYYY-MM-DD: number}
+    freq        intraday output bucket (daily metrics: one point per day)
+    reducer     intraday bucket reducer: sum, mean, min, max or count
+    approx      intraday: allow a mean from coarse-bucket means (approximate)
+    """
+    name: str
+    field: str
+    source: Union[Intraday, Daily]
+    collection: str
+    value: Optional[Callable] = None
+    freq: str = "1d"
+    reducer: str = "sum"
+    approx: bool = False
+
+    @property
+    def daily(self) -> bool:
+        return isinstance(self.source, Daily)
+
+    def detail(self) -> str:
+        """
+        Coarsest Fitbit detail level this metric can be computed from.
+
+        A level qualifies when its buckets tile the output bucket exactly,
+        and the reducer can be rebuilt from what a coarse bucket holds
+        (sums of sums; means of means only with `approx`). Otherwise the
+        native 1min data is needed.
+        """
+        coarse = self.source.coarse
+        decomposable = ((coarse == "sum" and self.reducer == "sum")
+                        or (coarse == "mean" and self.approx and self.reducer == "mean"))
+        minutes = freq_seconds(self.freq) // 60
+        if minutes == 0 or not decomposable:
+            return "1min"
+        for level, size in _DETAIL_LEVELS:
+            if minutes % size == 0:
+                return level
+        return "1min"
+
+
+# -------------------------------------------------------------------
+# Sources
+# -------------------------------------------------------------------
+
+def _azm_dataset(raw: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Active zone minutes come per day as {"minute": "YYYY-MM-DDTHH:MM:SS", "value": {...}}."""
+    return [
+        {"time": m["minute"][11:19], "value": m.get("value", {}).get("activeZoneMinutes", 0)}
+        for day in raw.get("activities-active-zone-minutes-intraday", [])
+        for m in day.get("minutes", [])
+    ]
+
+
+STEPS = Intraday("steps")
+HEART = Intraday("heart", coarse="mean")
+CALORIES = Intraday("calories")
+DISTANCE = Intraday("distance")
+ACTIVE_ZONE_MINUTES = Intraday("active-zone-minutes", dataset=_azm_dataset)
+
+SLEEP_LOG = Daily("sleep", lambda a, b: f"/1.2/user/-/sleep/date/{a}/{b}.json", 100)
+HEART_DAILY = Daily("heart_daily", lambda a, b: f"/1/user/-/activities/heart/date/{a}/{b}.json", 365)
+HRV_DAILY = Daily("hrv", lambda a, b: f"/1/user/-/hrv/date/{a}/{b}.json", 30)
+SPO2_DAILY = Daily("spo2", lambda a, b: f"/1/user/-/spo2/date/{a}/{b}.json", 30)
+
+
+def _sleep_minutes(raw: Dict[str, Any]) -> Dict[str, float]:
+    """Total sleep duration (minutes) per dateOfSleep in a sleep log response."""
+    by_day: Dict[str, int] = {}
+    for entry in raw.get("sleep", []):
+        d = entry.get("dateOfSleep")
+        if d:
+            by_day[d] = by_day.get(d, 0) + int(entry.get("duration", 0))  # ms
+    return {d: ms / 1000 / 60 for d, ms in by_day.items()}
+
+
+def _sleep_efficiency(raw: Dict[str, Any]) -> Dict[str, float]:
+    return {e["dateOfSleep"]: e["efficiency"] for e in raw.get("sleep", [])
+            if e.get("isMainSleep") and e.get("efficiency") is not None}
+
+
+def _resting_heartrate(raw: Dict[str, Any]) -> Dict[str, float]:
+    return {e["dateTime"]: e["value"]["restingHeartRate"] for e in raw.get("activities-heart", [])
+            if e.get("value", {}).get("restingHeartRate") is not None}
+
+
+def _hrv(raw: Dict[str, Any]) -> Dict[str, float]:
+    return {e["dateTime"]: e["value"]["dailyRmssd"] for e in raw.get("hrv", [])
+            if e.get("value", {}).get("dailyRmssd") is not None}
+
+
+def _spo2(raw: Any) -> Dict[str, float]:
+    # A single day comes back as an object, a range as a list
+    entries = raw if isinstance(raw, list) else [raw]
+    return {e["dateTime"]: e["value"]["avg"] for e in entries
+            if isinstance(e.get("value"), dict) and e["value"].get("avg") is not None}
+
+
+# -------------------------------------------------------------------
+# Registry
+# -------------------------------------------------------------------
+
+SPECS: Dict[str, MetricSpec] = {s.name: s for s in (
+    # Default set (the original three sensors)
+    MetricSpec("steps", "steps", STEPS, "activities",
+               freq=os.getenv("FITBIT_STEPS_FREQ", "1h"), reducer=os.getenv("FITBIT_STEPS_REDUCER", "sum")),
+    MetricSpec("sleep", "duration_minutes", SLEEP_LOG, "sleep", _sleep_minutes),
+    MetricSpec("heartrate", "heartrate", HEART, "activities",
+               freq=os.getenv("FITBIT_HR_FREQ", "1h"), reducer=os.getenv("FITBIT_HR_REDUCER", "mean"),
+               approx=os.getenv("FITBIT_HR_APPROX_DETAIL", "0") == "1"),
+    # Opt-in
+    MetricSpec("calories", "calories", CALORIES, "activities",
+               freq=os.getenv("FITBIT_CALORIES_FREQ", "1h"),
+               reducer=os.getenv("FITBIT_CALORIES_REDUCER", "sum")),
+    MetricSpec("distance", "distance_km", DISTANCE, "activities",
+               freq=os.getenv("FITBIT_DISTANCE_FREQ", "1h"),
+               reducer=os.getenv("FITBIT_DISTANCE_REDUCER", "sum")),
+    MetricSpec("active_zone_minutes", "active_zone_minutes", ACTIVE_ZONE_MINUTES, "activities",
+               freq=os.getenv("FITBIT_ACTIVE_ZONE_MINUTES_FREQ", "1h"),
+               reducer=os.getenv("FITBIT_ACTIVE_ZONE_MINUTES_REDUCER", "sum")),
+    MetricSpec("sleep_efficiency", "efficiency", SLEEP_LOG, "sleep", _sleep_efficiency),
+    MetricSpec("resting_heartrate", "resting_heartrate", HEART_DAILY, "activities", _resting_heartrate),
+    MetricSpec("hrv", "rmssd", HRV_DAILY, "sleep", _hrv),
+    MetricSpec("spo2", "spo2", SPO2_DAILY, "sleep", _spo2),
+)}
+
+
+def select(names: Iterable[str]) -> List[MetricSpec]:
+    """Specs for `names`, in that order; unknown names raise ValueError."""
+    unknown = [n for n in names if n not in SPECS]
+    if unknown:
+        raise ValueError(f"Unknown Fitbit metric(s) {', '.join(unknown)}; "
+                         f"available: {', '.join(SPECS)}")
+    return [SPECS[n] for n in dict.fromkeys(names)]
+
+
+# Fail at startup on a typo in FITBIT_METRICS rather than in the middle of a sync.
+ENABLED = select(FITBIT_METRICS)
+
+
+def by_collection(specs: Iterable[MetricSpec] = ENABLED) -> Dict[str, Tuple[str, ...]]:
+    """Subscription collection → names of the metrics it resyncs."""
+    out: Dict[str, Tuple[str, ...]] = {}
+    for s in specs:
+        out[s.collection] = out.get(s.collection, ()) + (s.name,)
+    return out
+
+
+def groups(specs: Iterable[MetricSpec]) -> List[List[MetricSpec]]:
+    """Specs grouped by source (one fetch each), in order of first appearance."""
+    by_source: Dict[Any, List[MetricSpec]] = {}
+    for s in specs:
+        by_source.setdefault(s.source, []).append(s)
+    return list(by_source.values())
+
+
+# -------------------------------------------------------------------
+# Engine: one fetch per source → per-metric points
+# -------------------------------------------------------------------
+
+def iter_group(specs: Sequence[MetricSpec], access_token: str, starts: Dict[str, datetime],
+               end: datetime, user_id: Optional[str] = None,
+               uploaded: Optional[datetime] = None) -> Iterator[Dict[str, Points]]:
+    """
+    Fetch the source shared by `specs` once over [min(starts), end] (user
+    local time, minute precision) and yield {metric name: points} chunks:
+    one per calendar day for intraday metrics (Series), a single one for
+    daily metrics (UTC midnight of each day, like sleep always had).
+
+    Each metric only gets the points from its own start on, so metrics of
+    one group may have different watermarks. `uploaded` (the tracker's
+    last upload) bounds the intraday days that may be cached.
+    """
+    if not specs:
+        return iter(())
+    if specs[0].daily:
+        return _iter_daily(specs, access_token, starts, end, user_id)
+    return _iter_intraday_group(specs, access_token, starts, end, user_id, uploaded)
+
+
+def _iter_intraday_group(specs: Sequence[MetricSpec], access_token: str, starts: Dict[str, datetime],
+                         end: datetime, user_id: Optional[str],
+                         uploaded: Optional[datetime]) -> Iterator[Dict[str, Points]]:
+    source: Intraday = specs[0].source
+    buckets = {s.name: freq_seconds(s.freq) * 1000 for s in specs}  # fail fast on a bad freq
+    sizes = dict(_DETAIL_LEVELS)
+    detail = min((s.detail() for s in specs), key=lambda level: sizes.get(level, 1))
+    start = min(starts[s.name] for s in specs)
+    start_ms = {s.name: int(starts[s.name].timestamp() * 1000) for s in specs}
+
+    for day, dataset in _iter_intraday(source.path, access_token, f"{start:%Y-%m-%dT%H:%M}",
+                                       f"{end:%Y-%m-%dT%H:%M}", detail, user_id, source.dataset,
+                                       uploaded):
+        chunk: Dict[str, Points] = {}
+        with metrics.STAGE_SECONDS.time(stage="resample"):
+            for s in specs:
+                series = resample_day(day, dataset, s.freq, s.reducer, s.field, s.value)
+                if starts[s.name] > start:
+                    # Keep the buckets that end after this metric's start
+                    series = series[series.timestamps + buckets[s.name] > start_ms[s.name]]
+                chunk[s.name] = series
+        yield chunk
+
+
+def _daily_points(field: str, by_day: Dict[str, float], since: date) -> List[Dict[str, Any]]:
+    """One point per day from `since` on, timestamped at UTC midnight of the day."""
+    points = []
+    for d, value in sorted(by_day.items()):
+        try:
+            day = date.fromisoformat(d)
+        except ValueError as e:
+            print(f"[WARN] Failed to parse {field} entry {d}: {e}")
+            continue
+        if day >= since:
+            ts = int(datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp() * 1000)
+            points.append({"timestamp": ts, field: value})
+    return points
+
+
+def _iter_daily(specs: Sequence[MetricSpec], access_token: str, starts: Dict[str, datetime],
+                end: datetime, user_id: Optional[str]) -> Iterator[Dict[str, Points]]:
+    source: Daily = specs[0].source
+    values: Dict[str, Dict[str, float]] = {s.name: {} for s in specs}
+    first, last = min(starts[s.name] for s in specs).date(), end.date()
+    while first <= last:
+        until = min(first + timedelta(days=source.max_days - 1), last)
+        raw = _get(API + source.url(first.isoformat(), until.isoformat()), access_token, user_id,
+                   source.name)
+        for s in specs:
+            values[s.name].update(s.value(raw))
+        first = until + timedelta(days=1)
+    yield {s.name: _daily_points(s.field, values[s.name], starts[s.name].date()) for s in specs}
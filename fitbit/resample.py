@@ -0,0 +1,141 @@
+import re
+from datetime import date, datetime, time as dtime, timedelta
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from fitbit.series import Series
+
+# -------------------------------------------------------------------
+# Frequencies
+# -------------------------------------------------------------------
+
+_FREQ_RE = re.compile(r"^(\d+)(min|h|d)$")
+_UNIT_SECONDS = {"min": 60, "h": 3600, "d": 86400}
+
+REDUCERS = ("sum", "mean", "min", "max", "count")
+
+
+def freq_seconds(freq: str) -> int:
+    """Bucket size of an output frequency ("1min", "5min", "15min", "1h", "1d", ...)."""
+    m = _FREQ_RE.match(freq)
+    if not m:
+        raise ValueError(f"Unsupported frequency: {freq!r}")
+    seconds = int(m.group(1)) * _UNIT_SECONDS[m.group(2)]
+    if seconds <= 0 or 86400 % seconds:
+        raise ValueError(f"Frequency {freq!r} must divide a day evenly")
+    return seconds
+
+
+# -------------------------------------------------------------------
+# Parsing
+# -------------------------------------------------------------------
+
+_HOUR_MS = 3600 * 1000
+
+
+def local_epoch_ms(day: str, wall_ms: np.ndarray) -> np.ndarray:
+    """
+    Epoch ms of wall-clock times of `day` (ms since local midnight), i.e.
+    datetime(day + wall).timestamp() point by point: naive → local, the
+    convention of the original per-datetime code.
+
+    The UTC offset is looked up once per distinct hour rather than taken
+    from midnight, so days with a DST transition convert like any other.
+    """
+    hours = wall_ms // _HOUR_MS
+    keys, inverse = np.unique(hours, return_inverse=True)
+    midnight = datetime.combine(date.fromisoformat(day), dtime())
+    hour_ms = np.array([int((midnight + timedelta(hours=int(h))).timestamp() * 1000) for h in keys],
+                       dtype=np.int64)
+    return hour_ms[inverse.reshape(-1)] + (wall_ms - hours * _HOUR_MS)
+
+
+def local_datetime(ts_ms: int) -> datetime:
+    """Naive local wall-clock time of an epoch-ms timestamp (inverse of local_epoch_ms)."""
+    return datetime.fromtimestamp(ts_ms / 1000)
+
+
+def _wall_arrays(dataset: List[Dict[str, Any]], value=None) -> Tuple[np.ndarray, np.ndarray]:
+    """(ms since local midnight, values) of one day's dataset."""
+    n = len(dataset)
+    if n == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    seconds = np.fromiter(
+        (int(e["time"][0:2]) * 3600 + int(e["time"][3:5]) * 60 + int(e["time"][6:8]) for e in dataset),
+        dtype=np.int64, count=n,
+    )
+    get = value or (lambda e: e["value"])
+    values = np.fromiter((get(e) for e in dataset), dtype=np.float64, count=n)
+    return seconds * 1000, values
+
+
+def dataset_to_arrays(day: str, dataset: List[Dict[str, Any]],
+                      value=None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Turn one day's Fitbit intraday dataset into (epoch_ms, values) arrays.
+
+    Times are "HH:MM:SS" strings relative to `day`; they are converted by
+    slicing instead of strptime. `value` optionally extracts the number from
+    an entry (defaults to entry["value"]).
+    """
+    wall_ms, values = _wall_arrays(dataset, value)
+    return local_epoch_ms(day, wall_ms), values
+
+
+# -------------------------------------------------------------------
+# Resampling
+# -------------------------------------------------------------------
+
+def resample(ts_ms: np.ndarray, values: np.ndarray, origin_ms: int, bucket_s: int,
+             reducer: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Group (ts_ms, values) into buckets of bucket_s seconds aligned on origin_ms
+    and reduce each bucket with `reducer` (sum, mean, min, max, count).
+
+    Returns (bucket_start_ms, reduced) sorted by bucket; empty buckets are omitted.
+    """
+    if reducer not in REDUCERS:
+        raise ValueError(f"Unsupported reducer: {reducer!r}")
+    if ts_ms.size == 0:
+        return ts_ms, values
+
+    bucket_ms = bucket_s * 1000
+    idx = (ts_ms - origin_ms) // bucket_ms
+    keys, inverse = np.unique(idx, return_inverse=True)
+    starts = origin_ms + keys * bucket_ms
+
+    if reducer in ("sum", "mean", "count"):
+        counts = np.bincount(inverse, minlength=keys.size)
+        if reducer == "count":
+            return starts, counts.astype(np.float64)
+        sums = np.bincount(inverse, weights=values, minlength=keys.size)
+        return starts, (sums if reducer == "sum" else sums / counts)
+
+    out = np.full(keys.size, np.inf if reducer == "min" else -np.inf)
+    (np.minimum if reducer == "min" else np.maximum).at(out, inverse, values)
+    return starts, out
+
+
+def resample_day(day: str, dataset: List[Dict[str, Any]], freq: str, reducer: str,
+                 field: str, value=None) -> Series:
+    """
+    Resample one day's intraday dataset to `freq` with `reducer` and return
+    it as a Series (LAMP points [{"timestamp": ms, field: value}, ...] once
+    serialized).
+
+    Integral results (sums, counts, min/max of integers) are emitted as int,
+    means as float, matching the values Fitbit sends.
+    """
+    # Buckets are cut on the wall clock (like the original floor-to-hour),
+    # then their starts converted to epoch ms.
+    wall_ms, values = _wall_arrays(dataset, value)
+    if wall_ms.size == 0:
+        return Series.empty(field)
+    starts, reduced = resample(wall_ms, values, 0, freq_seconds(freq), reducer)
+    starts = local_epoch_ms(day, starts)
+
+    # A mean over single-reading buckets is the reading itself (e.g. 1min HR).
+    whole = bool(np.all(values == np.floor(values)))
+    integral = reducer == "count" or (whole and (reducer != "mean" or starts.size == wall_ms.size))
+    return Series(field, starts, reduced, integral)
@@ -0,0 +1,138 @@
+import os
+import hmac
+import base64
+import hashlib
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import metrics
+from db import SessionLocal, FitbitSubscription
+from http_client import client
+from fitbit.oauth import CLIENT_SECRET
+from fitbit.ratelimit import limiter
+from fitbit.sync import API, _auth
+
+# -------------------------------------------------------------------
+# Configuration
+# -------------------------------------------------------------------
+# FITBIT_SUBSCRIPTIONS             1 creates subscriptions at OAuth callback time
+# FITBIT_SUBSCRIBER_ID             subscriber id from the Fitbit developer console
+# FITBIT_SUBSCRIBER_VERIFY_CODE    verification code shown for that subscriber
+# FITBIT_SUBSCRIPTION_COLLECTIONS  collections subscribed for each user
+
+SUBSCRIPTIONS_ENABLED = os.getenv("FITBIT_SUBSCRIPTIONS", "0") == "1"
+SUBSCRIBER_ID = os.getenv("FITBIT_SUBSCRIBER_ID", "")
+SUBSCRIBER_VERIFY_CODE = os.getenv("FITBIT_SUBSCRIBER_VERIFY_CODE", "")
+SUBSCRIPTION_COLLECTIONS = [
+    c.strip() for c in os.getenv("FITBIT_SUBSCRIPTION_COLLECTIONS", "activities,sleep").split(",")
+    if c.strip()
+]
+
+
+# -------------------------------------------------------------------
+# Subscription management
+# -------------------------------------------------------------------
+
+def create_subscription(access_token: str, collection: str, subscription_id: str,
+                        user_id: Optional[str] = None) -> bool:
+    """
+    Subscribe to one collection of the token's user. Returns True when the
+    subscription exists afterwards (created, or already there: 200/201/409).
+    """
+    url = f"{API}/1/user/-/{collection}/apiSubscriptions/{subscription_id}.json"
+    headers = _auth(access_token)
+    if SUBSCRIBER_ID:
+        headers["X-Fitbit-Subscriber-Id"] = SUBSCRIBER_ID
+
+    def _send():
+        with metrics.FITBIT_LATENCY.time(endpoint="subscriptions"):
+            r = client.post(url, headers=headers)
+        metrics.FITBIT_REQUESTS.inc(endpoint="subscriptions", status=str(r.status_code))
+        return r
+
+    r = limiter.request(user_id or access_token, _send)
+    if r.status_code in (200, 201, 409):
+        return True
+    r.raise_for_status()
+    return False
+
+
+def subscription_id(user_id: str, collection: str) -> str:
+    """
+    Stable id of a (user, collection) subscription. Fitbit caps ids at 50
+    characters and user ids are up to 128, so the id is a hash; the
+    fitbit_subscriptions table maps it back.
+    """
+    return hashlib.sha1(f"{user_id}\0{collection}".encode()).hexdigest()[:32]
+
+
+def subscribe_user(access_token: str, user_id: str) -> List[str]:
+    """Subscribe `user_id` to every configured collection; returns the ones that succeeded."""
+    done = []
+    for collection in SUBSCRIPTION_COLLECTIONS:
+        # One id per (user, collection): Fitbit echoes it back in notifications.
+        sid = subscription_id(user_id, collection)
+        if create_subscription(access_token, collection, sid, user_id):
+            _record_subscription(sid, user_id, collection)
+            done.append(collection)
+    return done
+
+
+def _record_subscription(sid: str, user_id: str, collection: str) -> None:
+    db = SessionLocal()
+    try:
+        db.merge(FitbitSubscription(subscription_id=sid, user_id=user_id, collection=collection,
+                                    created_at=datetime.now(timezone.utc).replace(tzinfo=None)))
+        db.commit()
+    finally:
+        db.close()
+
+
+def subscribed_users(subscription_ids: List[str]) -> Dict[str, str]:
+    """subscriptionId → user_id for the ids we created (others are left out)."""
+    if not subscription_ids:
+        return {}
+    db = SessionLocal()
+    try:
+        return dict(
+            db.query(FitbitSubscription.subscription_id, FitbitSubscription.user_id)
+            .filter(FitbitSubscription.subscription_id.in_(subscription_ids))
+            .all()
+        )
+    finally:
+        db.close()
+
+
+# -------------------------------------------------------------------
+# Notifications
+# -------------------------------------------------------------------
+
+def verify_signature(body: bytes, signature: Optional[str]) -> bool:
+    """
+    Check the X-Fitbit-Signature header: base64(HMAC-SHA1(body)) keyed with
+    "<client secret>&".
+    """
+    if not signature:
+        return False
+    key = f"{CLIENT_SECRET}&".encode()
+    expected = base64.b64encode(hmac.new(key, body, hashlib.sha1).digest()).decode()
+    return hmac.compare_digest(expected, signature)
+
+
+def parse_notifications(payload: Any) -> List[Dict[str, str]]:
+    """
+    Keep the fields we act on from a notification body:
+    [{"ownerId", "collectionType", "date", "subscriptionId"}, ...], the
+    subscriptionId possibly empty. Malformed entries are dropped.
+    """
+    if not isinstance(payload, list):
+        return []
+    out = []
+    for n in payload:
+        if not isinstance(n, dict):
+            continue
+        owner, collection, day = n.get("ownerId"), n.get("collectionType"), n.get("date")
+        if owner and collection and day:
+            out.append({"ownerId": owner, "collectionType": collection, "date": day,
+                        "subscriptionId": str(n.get("subscriptionId") or "")})
+    return out
@@ -1,8 +1,20 @@
-import requests
+import os
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import List, Dict, Any
+from itertools import islice
+from typing import List, Dict, Any, Callable, Deque, Iterator, Optional, Tuple
 
-API = "https://api.fitbit.com"
+import metrics
+from http_client import client
+from fitbit import cache
+from fitbit.ratelimit import limiter
+
+# FITBIT_API_BASE points the client at another server (e.g. bench/mock_servers.py).
+API = os.getenv("FITBIT_API_BASE", "https://api.fitbit.com").rstrip("/")
+
+# Intraday windows fetched in parallel (and ahead of the consumer) for one user.
+FETCH_CONCURRENCY = max(1, int(os.getenv("FITBIT_FETCH_CONCURRENCY", "4")))
 
 # -------------------------------------------------------------------
 # Auth header
@@ -13,184 +25,222 @@ def _auth(access_token: str) -> Dict[str, str]:
     return {"Authorization": f"Bearer {access_token}"}
 
 
-# -------------------------------------------------------------------
-# Profile
-# -------------------------------------------------------------------
+def _get(url: str, access_token: str, user_id: Optional[str] = None,
+         endpoint: str = "other") -> Any:
+    """
+    GET a Fitbit API URL within the user's rate-limit budget and return the JSON.
 
-def get_profile(access_token: str) -> Dict[str, Any]:
-    """Get the Fitbit user profile."""
-    url = f"{API}/1/user/-/profile.json"
-    r = requests.get(url, headers=_auth(access_token), timeout=30)
+    The budget is keyed by user_id when given (falls back to the token).
+    Raises fitbit.ratelimit.RateLimitExceeded when the user's quota is spent
+    and the reset is too far away to wait for. `endpoint` labels the call in
+    the metrics (counts, latency, JSON parsing time).
+    """
+    def _send():
+        with metrics.FITBIT_LATENCY.time(endpoint=endpoint):
+            r = client.get(url, headers=_auth(access_token))
+        metrics.FITBIT_REQUESTS.inc(endpoint=endpoint, status=str(r.status_code))
+        return r
+
+    r = limiter.request(user_id or access_token, _send)
     r.raise_for_status()
-    return r.json()
+    with metrics.STAGE_SECONDS.time(stage="parse"):
+        return r.json()
 
 
 # -------------------------------------------------------------------
-# Helpers
+# Profile
 # -------------------------------------------------------------------
 
-def _combine_datetime(ymd: str, time_str: str) -> datetime:
-    """Combine a YYYY-MM-DD date string and HH:MM:SS time string into a datetime."""
-    d = datetime.strptime(ymd, "%Y-%m-%d").date()
-    t = datetime.strptime(time_str, "%H:%M:%S").time()
-    return datetime.combine(d, t)
-
-def _floor_to_hour(dt: datetime) -> datetime:
-    """Floor a datetime to the start of the hour."""
-    return dt.replace(minute=0, second=0, microsecond=0)
+def get_profile(access_token: str, user_id: Optional[str] = None) -> Dict[str, Any]:
+    """Get the Fitbit user profile."""
+    url = f"{API}/1/user/-/profile.json"
+    return _get(url, access_token, user_id, "profile")
 
 
 # -------------------------------------------------------------------
-# SLEEP  (daily only — Fitbit does not support intraday sleep duration
-#         in a straightforward way, so we work with daily totals)
+# Devices
 # -------------------------------------------------------------------
 
-def get_sleep(access_token: str, start_ymd: str, end_ymd: str, freq: str) -> List[Dict[str, Any]]:
-    """
-    Sleep duration per day between start_ymd and end_ymd (inclusive).
+def get_devices(access_token: str, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Get the user's paired devices (type, battery, lastSyncTime...)."""
+    url = f"{API}/1/user/-/devices.json"
+    return _get(url, access_token, user_id, "devices")
 
-    freq is ignored for sleep because Fitbit only supports daily sleep duration.
 
-    Returns:
-        [
-          {"date": "2025-11-10", "duration_minutes": 421.0},
-          ...
-        ]
+def last_upload(devices: List[Dict[str, Any]]) -> Optional[datetime]:
     """
-    url = f"{API}/1.2/user/-/sleep/date/{start_ymd}/{end_ymd}.json"
-    r = requests.get(url, headers=_auth(access_token), timeout=30)
-    r.raise_for_status()
-    raw = r.json()
-
-    by_day: Dict[str, int] = {}
+    Most recent lastSyncTime over the user's devices (naive, user local
+    time like the intraday data), or None when no device reports one.
+    """
+    times = []
+    for d in devices or []:
+        value = d.get("lastSyncTime")
+        if value:
+            # "2024-05-01T13:29:17.000" → drop the milliseconds
+            times.append(datetime.fromisoformat(value[:19]))
+    return max(times, default=None)
 
-    for entry in raw.get("sleep", []):
-        d = entry.get("dateOfSleep")
-        dur = entry.get("duration", 0)  # ms
-        if d:
-            by_day[d] = by_day.get(d, 0) + int(dur)
 
-    results: List[Dict[str, Any]] = []
-    for d, ms in sorted(by_day.items()):
-        results.append({
-            "date": d,
-            "duration_minutes": ms / 1000 / 60,  # convert ms → minutes
-        })
+# -------------------------------------------------------------------
+# Intraday range planning
+#
+# Fitbit serves intraday data for at most 24 hours per request, either as a
+# whole day (/date/{day}/1d/{detail}.json) or as a time window that may
+# cross midnight (/date/{d1}/{d2}/{detail}/time/{HH:MM}/{HH:MM}.json).
+# A range [start, end] is cut into as few such windows as possible, the
+# windows are fetched concurrently, and each response is split back into
+# per-day datasets. Whole days before the tracker's last upload go through
+# the raw response cache (fitbit/cache.py) when the caller passes a user_id
+# and that upload.
+# -------------------------------------------------------------------
 
-    return results
+_DAY_MINUTES = 24 * 60
 
+# Fitbit intraday detail levels, coarsest first, with their size in minutes.
+_DETAIL_LEVELS = (("15min", 15), ("5min", 5), ("1min", 1))
 
-# -------------------------------------------------------------------
-# STEPS (intraday 1-minute → aggregated depending on freq)
-# -------------------------------------------------------------------
 
-def get_steps(access_token: str, start_ymd: str, end_ymd: str, freq: str) -> List[Dict[str, Any]]:
+def _parse_bound(value: str, is_end: bool) -> datetime:
     """
-    Get steps between start_ymd and end_ymd.
+    Parse a range bound: "YYYY-MM-DD" (whole day) or "YYYY-MM-DDTHH:MM".
+    A bare end date means the end of that day (23:59).
+    """
+    if "T" in value:
+        return datetime.strptime(value[:16], "%Y-%m-%dT%H:%M")
+    d = datetime.strptime(value, "%Y-%m-%d")
+    return d.replace(hour=23, minute=59) if is_end else d
 
-    freq: "1min" or "1h"
 
-    Returns:
-        - "1min" → [{"timestamp": ..., "steps": value}, ...]
-        - "1h"   → [{"timestamp": ..., "steps": sum_per_hour}, ...]
+def _intraday_windows(start: datetime, end: datetime) -> List[Tuple[datetime, datetime]]:
     """
-    all_points: List[Dict[str, Any]] = []
-    current = datetime.strptime(start_ymd, "%Y-%m-%d").date()
-    end = datetime.strptime(end_ymd, "%Y-%m-%d").date()
+    Cut [start, end] (minute precision, inclusive) into windows of at most
+    24 hours.
 
+    A range that fits in 24 hours is one window, even across midnight.
+    Longer ranges are cut on day boundaries so that every full day is its
+    own window (and can be served from the response cache).
+    """
+    if end - start < timedelta(minutes=_DAY_MINUTES):
+        return [(start, end)] if start <= end else []
+    windows: List[Tuple[datetime, datetime]] = []
+    current = start
     while current <= end:
-        day = current.isoformat()
-        url = f"{API}/1/user/-/activities/steps/date/{day}/1d/1min.json"
-        r = requests.get(url, headers=_auth(access_token), timeout=30)
-        r.raise_for_status()
-        raw = r.json()
-
-        dataset = raw.get("activities-steps-intraday", {}).get("dataset", [])
-
-        if freq == "1min":
-            for entry in dataset:
-                dt = _combine_datetime(day, entry["time"])
-                ts = int(dt.timestamp() * 1000)
-                all_points.append({
-                    "timestamp": ts,
-                    "steps": entry["value"],
-                })
-
-        elif freq == "1h":
-            hourly: Dict[datetime, int] = {}
-            for entry in dataset:
-                dt = _combine_datetime(day, entry["time"])
-                h = _floor_to_hour(dt)
-                hourly[h] = hourly.get(h, 0) + entry["value"]
-
-            for hdt, total in sorted(hourly.items()):
-                ts = int(hdt.timestamp() * 1000)
-                all_points.append({
-                    "timestamp": ts,
-                    "steps": total,
-                })
-
-        current += timedelta(days=1)
-
-    return all_points
+        day_end = current.replace(hour=23, minute=59)
+        w_end = min(end, day_end)
+        windows.append((current, w_end))
+        current = w_end + timedelta(minutes=1)
+    return windows
 
 
-# -------------------------------------------------------------------
-# HEART RATE (intraday 1-minute → aggregated depending on freq)
-# -------------------------------------------------------------------
+def _is_whole_day(w_start: datetime, w_end: datetime) -> bool:
+    return (w_start.date() == w_end.date()
+            and (w_start.hour, w_start.minute) == (0, 0)
+            and (w_end.hour, w_end.minute) == (23, 59))
 
-def get_heartrate(access_token: str, start_ymd: str, end_ymd: str, freq: str) -> List[Dict[str, Any]]:
-    """
-    Get heart rate between start_ymd and end_ymd.
-
-    freq: "1min" or "1h"
 
-    Returns:
-        - "1min" → [{"timestamp": ..., "heartrate": bpm}, ...]
-        - "1h"   → [{"timestamp": ..., "heartrate": avg_bpm_for_hour}, ...]
-    """
-    all_points: List[Dict[str, Any]] = []
-    current = datetime.strptime(start_ymd, "%Y-%m-%d").date()
-    end = datetime.strptime(end_ymd, "%Y-%m-%d").date()
+def _window_url(resource: str, w_start: datetime, w_end: datetime, detail: str) -> str:
+    """Build the intraday URL for one window (whole-day form when possible)."""
+    d1 = w_start.date().isoformat()
+    base = f"{API}/1/user/-/activities/{resource}/date"
+    if w_start.date() == w_end.date():
+        if _is_whole_day(w_start, w_end):
+            return f"{base}/{d1}/1d/{detail}.json"
+        return f"{base}/{d1}/1d/{detail}/time/{w_start:%H:%M}/{w_end:%H:%M}.json"
+    d2 = w_end.date().isoformat()
+    return f"{base}/{d1}/{d2}/{detail}/time/{w_start:%H:%M}/{w_end:%H:%M}.json"
 
-    while current <= end:
-        day = current.isoformat()
-        url = f"{API}/1/user/-/activities/heart/date/{day}/1d/1min.json"
-        r = requests.get(url, headers=_auth(access_token), timeout=30)
-        r.raise_for_status()
-        raw = r.json()
-
-        dataset = raw.get("activities-heart-intraday", {}).get("dataset", [])
-
-        if freq == "1min":
-            for entry in dataset:
-                dt = _combine_datetime(day, entry["time"])
-                ts = int(dt.timestamp() * 1000)
-                all_points.append({
-                    "timestamp": ts,
-                    "heartrate": entry["value"],
-                })
-
-        elif freq == "1h":
-            sums: Dict[datetime, int] = {}
-            counts: Dict[datetime, int] = {}
-
-            for entry in dataset:
-                dt = _combine_datetime(day, entry["time"])
-                h = _floor_to_hour(dt)
-                sums[h] = sums.get(h, 0) + entry["value"]
-                counts[h] = counts.get(h, 0) + 1
-
-            for hdt in sorted(sums.keys()):
-                avg = sums[hdt] / counts[hdt]
-                ts = int(hdt.timestamp() * 1000)
-                all_points.append({
-                    "timestamp": ts,
-                    "heartrate": avg,
-                })
-
-        current += timedelta(days=1)
-
-    return all_points
 
+def _split_window(dataset: List[Dict[str, Any]], w_start: datetime,
+                  w_end: datetime) -> List[Tuple[str, List[Dict[str, Any]]]]:
+    """
+    Split one window's dataset into (day, entries) pieces.
 
+    Windows are shorter than 24h, so when one crosses midnight every entry
+    at or after the start time belongs to the first day and every entry
+    before it belongs to the second day.
+    """
+    d1 = w_start.date().isoformat()
+    if w_start.date() == w_end.date():
+        return [(d1, dataset)]
+    cut = f"{w_start:%H:%M}"
+    first = [e for e in dataset if e["time"][:5] >= cut]
+    second = [e for e in dataset if e["time"][:5] < cut]
+    return [(d1, first), (w_end.date().isoformat(), second)]
+
+
+def _iter_intraday(resource: str, access_token: str, start: str, end: str,
+                   detail: str, user_id: Optional[str] = None,
+                   dataset: Optional[Callable[[Dict[str, Any]], List[Dict[str, Any]]]] = None,
+                   uploaded: Optional[datetime] = None,
+                   ) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+    """
+    Stream the intraday dataset of `resource` ("steps", "heart") over
+    [start, end] as chronological (YYYY-MM-DD, dataset) pairs, one per
+    calendar day.
+
+    `dataset` pulls the [{"time": "HH:MM:SS", ...}] entries out of a
+    response, for resources not shaped like activities-{resource}-intraday.
+    `uploaded` is the tracker's last upload (user local time): days from
+    its date on may still be zero-filled, so they are neither read from
+    nor stored in the cache.
+
+    Up to FETCH_CONCURRENCY windows are requested ahead of the consumer, so
+    the next day is downloading while the caller processes the current one,
+    and at most that many windows are held in memory.
+    """
+    # Coarse levels return whole buckets, so start on a bucket boundary.
+    size = dict(_DETAIL_LEVELS).get(detail, 1)
+    w_start = _parse_bound(start, False)
+    w_start -= timedelta(minutes=w_start.minute % size)
+    windows = _intraday_windows(w_start, _parse_bound(end, True))
+    key = f"activities-{resource}-intraday"
+    extract = dataset or (lambda raw: raw.get(key, {}).get("dataset", []))
+
+    use_cache = cache.CACHE_ENABLED and user_id is not None and bool(windows) and uploaded is not None
+    upload_day = uploaded.date().isoformat() if uploaded is not None else ""
+    in_cache = (cache.cached_days(user_id, resource, detail,
+                                  windows[0][0].date().isoformat(),
+                                  windows[-1][1].date().isoformat())
+                if use_cache else set())
+
+    def _fetch(window: Tuple[datetime, datetime]) -> List[Dict[str, Any]]:
+        day = window[0].date().isoformat()
+        # Only whole days the tracker has uploaded past are final
+        cacheable = use_cache and _is_whole_day(*window) and day < upload_day
+        raw = None
+        if cacheable and day in in_cache:
+            raw = cache.load(user_id, resource, day, detail)
+            if raw is not None:
+                metrics.FITBIT_CACHE_HITS.inc(endpoint=f"intraday_{resource}")
+        if raw is None:
+            raw = _get(_window_url(resource, window[0], window[1], detail), access_token, user_id,
+                       f"intraday_{resource}")
+            if cacheable:
+                cache.store(user_id, resource, day, detail, raw, uploaded)
+        return extract(raw)
+
+    pool = ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY)
+    try:
+        ahead: Deque[Tuple[Tuple[datetime, datetime], Future]] = deque()
+        todo = iter(windows)
+        for w in islice(todo, FETCH_CONCURRENCY):
+            ahead.append((w, pool.submit(_fetch, w)))
+
+        day: Optional[str] = None
+        entries: List[Dict[str, Any]] = []
+        while ahead:
+            (w_start, w_end), fut = ahead.popleft()
+            dataset = fut.result()
+            nxt = next(todo, None)
+            if nxt is not None:
+                ahead.append((nxt, pool.submit(_fetch, nxt)))
+            for piece_day, piece in _split_window(dataset, w_start, w_end):
+                if piece_day != day:
+                    if day is not None:
+                        yield day, entries
+                    day, entries = piece_day, []
+                entries.extend(piece)
+        if day is not None:
+            yield day, entries
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
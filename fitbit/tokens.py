@@ -0,0 +1,177 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import metrics
+from db import SessionLocal, FitbitConnection
+from fitbit.oauth import refresh_tokens
+
+# -------------------------------------------------------------------
+# Configuration
+# -------------------------------------------------------------------
+# FITBIT_TOKEN_MARGIN     seconds before expires_at when a token is renewed
+#                         (must cover the longest sync of one user)
+# FITBIT_TOKEN_BATCH      tokens renewed per refresh_due() pass
+# FITBIT_TOKEN_WORKERS    refresh calls in parallel within a pass
+# FITBIT_TOKEN_INTERVAL   seconds between passes of the background refresher
+
+TOKEN_MARGIN = float(os.getenv("FITBIT_TOKEN_MARGIN", "1800"))
+TOKEN_BATCH = max(1, int(os.getenv("FITBIT_TOKEN_BATCH", "100")))
+TOKEN_WORKERS = max(1, int(os.getenv("FITBIT_TOKEN_WORKERS", "4")))
+TOKEN_INTERVAL = float(os.getenv("FITBIT_TOKEN_INTERVAL", "300"))
+
+
+def _utcnow() -> datetime:
+    """Naive UTC now, the convention used by FitbitConnection.expires_at."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _as_naive_utc(dt: Optional[datetime]) -> Optional[datetime]:
+    if dt is not None and dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+class TokenManager:
+    """
+    In-process cache of access tokens with per-user refresh locks.
+
+    Fitbit refresh tokens are single-use, so two concurrent refreshes of the
+    same user would invalidate each other: every refresh of a user goes
+    through that user's lock and re-checks the DB before calling Fitbit.
+    """
+
+    def __init__(self, margin: float = TOKEN_MARGIN):
+        self.margin = timedelta(seconds=margin)
+        self._cache: Dict[str, Tuple[str, datetime]] = {}   # user_id → (token, expires_at)
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _user_lock(self, user_id: str) -> threading.Lock:
+        with self._lock:
+            lock = self._locks.get(user_id)
+            if lock is None:
+                lock = self._locks[user_id] = threading.Lock()
+            return lock
+
+    def _fresh(self, expires_at: Optional[datetime]) -> bool:
+        return expires_at is not None and _as_naive_utc(expires_at) - self.margin > _utcnow()
+
+    def get(self, user_id: str) -> str:
+        """
+        Return an access token for `user_id` valid for at least the margin,
+        refreshing it first if needed. Raises if the refresh fails.
+        """
+        cached = self._cache.get(user_id)
+        if cached and self._fresh(cached[1]):
+            return cached[0]
+        with self._user_lock(user_id):
+            return self._refresh_locked(user_id)
+
+    def invalidate(self, user_id: str) -> None:
+        self._cache.pop(user_id, None)
+
+    def _refresh_locked(self, user_id: str) -> str:
+        """Re-read the DB row and refresh it if still needed (user lock held)."""
+        db = SessionLocal()
+        try:
+            row = db.query(FitbitConnection).filter_by(user_id=user_id).one()
+            if self._fresh(row.expires_at):
+                self._cache[user_id] = (row.access_token, _as_naive_utc(row.expires_at))
+                return row.access_token
+            try:
+                new = refresh_tokens(row.refresh_token)
+            except Exception:
+                metrics.TOKEN_REFRESHES.inc(outcome="error")
+                raise
+            metrics.TOKEN_REFRESHES.inc(outcome="ok")
+            row.access_token = new["access_token"]
+            row.refresh_token = new["refresh_token"]
+            # new["expires_at"] est isoformat() sans tz → naive UTC
+            row.expires_at = datetime.fromisoformat(new["expires_at"])
+            # Committed right away, not with the batch: Fitbit has already
+            # revoked the old refresh token, so the new one must not wait on
+            # the other users' refreshes (a crash would lose it).
+            db.commit()
+            self._cache[user_id] = (row.access_token, row.expires_at)
+            print(f"[{user_id}] token refreshed")
+            return row.access_token
+        finally:
+            db.close()
+
+    def refresh_due(self, user_ids: Iterable[str], limit: int = TOKEN_BATCH,
+                    workers: int = TOKEN_WORKERS) -> Tuple[int, int]:
+        """
+        Renew, in one batch, the tokens of `user_ids` that expire within the
+        margin.
+
+        `user_ids` must be users this process holds a lease for
+        (jobs/leases.py): the per-user locks only cover this process, and a
+        single-use refresh token spent by two processes leaves one of them
+        with a revoked token. Returns (refreshed, failed). Users already
+        being refreshed by another thread are skipped rather than waited for.
+        The batch shares one query and one thread pool; each refreshed token
+        is still committed on its own (see _refresh_locked).
+        """
+        user_ids = list(user_ids)
+        if not user_ids:
+            return 0, 0
+        db = SessionLocal()
+        try:
+            due: List[str] = [
+                uid for (uid,) in db.query(FitbitConnection.user_id)
+                .filter(FitbitConnection.user_id.in_(user_ids))
+                .filter(FitbitConnection.expires_at <= _utcnow() + self.margin)
+                .order_by(FitbitConnection.expires_at)
+                .limit(limit)
+            ]
+        finally:
+            db.close()
+        if not due:
+            return 0, 0
+
+        def _one(user_id: str) -> bool:
+            lock = self._user_lock(user_id)
+            if not lock.acquire(blocking=False):
+                return True
+            try:
+                self._refresh_locked(user_id)
+                return True
+            except Exception as e:
+                print(f"[ERROR] Token refresh failed for {user_id}: {e}")
+                return False
+            finally:
+                lock.release()
+
+        with ThreadPoolExecutor(max_workers=min(workers, len(due)), thread_name_prefix="token") as pool:
+            results = list(pool.map(_one, due))
+        ok = sum(results)
+        return ok, len(results) - ok
+
+    def start_background(self, held: Callable[[], Iterable[str]],
+                         interval: float = TOKEN_INTERVAL) -> threading.Event:
+        """
+        Run refresh_due() every `interval` seconds in a daemon thread, on
+        the users returned by `held()` (the leases this process holds, e.g.
+        Heartbeat.snapshot). Returns an Event; set it to stop the thread.
+        """
+        stop = threading.Event()
+
+        def _loop() -> None:
+            while not stop.is_set():
+                try:
+                    refreshed, failed = self.refresh_due(held())
+                    if refreshed or failed:
+                        print(f"Token refresher: {refreshed} refreshed, {failed} failed")
+                except Exception as e:
+                    print(f"[ERROR] Token refresher pass failed: {e}")
+                stop.wait(interval)
+
+        threading.Thread(target=_loop, name="token-refresher", daemon=True).start()
+        return stop
+
+
+# Shared by every sync worker in the process.
+tokens = TokenManager()
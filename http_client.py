@@ -0,0 +1,109 @@
+import os
+import gzip
+import json
+import threading
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# ---- Configuration ----
+# HTTP_POOL_SIZE        keep-alive connections kept per host
+# HTTP_CONNECT_TIMEOUT  seconds to establish a connection
+# HTTP_READ_TIMEOUT     seconds to wait for a response
+# HTTP_RETRIES          transport-level retries (connection errors, 5xx on GET)
+# HTTP_BACKOFF          exponential backoff factor between those retries
+# HTTP_GZIP_UPLOADS     gzip JSON request bodies (Content-Encoding: gzip)
+HTTP_POOL_SIZE = max(1, int(os.getenv("HTTP_POOL_SIZE", "32")))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+HTTP_RETRIES = max(0, int(os.getenv("HTTP_RETRIES", "3")))
+HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", "0.5"))
+HTTP_GZIP_UPLOADS = os.getenv("HTTP_GZIP_UPLOADS", "0") == "1"
+
+
+class HttpClient:
+    """
+    One pooled requests.Session per host, shared by every Fitbit and LAMP call.
+
+    - keep-alive pools sized by pool_size (safe to share between threads);
+    - gzip/deflate responses (requests' default Accept-Encoding);
+    - connection errors retried for every method, 5xx only for GET (POSTs
+      are not idempotent); 429 is left to fitbit.ratelimit;
+    - a default (connect, read) timeout on every call.
+    """
+
+    def __init__(self, pool_size: int = HTTP_POOL_SIZE,
+                 timeout: Tuple[float, float] = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT),
+                 retries: int = HTTP_RETRIES, backoff: float = HTTP_BACKOFF,
+                 gzip_uploads: bool = HTTP_GZIP_UPLOADS):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.gzip_uploads = gzip_uploads
+        self._sessions: Dict[str, requests.Session] = {}
+        self._lock = threading.Lock()
+
+    def _new_session(self) -> requests.Session:
+        retry = Retry(
+            total=self.retries,
+            connect=self.retries,
+            read=self.retries,
+            status=self.retries,
+            backoff_factor=self.backoff,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset({"GET", "HEAD"}),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+        s = requests.Session()
+        s.mount("https://", adapter)
+        s.mount("http://", adapter)
+        return s
+
+    def session(self, url: str) -> requests.Session:
+        """Return the pooled session for the host of `url`."""
+        parts = urlsplit(url)
+        host = f"{parts.scheme}://{parts.netloc}"
+        session = self._sessions.get(host)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(host)
+                if session is None:
+                    session = self._sessions[host] = self._new_session()
+        return session
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session(url).get(url, **kwargs)
+
+    def post(self, url: str, json_body: Any = None, headers: Optional[Dict[str, str]] = None,
+             gzip_body: Optional[bool] = None, **kwargs) -> requests.Response:
+        """
+        POST to `url`. A JSON body is serialized here so it can be gzipped
+        (gzip_body, default HTTP_GZIP_UPLOADS); form data goes through `data=`.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        headers = dict(headers or {})
+        if json_body is not None:
+            body = json.dumps(json_body, separators=(",", ":"), ensure_ascii=False).encode()
+            headers.setdefault("Content-Type", "application/json")
+            if self.gzip_uploads if gzip_body is None else gzip_body:
+                body = gzip.compress(body, compresslevel=5)
+                headers["Content-Encoding"] = "gzip"
+            kwargs["data"] = body
+        return self.session(url).post(url, headers=headers, **kwargs)
+
+    def close(self) -> None:
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+# Process-wide client: every Fitbit and LAMP call goes through it.
+client = HttpClient()
@@ -0,0 +1,320 @@
+# jobs/backfill.py
+
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set, Tuple
+
+# Make sure imports work whether you run from project root or jobs/
+CURRENT_DIR = os.path.dirname(__file__)
+PROJECT_ROOT = os.path.dirname(CURRENT_DIR)
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+# Env loading
+from dotenv import load_dotenv
+load_dotenv()  # loads .env from project root
+
+from sqlalchemy.exc import IntegrityError
+
+# Local modules
+import metrics
+from db import SessionLocal, BackfillJob, FitbitConnection, init_db
+from fitbit.ratelimit import RateLimitExceeded, limiter
+from fitbit.registry import ENABLED, groups, iter_group
+from fitbit.tokens import tokens
+from jobs.lamp import deliver_streams, flush_all
+from jobs.leases import Heartbeat, claim, release
+from jobs.sync_fitbit import SYNC_WORKERS, _cached_profile, _check_upload, _device_state, _final_until
+
+# ---- Configuration ----
+# BACKFILL_WINDOW_DAYS  days fetched and delivered per checkpoint (one
+#                       window ≈ days Fitbit calls per intraday resource,
+#                       plus one per daily endpoint, of FITBIT_METRICS)
+# BACKFILL_RESERVE      Fitbit calls per user and hour left to the regular
+#                       syncs: a user's backfill pauses below that budget
+BACKFILL_WINDOW_DAYS = max(1, int(os.getenv("BACKFILL_WINDOW_DAYS", "7")))
+BACKFILL_RESERVE = max(0, int(os.getenv("BACKFILL_RESERVE", "30")))
+# BACKFILL_BUSY_RETRY   seconds before retrying a job whose user is leased
+#                       by a sync (or another backfill) when a window starts
+BACKFILL_BUSY_RETRY = max(1.0, float(os.getenv("BACKFILL_BUSY_RETRY", "60")))
+
+
+class AwaitingUpload(Exception):
+    """The job has reached the device's last upload; resume it after the next one."""
+
+    def __init__(self, user_id: str, day: date):
+        super().__init__(f"{user_id} has not uploaded {day} yet")
+        self.user_id = user_id
+        self.day = day
+
+
+class UserLeased(Exception):
+    """The job's user is leased by another worker; retry the job later."""
+
+    def __init__(self, user_id: str):
+        super().__init__(f"{user_id} is leased by another worker")
+        self.user_id = user_id
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# ---- Jobs (checkpoints) ----
+
+def create_job(user_id: str, start: date, end: date) -> int:
+    """
+    Register a backfill of `user_id` over [start, end] and return its id.
+    An existing job for the same range is reused, so re-running the same
+    command resumes it instead of starting over.
+    """
+    db = SessionLocal()
+    try:
+        key = dict(user_id=user_id, start_day=start.isoformat(), end_day=end.isoformat())
+        job = db.query(BackfillJob).filter_by(**key).one_or_none()
+        if job is None:
+            now = _utcnow()
+            job = BackfillJob(**key, next_day=key["start_day"], done_sensors="",
+                              status="pending", created_at=now, updated_at=now)
+            db.add(job)
+            try:
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+                job = db.query(BackfillJob).filter_by(**key).one()
+        elif job.status == "failed":
+            # Retry from the checkpoint
+            job.status, job.error = "pending", None
+            db.commit()
+        return job.id
+    finally:
+        db.close()
+
+
+def unfinished_jobs() -> List[int]:
+    db = SessionLocal()
+    try:
+        return [jid for (jid,) in db.query(BackfillJob.id)
+                .filter(BackfillJob.status != "done").order_by(BackfillJob.id)]
+    finally:
+        db.close()
+
+
+def _last_complete_day(db, user_id: str, access_token: str) -> Tuple[Optional[datetime], date]:
+    """
+    (device's last upload, last day it has fully uploaded): Fitbit zero-fills
+    the minutes after lastSyncTime, so windows stop at the day before, like
+    sync_user's watermarks stop at final_until.
+    """
+    state = _device_state(db, user_id)
+    device_upload = _check_upload(db, state, access_token)
+    _, offset_ms = _cached_profile(db, state, access_token)
+    now_local = (datetime.now(timezone.utc) + timedelta(milliseconds=offset_ms)).replace(tzinfo=None)
+    return device_upload, _final_until(device_upload, now_local).date() - timedelta(days=1)
+
+
+def _window_streams(access_token: str, user_id: str, first: date, last: date, done: Set[str],
+                    uploaded: Optional[datetime]):
+    """(metric names, chunks factory) per Fitbit source for one window, whole days only."""
+    start = datetime.combine(first, datetime.min.time())
+    end = datetime.combine(last, datetime.min.time()).replace(hour=23, minute=59)
+    for group in groups(s for s in ENABLED if s.name not in done):
+        names = [s.name for s in group]
+        yield names, (lambda group=group, names=names: iter_group(
+            group, access_token, dict.fromkeys(names, start), end, user_id, uploaded))
+
+
+def run_job(job_id: int, window_days: int = BACKFILL_WINDOW_DAYS) -> bool:
+    """
+    Advance one backfill job window by window until it is done.
+
+    Each window runs under the user's lease (jobs/leases.py, renewed by a
+    heartbeat), released between windows so the regular syncs keep their
+    slot; raises UserLeased when another worker holds the user. Windows stop
+    at the last day the user's device has fully uploaded: past it, the job
+    stays pending and AwaitingUpload is raised. The checkpoint (next_day + done_sensors) is committed after every Fitbit
+    source (its metrics together) of every window, so a crash or a 429
+    resumes exactly there. Raises RateLimitExceeded when the user's budget
+    drops to BACKFILL_RESERVE, the job staying pending. Returns False when a
+    window could not be delivered (job marked failed, checkpoint kept).
+    """
+    db = SessionLocal()
+    try:
+        job = db.get(BackfillJob, job_id)
+        if job is None or job.status == "done":
+            return True
+        user_id = job.user_id
+        end = date.fromisoformat(job.end_day)
+
+        with Heartbeat() as hb:
+            while date.fromisoformat(job.next_day) <= end:
+                first = date.fromisoformat(job.next_day)
+                remaining = limiter.remaining(user_id)
+                if remaining is not None and remaining <= BACKFILL_RESERVE:
+                    raise RateLimitExceeded(user_id, limiter.reset_in(user_id))
+
+                if not claim([user_id]):
+                    raise UserLeased(user_id)
+                hb.add([user_id])
+                try:
+                    access_token = tokens.get(user_id)
+                    uploaded, complete = _last_complete_day(db, user_id, access_token)
+                    last = min(first + timedelta(days=window_days - 1), end, complete)
+                    if last < first:
+                        raise AwaitingUpload(user_id, first)
+                    if not _run_window(db, job, first, last, access_token, uploaded):
+                        return False
+                finally:
+                    hb.remove([user_id])
+                    release([user_id])
+                print(f"[{user_id}] backfill {first}..{last} done ({job.next_day} → {job.end_day} left)")
+
+        job.status = "done"
+        job.updated_at = _utcnow()
+        db.commit()
+        print(f"[{user_id}] backfill {job.start_day}..{job.end_day} complete")
+        return True
+    finally:
+        db.close()
+
+
+def _run_window(db, job: BackfillJob, first: date, last: date, access_token: str,
+                uploaded: Optional[datetime]) -> bool:
+    """One window of run_job(), the user's lease held. False when it failed."""
+    user_id = job.user_id
+    done = set(filter(None, job.done_sensors.split(",")))
+    for names, chunks in _window_streams(access_token, user_id, first, last, done, uploaded):
+        label = ",".join(names)
+        try:
+            delivered = deliver_streams(user_id, names, chunks())
+        except RateLimitExceeded:
+            raise
+        except Exception as e:
+            error = f"{label} {first}..{last}: {e}"
+        else:
+            failed = sum(stats.failed_points for stats in delivered.values())
+            error = f"{label} {first}..{last}: {failed} points not delivered" if failed else None
+        if error:
+            print(f"[ERROR] Backfill {user_id}: {error}")
+            job.status, job.error, job.updated_at = "failed", error, _utcnow()
+            db.commit()
+            return False
+        done.update(names)
+        job.done_sensors = ",".join(sorted(done))
+        job.updated_at = _utcnow()
+        db.commit()
+
+    job.next_day = (last + timedelta(days=1)).isoformat()
+    job.done_sensors = ""
+    job.updated_at = _utcnow()
+    db.commit()
+    # Deliver the window now so the outbox stays small over months of history
+    flush_all(user_id=user_id)
+    return True
+
+
+# ---- Runner ----
+
+def run_backfill(job_ids: List[int], workers: Optional[int] = None,
+                 window_days: int = BACKFILL_WINDOW_DAYS) -> Tuple[int, int]:
+    """
+    Run jobs in parallel (one user per worker). A rate-limited job goes back
+    in the queue until its user's budget resets, and one whose user is
+    being synced elsewhere for BACKFILL_BUSY_RETRY seconds, while the other
+    users keep going; the runner only stops once every job is done, failed
+    or waiting for a device upload (left pending for a later --resume).
+    Returns (done, failed).
+    """
+    workers = max(1, workers or SYNC_WORKERS)
+    queue: List[Tuple[float, int]] = [(0.0, jid) for jid in job_ids]
+    running: Dict[Future, int] = {}
+    done = failed = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="backfill") as pool:
+        while queue or running:
+            queue.sort()
+            now = time.monotonic()
+            while queue and queue[0][0] <= now and len(running) < workers:
+                _, jid = queue.pop(0)
+                running[pool.submit(run_job, jid, window_days)] = jid
+            timeout = max(0.0, queue[0][0] - now) if queue else None
+            if not running:
+                time.sleep(timeout or 0)
+                continue
+            finished, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                jid = running.pop(fut)
+                try:
+                    ok = fut.result()
+                except RateLimitExceeded as e:
+                    print(f"Backfill job {jid} paused: {e}")
+                    queue.append((time.monotonic() + e.retry_in + 1, jid))
+                    continue
+                except UserLeased as e:
+                    print(f"Backfill job {jid} waiting: {e}")
+                    queue.append((time.monotonic() + BACKFILL_BUSY_RETRY, jid))
+                    continue
+                except AwaitingUpload as e:
+                    print(f"Backfill job {jid} pending: {e}, --resume after the device syncs")
+                    continue
+                except Exception as e:
+                    print(f"[ERROR] Backfill job {jid} crashed: {e}")
+                    ok = False
+                if ok:
+                    done += 1
+                else:
+                    failed += 1
+    return done, failed
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Backfill Fitbit history to mindLAMP (resumable).",
+        epilog="Re-run the same command, or use --resume, to continue after a crash.",
+    )
+    parser.add_argument("--user", action="append", default=[], help="user_id (repeatable)")
+    parser.add_argument("--all", action="store_true", help="every connected user")
+    parser.add_argument("--start", type=date.fromisoformat, help="first day, YYYY-MM-DD")
+    parser.add_argument("--end", type=date.fromisoformat,
+                        help="last day, YYYY-MM-DD (default: yesterday; days after the "
+                             "device's last upload are left pending)")
+    parser.add_argument("--resume", action="store_true", help="continue every unfinished job")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="users backfilled in parallel (default: SYNC_WORKERS or 1)")
+    parser.add_argument("--window-days", type=int, default=BACKFILL_WINDOW_DAYS,
+                        help="days per window / checkpoint (default: BACKFILL_WINDOW_DAYS)")
+    args = parser.parse_args(argv)
+
+    init_db()
+    if args.resume:
+        job_ids = unfinished_jobs()
+    else:
+        if not args.start or not (args.user or args.all):
+            parser.error("--start and --user/--all are required (or --resume)")
+        end = args.end or date.today() - timedelta(days=1)
+        if end < args.start:
+            parser.error("--end is before --start")
+        user_ids = args.user
+        if args.all:
+            db = SessionLocal()
+            try:
+                user_ids = [uid for (uid,) in db.query(FitbitConnection.user_id).all()]
+            finally:
+                db.close()
+        job_ids = [create_job(uid, args.start, end) for uid in user_ids]
+
+    if not job_ids:
+        print("Nothing to backfill.")
+        return
+    started = time.monotonic()
+    done, failed = run_backfill(job_ids, workers=args.workers, window_days=max(1, args.window_days))
+    print(f"Backfill finished: {done} done, {failed} failed out of {len(job_ids)} jobs "
+          f"in {time.monotonic() - started:.1f}s")
+    metrics.write_file()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+# jobs/daemon.py
+
+import os
+import sys
+import zlib
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Set
+
+# Make sure imports work whether you run from project root or jobs/
+CURRENT_DIR = os.path.dirname(__file__)
+PROJECT_ROOT = os.path.dirname(CURRENT_DIR)
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+# Env loading
+from dotenv import load_dotenv
+load_dotenv()  # loads .env from project root
+
+from apscheduler.events import EVENT_JOB_SUBMITTED
+from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.schedulers.blocking import BlockingScheduler
+from apscheduler.triggers.date import DateTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+
+# Local modules
+import metrics
+from db import SessionLocal, FitbitConnection, init_db
+from fitbit import cache
+from fitbit.ratelimit import RateLimitExceeded
+from fitbit.tokens import tokens
+from jobs.lamp import LAMP_OUTBOX, flush_all, prune_digests
+from jobs.leases import Heartbeat, claim, release
+from jobs.sync_fitbit import SYNC_INTERVAL, SYNC_WORKERS, pending_syncs, sync_pending_user, sync_user
+
+# ---- Configuration ----
+# SYNC_INTERVAL            seconds between two syncs of the same user (jobs.sync_fitbit)
+# SYNC_RECONCILE_INTERVAL  seconds between checks for new / removed users
+# SYNC_STATS_INTERVAL      seconds between queue/lag log lines and gauge updates
+# SYNC_PENDING_INTERVAL    seconds between checks of queued Fitbit notifications
+# LAMP_FLUSH_INTERVAL      seconds between two flushes of the LAMP outbox
+SYNC_RECONCILE_INTERVAL = max(10, int(os.getenv("SYNC_RECONCILE_INTERVAL", "300")))
+SYNC_STATS_INTERVAL = max(10, int(os.getenv("SYNC_STATS_INTERVAL", "60")))
+SYNC_PENDING_INTERVAL = max(5, int(os.getenv("SYNC_PENDING_INTERVAL", "30")))
+LAMP_FLUSH_INTERVAL = max(1, int(os.getenv("LAMP_FLUSH_INTERVAL", "10")))
+
+_USER_JOB = "sync:"
+_RETRY_JOB = "retry:"
+_PUSH_JOB = "push:"
+
+
+class SyncDaemon:
+    """
+    Resident sync worker: every user gets its own interval job, and the
+    users are spread evenly over the interval instead of all firing at the
+    top of the hour. Jobs run on a pool of `workers` threads that reuse the
+    process's warm DB and HTTP connection pools.
+
+    The queue depth (jobs due but waiting for a free worker) and the lag
+    between a job's scheduled time and its actual start are tracked in
+    stats(), logged and exported as gauges every SYNC_STATS_INTERVAL seconds.
+    """
+
+    def __init__(self, interval: int = SYNC_INTERVAL, workers: int = SYNC_WORKERS):
+        self.interval = interval
+        self.workers = max(1, workers)
+        self.scheduler = BlockingScheduler(
+            executors={"default": ThreadPoolExecutor(self.workers)},
+            job_defaults={"coalesce": True, "max_instances": 1, "misfire_grace_time": interval},
+            timezone=timezone.utc,
+        )
+        self.scheduler.add_listener(self._on_submitted, EVENT_JOB_SUBMITTED)
+        # Spread anchor: slots are offsets from the start of the current UTC day.
+        self._anchor = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        self._offsets: Dict[str, float] = {}
+        self._waiting: Dict[str, datetime] = {}   # job id → scheduled run time, until it starts
+        self._pushing: Set[str] = set()           # users with a targeted sync queued or running
+        self._heartbeat = Heartbeat()              # renews the leases of running syncs
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Any] = {
+            "runs": 0, "ok": 0, "failed": 0, "deferred": 0, "leased": 0, "pushed": 0, "delivered": 0,
+            "last_lag_s": 0.0, "max_lag_s": 0.0, "running": 0,
+        }
+
+    # ---- Bookkeeping ----
+
+    def _on_submitted(self, event) -> None:
+        if event.job_id.startswith((_USER_JOB, _RETRY_JOB, _PUSH_JOB)):
+            with self._lock:
+                self._waiting[event.job_id] = event.scheduled_run_times[-1]
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of the daemon's counters, queue depth and lag."""
+        with self._lock:
+            now = datetime.now(timezone.utc)
+            oldest = min(self._waiting.values(), default=None)
+            return {
+                **self._stats,
+                "users": len(self._offsets),
+                "queue_depth": len(self._waiting),
+                "oldest_wait_s": (now - oldest).total_seconds() if oldest else 0.0,
+            }
+
+    def _log_stats(self) -> None:
+        s = self.stats()
+        metrics.DAEMON_QUEUE_DEPTH.set(s["queue_depth"])
+        for kind, key in (("last", "last_lag_s"), ("max", "max_lag_s"), ("oldest_wait", "oldest_wait_s")):
+            metrics.DAEMON_SYNC_LAG.set(s[key], kind=kind)
+        metrics.write_file()
+        print(
+            f"[daemon] users:{s['users']} queue:{s['queue_depth']} running:{s['running']} "
+            f"lag:{s['last_lag_s']:.1f}s (max {s['max_lag_s']:.1f}s) "
+            f"runs:{s['runs']} ok:{s['ok']} failed:{s['failed']} deferred:{s['deferred']} leased:{s['leased']} "
+            f"pushed:{s['pushed']}"
+        )
+
+    # ---- Jobs ----
+
+    def _run_user(self, user_id: str, job_id: str) -> None:
+        started = datetime.now(timezone.utc)
+        with self._lock:
+            scheduled = self._waiting.pop(job_id, started)
+            lag = max(0.0, (started - scheduled).total_seconds())
+            self._stats["last_lag_s"] = lag
+            self._stats["max_lag_s"] = max(self._stats["max_lag_s"], lag)
+            self._stats["running"] += 1
+        outcome = "failed"
+        if not claim([user_id]):
+            # Being synced by another process on the same DB (worker, run_once)
+            outcome = "leased"
+        try:
+            if outcome != "leased":
+                self._heartbeat.add([user_id])
+                outcome = "ok" if sync_user(user_id) else "failed"
+        except RateLimitExceeded as e:
+            outcome = "deferred"
+            print(f"[{user_id}] deferred: {e}")
+            if e.retry_in < self.interval:
+                self.scheduler.add_job(
+                    self._run_user, DateTrigger(started + timedelta(seconds=e.retry_in + 1)),
+                    args=[user_id, _RETRY_JOB + user_id], id=_RETRY_JOB + user_id,
+                    replace_existing=True,
+                )
+        except Exception as e:
+            print(f"[ERROR] Unexpected error while syncing {user_id}: {e}")
+        finally:
+            if outcome != "leased":
+                self._heartbeat.remove([user_id])
+                release([user_id], next_sync_in=self.interval)
+            with self._lock:
+                self._stats["running"] -= 1
+                self._stats["runs"] += 1
+                self._stats[outcome] += 1
+
+    def _run_push(self, user_id: str, ids: List[int], sensors: Set[str], since_day) -> None:
+        with self._lock:
+            self._waiting.pop(_PUSH_JOB + user_id, None)
+        # Not leased: the notifications stay queued for the next drain
+        claimed = bool(claim([user_id]))
+        try:
+            if claimed:
+                self._heartbeat.add([user_id])
+                sync_pending_user(user_id, ids, sensors, since_day)
+        except RateLimitExceeded as e:
+            print(f"[{user_id}] targeted sync deferred: {e}")
+        except Exception as e:
+            print(f"[ERROR] Targeted sync failed for {user_id}: {e}")
+        finally:
+            if claimed:
+                self._heartbeat.remove([user_id])
+                release([user_id])
+            with self._lock:
+                self._pushing.discard(user_id)
+                self._stats["pushed"] += 1
+
+    def flush(self) -> None:
+        """Deliver the LAMP outbox (sync workers only queue points)."""
+        try:
+            delivered, failed = flush_all()
+        except Exception as e:
+            print(f"[ERROR] Outbox flush failed: {e}")
+            return
+        if delivered or failed:
+            with self._lock:
+                self._stats["delivered"] += delivered
+            print(f"[daemon] outbox: {delivered} delivered, {failed} failed")
+
+    def drain_pending(self) -> None:
+        """Turn queued Fitbit notifications into one-off targeted sync jobs."""
+        for uid, (ids, sensors, since_day) in pending_syncs().items():
+            with self._lock:
+                if uid in self._pushing:
+                    continue
+                self._pushing.add(uid)
+            self.scheduler.add_job(
+                self._run_push, args=[uid, ids, sensors, since_day],
+                id=_PUSH_JOB + uid, replace_existing=True,
+            )
+
+    def reconcile(self) -> None:
+        """Add jobs for new users, drop removed ones and re-spread the slots."""
+        db = SessionLocal()
+        try:
+            user_ids: List[str] = [uid for (uid,) in db.query(FitbitConnection.user_id).all()]
+        finally:
+            db.close()
+
+        # Evenly spaced slots, in a stable (hashed) order so that a new user
+        # only shifts its neighbours a little.
+        user_ids.sort(key=lambda uid: zlib.crc32(uid.encode()))
+        wanted = {uid: self.interval * i / len(user_ids) for i, uid in enumerate(user_ids)}
+
+        for uid in set(self._offsets) - set(wanted):
+            job = self.scheduler.get_job(_USER_JOB + uid)
+            if job:
+                job.remove()
+            del self._offsets[uid]
+
+        for uid, offset in wanted.items():
+            if self._offsets.get(uid) == offset:
+                continue
+            trigger = IntervalTrigger(
+                seconds=self.interval,
+                start_date=self._anchor + timedelta(seconds=offset),
+                timezone=timezone.utc,
+            )
+            self.scheduler.add_job(
+                self._run_user, trigger, args=[uid, _USER_JOB + uid],
+                id=_USER_JOB + uid, replace_existing=True,
+            )
+            self._offsets[uid] = offset
+
+    # ---- Lifecycle ----
+
+    def start(self) -> None:
+        """Block and run until interrupted (Ctrl+C / SIGTERM)."""
+        init_db()
+        refresher = tokens.start_background(self._heartbeat.snapshot)
+        self._heartbeat.start()
+        metrics.serve()
+        self.reconcile()
+        print(f"[daemon] {len(self._offsets)} users spread over {self.interval}s, {self.workers} workers")
+
+        self.scheduler.add_job(self.reconcile, IntervalTrigger(seconds=SYNC_RECONCILE_INTERVAL),
+                               id="reconcile")
+        self.scheduler.add_job(self._log_stats, IntervalTrigger(seconds=SYNC_STATS_INTERVAL),
+                               id="stats")
+        self.scheduler.add_job(prune_digests, IntervalTrigger(hours=24), id="prune-digests")
+        self.scheduler.add_job(cache.prune, IntervalTrigger(hours=24), id="prune-cache")
+        self.scheduler.add_job(self.drain_pending, IntervalTrigger(seconds=SYNC_PENDING_INTERVAL),
+                               id="pending")
+        if LAMP_OUTBOX:
+            self.scheduler.add_job(self.flush, IntervalTrigger(seconds=LAMP_FLUSH_INTERVAL), id="flush")
+        try:
+            self.scheduler.start()
+        except (KeyboardInterrupt, SystemExit):
+            pass
+        finally:
+            refresher.set()
+            self._heartbeat.stop()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Resident Fitbit → mindLAMP sync worker.")
+    parser.add_argument("--interval", type=int, default=SYNC_INTERVAL,
+                        help="seconds between two syncs of the same user (default: SYNC_INTERVAL)")
+    parser.add_argument("--workers", type=int, default=SYNC_WORKERS,
+                        help="users synced in parallel (default: SYNC_WORKERS)")
+    args = parser.parse_args(argv)
+    SyncDaemon(interval=args.interval, workers=args.workers).start()
+
+
+if __name__ == "__main__":
+    main()
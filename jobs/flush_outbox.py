@@ -0,0 +1,45 @@
+# jobs/flush_outbox.py
+
+import os
+import sys
+import time
+import argparse
+
+# Make sure imports work whether you run from project root or jobs/
+CURRENT_DIR = os.path.dirname(__file__)
+PROJECT_ROOT = os.path.dirname(CURRENT_DIR)
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+# Env loading
+from dotenv import load_dotenv
+load_dotenv()  # loads .env from project root
+
+# Local modules
+import metrics
+from db import init_db
+from jobs.lamp import flush_all, outbox_size
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Deliver the LAMP outbox to mindLAMP.")
+    parser.add_argument("--user", default=None, help="only this user_id")
+    parser.add_argument("--loop", type=float, default=0, metavar="SECONDS",
+                        help="keep flushing every SECONDS instead of exiting")
+    args = parser.parse_args(argv)
+
+    init_db()
+    while True:
+        started = time.monotonic()
+        delivered, failed = flush_all(user_id=args.user)
+        if delivered or failed or not args.loop:
+            print(f"Outbox: {delivered} points delivered, {failed} failed, {outbox_size()} waiting "
+                  f"({time.monotonic() - started:.1f}s)")
+        metrics.write_file()
+        if not args.loop:
+            return
+        time.sleep(args.loop)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,513 @@
+# jobs/lamp.py
+
+import os
+import json
+import time
+import uuid
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, insert, update
+
+import metrics
+from db import SessionLocal, LampDeliveryDigest, LampOutbox
+from fitbit.series import Points, concat_points, point_timestamps, take_points
+from http_client import client
+
+LAMP_BASE: Optional[str] = os.getenv("LAMP_BASE")  # e.g. https://api.mind.momonia.net or with /api
+LAMP_AUTH: Optional[str] = os.getenv("LAMP_AUTH")  # e.g. "Basic XXX" or "Bearer YYY"
+
+# ---- Delivery configuration ----
+# LAMP_BATCH_SIZE: number of sensor_events per POST. mindLAMP accepts either a
+# single SensorEvent object or an array of them on /participant/{id}/sensor_event;
+# set it to 1 to fall back to one object per request.
+# LAMP_CONCURRENCY: number of batches in flight at the same time over the
+# shared keep-alive pool (http_client).
+LAMP_BATCH_SIZE = max(1, int(os.getenv("LAMP_BATCH_SIZE", "500")))
+LAMP_CONCURRENCY = max(1, int(os.getenv("LAMP_CONCURRENCY", "4")))
+LAMP_TIMEOUT = float(os.getenv("LAMP_TIMEOUT", "30"))
+# LAMP_DEDUPE: only send points whose value changed since the last delivery
+# of the same (user, sensor, timestamp). Digests older than
+# LAMP_DIGEST_RETENTION_DAYS are pruned by prune_digests().
+LAMP_DEDUPE = os.getenv("LAMP_DEDUPE", "1") == "1"
+LAMP_DIGEST_RETENTION_DAYS = int(os.getenv("LAMP_DIGEST_RETENTION_DAYS", "35"))
+# LAMP_OUTBOX: the sync writes points to the lamp_outbox table and
+# flush_outbox() delivers them; a failed POST is retried from there
+# (LAMP_OUTBOX_BACKOFF doubling up to LAMP_OUTBOX_MAX_BACKOFF seconds)
+# without fetching from Fitbit again. 0 = POST directly from the sync.
+LAMP_OUTBOX = os.getenv("LAMP_OUTBOX", "1") == "1"
+LAMP_OUTBOX_FLUSH_LIMIT = max(1, int(os.getenv("LAMP_OUTBOX_FLUSH_LIMIT", "5000")))
+LAMP_OUTBOX_BACKOFF = float(os.getenv("LAMP_OUTBOX_BACKOFF", "30"))
+LAMP_OUTBOX_MAX_BACKOFF = float(os.getenv("LAMP_OUTBOX_MAX_BACKOFF", "3600"))
+# A flush claims the rows it posts for LAMP_OUTBOX_CLAIM_TTL seconds, so
+# concurrent flushes (daemon, workers, jobs/flush_outbox.py) never post the
+# same row; rows of a flush that died become due again after it.
+LAMP_OUTBOX_CLAIM_TTL = max(60.0, float(os.getenv("LAMP_OUTBOX_CLAIM_TTL", "300")))
+
+
+# ---- Stats ----
+
+@dataclass
+class DeliveryStats:
+    """Per-sensor delivery summary (replaces the old per-point log lines)."""
+    sensor: str
+    points: int = 0
+    batches: int = 0
+    failed_points: int = 0
+    failed_batches: int = 0
+    unchanged: int = 0
+    queued: int = 0                        # written to the outbox instead of sent
+    last_timestamp: Optional[int] = None   # latest point timestamp handled (ms)
+    seconds: float = 0.0
+    errors: List[str] = field(default_factory=list)
+
+    @property
+    def sent(self) -> int:
+        return self.points - self.failed_points - self.unchanged - self.queued
+
+    def merge(self, other: "DeliveryStats") -> "DeliveryStats":
+        self.points += other.points
+        self.batches += other.batches
+        self.failed_points += other.failed_points
+        self.failed_batches += other.failed_batches
+        self.unchanged += other.unchanged
+        self.queued += other.queued
+        if other.last_timestamp is not None:
+            self.last_timestamp = max(self.last_timestamp or other.last_timestamp, other.last_timestamp)
+        self.seconds += other.seconds
+        self.errors.extend(other.errors)
+        return self
+
+    def summary(self, user_id: str) -> str:
+        if self.queued:
+            line = (f"[{user_id}] {self.sensor} → {self.queued}/{self.points} points queued "
+                    f"for delivery, {self.seconds:.2f}s")
+            if self.unchanged:
+                line += f", {self.unchanged} unchanged skipped"
+            return line
+        rate = self.sent / self.seconds if self.seconds > 0 else 0.0
+        line = (
+            f"[{user_id}] {self.sensor} → {self.sent}/{self.points} points in "
+            f"{self.batches} batches, {self.seconds:.2f}s ({rate:.0f} pts/s)"
+        )
+        if self.unchanged:
+            line += f", {self.unchanged} unchanged skipped"
+        if self.failed_batches:
+            line += f", {self.failed_batches} failed batches (first error: {self.errors[0]})"
+        return line
+
+
+# ---- Change detection ----
+
+def _digest(point: Dict[str, Any]) -> str:
+    """Short, stable digest of a point's content."""
+    raw = json.dumps(point, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.blake2b(raw.encode(), digest_size=8).hexdigest()
+
+
+def _load_digests(user_id: str, sensor: str, first_ts: int, last_ts: int) -> Dict[int, str]:
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(LampDeliveryDigest.timestamp, LampDeliveryDigest.digest)
+            .filter_by(user_id=user_id, sensor=sensor)
+            .filter(LampDeliveryDigest.timestamp >= first_ts, LampDeliveryDigest.timestamp <= last_ts)
+            .all()
+        )
+        return dict(rows)
+    finally:
+        db.close()
+
+
+def _record_digests(user_id: str, sensor: str, delivered: Dict[int, str], db=None) -> None:
+    """
+    Remember the digests of successfully delivered points (one transaction,
+    or part of the caller's when `db` is given; the caller then commits).
+    """
+    if not delivered:
+        return
+    own = db is None
+    db = db or SessionLocal()
+    try:
+        existing = {
+            row.timestamp: row
+            for row in db.query(LampDeliveryDigest)
+            .filter_by(user_id=user_id, sensor=sensor)
+            .filter(LampDeliveryDigest.timestamp >= min(delivered),
+                    LampDeliveryDigest.timestamp <= max(delivered))
+        }
+        for ts, digest in delivered.items():
+            row = existing.get(ts)
+            if row is None:
+                db.add(LampDeliveryDigest(user_id=user_id, sensor=sensor, timestamp=ts, digest=digest))
+            else:
+                row.digest = digest
+        if own:
+            db.commit()
+    finally:
+        if own:
+            db.close()
+
+
+def prune_digests(retention_days: Optional[int] = None) -> int:
+    """Delete digests of points older than the retention window. Returns rows deleted."""
+    days = LAMP_DIGEST_RETENTION_DAYS if retention_days is None else retention_days
+    cutoff = int((time.time() - days * 86400) * 1000)
+    db = SessionLocal()
+    try:
+        deleted = db.query(LampDeliveryDigest).filter(LampDeliveryDigest.timestamp < cutoff).delete()
+        db.commit()
+        return deleted
+    finally:
+        db.close()
+
+
+# ---- Sending ----
+
+def _make_event(sensor: str, point: Dict[str, Any], now_ms: int) -> Dict[str, Any]:
+    """1 mesure = 1 sensor_event (the measurement timestamp stays in data)."""
+    return {
+        "timestamp": now_ms,
+        "sensor": f"fitbit_{sensor}",
+        "data": point,
+    }
+
+
+def _post_events(user_id: str, events: List[Dict[str, Any]]) -> Optional[str]:
+    """
+    POST one batch of sensor_events. Returns None on success, or a short
+    error description on failure.
+    """
+    url = f"{LAMP_BASE}/participant/{user_id}/sensor_event"
+    body: Any = events if len(events) > 1 else events[0]
+    try:
+        with metrics.LAMP_LATENCY.time():
+            r = client.post(url, json_body=body, headers={"Authorization": LAMP_AUTH},
+                            timeout=(client.timeout[0], LAMP_TIMEOUT))
+    except Exception as e:
+        metrics.LAMP_REQUESTS.inc(status="error")
+        return f"{type(e).__name__}: {e}"
+    metrics.LAMP_REQUESTS.inc(status=str(r.status_code))
+    if r.status_code >= 400:
+        return f"HTTP {r.status_code} {r.text[:200]}"
+    return None
+
+
+def send_points(user_id: str, sensor: str, points: Points,
+                batch_size: Optional[int] = None,
+                concurrency: Optional[int] = None,
+                dedupe: Optional[bool] = None) -> DeliveryStats:
+    """
+    Deliver every point as its own sensor_event, LAMP_BATCH_SIZE events per
+    POST with up to LAMP_CONCURRENCY POSTs in flight on the shared pool.
+
+    With dedupe (default LAMP_DEDUPE), points identical to what was last
+    delivered for the same timestamp are skipped, and the digests of the
+    points that were accepted are recorded.
+
+    `points` is a Series or a list of point dicts; a Series is turned into
+    dicts batch by batch, as the events are built.
+
+    Returns the DeliveryStats for this call; nothing is printed per point.
+    """
+    stats = DeliveryStats(sensor=sensor, points=len(points))
+    if not points:
+        return stats
+    stamps = point_timestamps(points)
+    stats.last_timestamp = max(stamps)
+    if not (LAMP_BASE and LAMP_AUTH):
+        print("[WARN] LAMP_BASE or LAMP_AUTH not set. Skipping send.")
+        stats.failed_points = len(points)
+        return stats
+
+    dedupe = LAMP_DEDUPE if dedupe is None else dedupe
+    digests: List[str] = []
+    if dedupe:
+        known = _load_digests(user_id, sensor, min(stamps), stats.last_timestamp)
+        keep = []
+        for i, p in enumerate(points):
+            d = _digest(p)
+            if known.get(stamps[i]) != d:
+                keep.append(i)
+                digests.append(d)
+        stats.unchanged = len(points) - len(keep)
+        points = take_points(points, keep)
+        if not points:
+            return stats
+
+    size = max(1, batch_size or LAMP_BATCH_SIZE)
+    workers = max(1, concurrency or LAMP_CONCURRENCY)
+    now_ms = int(datetime.now(timezone.utc).timestamp() * 1000)
+    with metrics.STAGE_SECONDS.time(stage="serialize"):
+        batches = [
+            [_make_event(sensor, p, now_ms) for p in points[i:i + size]]
+            for i in range(0, len(points), size)
+        ]
+    stats.batches = len(batches)
+
+    started = time.perf_counter()
+    if workers == 1 or len(batches) == 1:
+        results = [_post_events(user_id, b) for b in batches]
+    else:
+        with ThreadPoolExecutor(max_workers=min(workers, len(batches))) as pool:
+            results = list(pool.map(lambda b: _post_events(user_id, b), batches))
+    stats.seconds = time.perf_counter() - started
+
+    delivered: Dict[int, str] = {}
+    for i, (batch, err) in enumerate(zip(batches, results)):
+        if err:
+            stats.failed_batches += 1
+            stats.failed_points += len(batch)
+            stats.errors.append(err)
+        elif dedupe:
+            for j, point in enumerate(points[i * size:(i + 1) * size]):
+                delivered[point["timestamp"]] = digests[i * size + j]
+    _record_digests(user_id, sensor, delivered)
+    return stats
+
+
+def _buffered(put, user_id: str, sensors: Sequence[str],
+              chunks: Iterable[Dict[str, Points]]) -> Dict[str, DeliveryStats]:
+    """
+    Hand {sensor: points} chunks to `put` (send_points / queue_points) per
+    sensor, each buffered until LAMP_BATCH_SIZE × LAMP_CONCURRENCY points
+    are ready.
+    """
+    stats = {s: DeliveryStats(sensor=s) for s in sensors}
+    flush_at = LAMP_BATCH_SIZE * LAMP_CONCURRENCY
+    buffers: Dict[str, List[Points]] = {s: [] for s in sensors}
+    buffered = dict.fromkeys(sensors, 0)
+    for chunk in chunks:
+        for sensor, points in chunk.items():
+            buffers[sensor].append(points)
+            buffered[sensor] += len(points)
+            if buffered[sensor] >= flush_at:
+                stats[sensor].merge(put(user_id, sensor, concat_points(buffers[sensor])))
+                buffers[sensor], buffered[sensor] = [], 0
+    for sensor in sensors:
+        if buffered[sensor]:
+            stats[sensor].merge(put(user_id, sensor, concat_points(buffers[sensor])))
+    return stats
+
+
+def send_stream(user_id: str, sensor: str, chunks: Iterable[Points]) -> DeliveryStats:
+    """
+    Deliver a stream of point lists or Series (e.g. one per day) as they arrive.
+
+    Small chunks are buffered until a full round of batches
+    (LAMP_BATCH_SIZE × LAMP_CONCURRENCY points) is ready, so memory stays
+    bounded by that buffer plus one chunk whatever the length of the stream.
+    """
+    return _buffered(send_points, user_id, [sensor], ({sensor: c} for c in chunks))[sensor]
+
+
+# ---- Outbox ----
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def queue_points(user_id: str, sensor: str, points: Points,
+                 dedupe: Optional[bool] = None) -> DeliveryStats:
+    """
+    Write points to the outbox in one bulk insert (one transaction).
+
+    Points identical to what was last delivered are skipped (dedupe, as in
+    send_points), and so are points identical to the one already waiting
+    for their timestamp, whose row keeps its attempts and backoff. A point
+    waiting with another value is replaced by the new one, or dropped when
+    the new value is back to the delivered one. Once this returns, delivery
+    is flush_outbox()'s job.
+    """
+    stats = DeliveryStats(sensor=sensor, points=len(points))
+    if not points:
+        return stats
+    started = time.perf_counter()
+    stamps = point_timestamps(points)
+    first_ts, stats.last_timestamp = min(stamps), max(stamps)
+
+    digests = [_digest(p) for p in points]
+    known = (_load_digests(user_id, sensor, first_ts, stats.last_timestamp)
+             if (LAMP_DEDUPE if dedupe is None else dedupe) else {})
+    db = SessionLocal()
+    try:
+        with metrics.STAGE_SECONDS.time(stage="outbox_write"):
+            pending = dict(
+                db.query(LampOutbox.timestamp, LampOutbox.digest)
+                .filter_by(user_id=user_id, sensor=sensor)
+                .filter(LampOutbox.timestamp >= first_ts, LampOutbox.timestamp <= stats.last_timestamp)
+                .all()
+            )
+        keep = [i for i, ts in enumerate(stamps) if digests[i] not in (pending.get(ts), known.get(ts))]
+        stale = [ts for i, ts in enumerate(stamps) if ts in pending and pending[ts] != digests[i]]
+        stats.unchanged = len(points) - len(keep)
+
+        now = _utcnow()
+        with metrics.STAGE_SECONDS.time(stage="serialize"):
+            rows = [
+                {
+                    "user_id": user_id, "sensor": sensor, "timestamp": p["timestamp"],
+                    "payload": json.dumps(p, separators=(",", ":"), ensure_ascii=False),
+                    "digest": digests[i], "attempts": 0, "next_attempt_at": now, "created_at": now,
+                }
+                for i, p in zip(keep, take_points(points, keep))
+            ]
+        with metrics.STAGE_SECONDS.time(stage="outbox_write"):
+            if stale:
+                db.query(LampOutbox).filter_by(user_id=user_id, sensor=sensor).filter(
+                    LampOutbox.timestamp.in_(stale)
+                ).delete(synchronize_session=False)
+            if rows:
+                db.execute(insert(LampOutbox), rows)
+            db.commit()
+    finally:
+        db.close()
+    stats.queued = len(rows)
+    stats.seconds = time.perf_counter() - started
+    return stats
+
+
+def queue_stream(user_id: str, sensor: str, chunks: Iterable[Points]) -> DeliveryStats:
+    """Streaming queue_points(), buffered like send_stream()."""
+    return _buffered(queue_points, user_id, [sensor], ({sensor: c} for c in chunks))[sensor]
+
+
+def deliver_streams(user_id: str, sensors: Sequence[str],
+                    chunks: Iterable[Dict[str, Points]]) -> Dict[str, DeliveryStats]:
+    """
+    Hand several sensors' points over for delivery, from one stream of
+    {sensor: points} chunks (metrics fetched together, fitbit/registry.py):
+    via the outbox, or directly (LAMP_OUTBOX=0).
+    """
+    by_sensor = _buffered(queue_points if LAMP_OUTBOX else send_points, user_id, sensors, chunks)
+    for sensor, stats in by_sensor.items():
+        for outcome in ("queued", "sent", "unchanged"):
+            metrics.POINTS.inc(getattr(stats, outcome), sensor=sensor, outcome=outcome)
+        metrics.POINTS.inc(stats.failed_points, sensor=sensor, outcome="failed")
+    return by_sensor
+
+
+def deliver_stream(user_id: str, sensor: str, chunks: Iterable[Points]) -> DeliveryStats:
+    """Hand a sensor's points over for delivery: via the outbox, or directly (LAMP_OUTBOX=0)."""
+    return deliver_streams(user_id, [sensor], ({sensor: c} for c in chunks))[sensor]
+
+
+def flush_outbox(limit: Optional[int] = None, user_id: Optional[str] = None,
+                 concurrency: Optional[int] = None) -> Tuple[int, int]:
+    """
+    Deliver up to `limit` due outbox rows (oldest points first), batched per
+    (user, sensor) with up to LAMP_CONCURRENCY POSTs in flight.
+
+    The rows are first claimed with a compare-and-set UPDATE (only rows
+    still due are taken, and taking them makes them not due for
+    LAMP_OUTBOX_CLAIM_TTL), so concurrent flushes of the same database
+    never post the same row. Acknowledged rows are deleted and their
+    digests recorded in the same transaction; rows of a failed batch are
+    released with an exponential backoff before the next attempt. Rows
+    replaced by a newer value while in flight are left for the next pass.
+    Returns (delivered, failed) point counts.
+    """
+    if not (LAMP_BASE and LAMP_AUTH):
+        print("[WARN] LAMP_BASE or LAMP_AUTH not set. Outbox not flushed.")
+        return 0, 0
+
+    token = uuid.uuid4().hex
+    db = SessionLocal()
+    try:
+        now = _utcnow()
+        q = db.query(LampOutbox.id).filter(LampOutbox.next_attempt_at <= now)
+        if user_id is not None:
+            q = q.filter(LampOutbox.user_id == user_id)
+        due = [i for (i,) in q.order_by(LampOutbox.user_id, LampOutbox.sensor, LampOutbox.timestamp)
+               .limit(limit or LAMP_OUTBOX_FLUSH_LIMIT)]
+        if not due:
+            return 0, 0
+        db.execute(
+            update(LampOutbox)
+            .where(and_(LampOutbox.id.in_(due), LampOutbox.next_attempt_at <= now))
+            .values(claimed_by=token, next_attempt_at=now + timedelta(seconds=LAMP_OUTBOX_CLAIM_TTL))
+        )
+        db.commit()
+        rows = db.query(LampOutbox.id, LampOutbox.user_id, LampOutbox.sensor, LampOutbox.timestamp,
+                        LampOutbox.payload, LampOutbox.digest, LampOutbox.attempts) \
+            .filter(LampOutbox.claimed_by == token) \
+            .order_by(LampOutbox.user_id, LampOutbox.sensor, LampOutbox.timestamp).all()
+    finally:
+        db.close()
+    if not rows:
+        # All taken by another flush in the meantime
+        return 0, 0
+
+    # Batches never mix users (one URL per participant) nor sensors.
+    batches: List[List[Any]] = []
+    for row in rows:
+        last = batches[-1] if batches else None
+        if last and len(last) < LAMP_BATCH_SIZE and (last[0].user_id, last[0].sensor) == (row.user_id, row.sensor):
+            last.append(row)
+        else:
+            batches.append([row])
+
+    now_ms = int(datetime.now(timezone.utc).timestamp() * 1000)
+
+    def _post(batch: List[Any]) -> Optional[str]:
+        events = [_make_event(r.sensor, json.loads(r.payload), now_ms) for r in batch]
+        return _post_events(batch[0].user_id, events)
+
+    workers = max(1, concurrency or LAMP_CONCURRENCY)
+    with ThreadPoolExecutor(max_workers=min(workers, len(batches))) as pool:
+        results = list(pool.map(_post, batches))
+
+    delivered, failed = 0, 0
+    acked: List[int] = []
+    db = SessionLocal()
+    try:
+        for batch, err in zip(batches, results):
+            metrics.POINTS.inc(len(batch), sensor=batch[0].sensor,
+                               outcome="delivered" if err is None else "retry")
+            if err is None:
+                delivered += len(batch)
+                acked.extend(r.id for r in batch)
+                _record_digests(batch[0].user_id, batch[0].sensor,
+                                {r.timestamp: r.digest for r in batch}, db=db)
+                continue
+            failed += len(batch)
+            print(f"[WARN] LAMP delivery failed for {batch[0].user_id} ({batch[0].sensor}, "
+                  f"{len(batch)} points, attempt {batch[0].attempts + 1}): {err}")
+            for r in batch:
+                backoff = min(LAMP_OUTBOX_MAX_BACKOFF, LAMP_OUTBOX_BACKOFF * 2 ** r.attempts)
+                db.query(LampOutbox).filter_by(id=r.id, claimed_by=token).update({
+                    "attempts": r.attempts + 1,
+                    "next_attempt_at": _utcnow() + timedelta(seconds=backoff),
+                    "last_error": err,
+                    "claimed_by": None,
+                }, synchronize_session=False)
+        with metrics.STAGE_SECONDS.time(stage="db_commit"):
+            if acked:
+                db.query(LampOutbox).filter(LampOutbox.id.in_(acked)).delete(synchronize_session=False)
+            db.commit()
+    finally:
+        db.close()
+    return delivered, failed
+
+
+def flush_all(user_id: Optional[str] = None) -> Tuple[int, int]:
+    """Flush until nothing is due (failed rows wait for their backoff)."""
+    delivered, failed = 0, 0
+    while True:
+        d, f = flush_outbox(user_id=user_id)
+        delivered, failed = delivered + d, failed + f
+        if d == 0:
+            return delivered, failed
+
+
+def outbox_size() -> int:
+    db = SessionLocal()
+    try:
+        size = db.query(LampOutbox).count()
+    finally:
+        db.close()
+    metrics.OUTBOX_SIZE.set(size)
+    return size
@@ -0,0 +1,173 @@
+# jobs/leases.py
+
+import os
+import uuid
+import socket
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Optional, Set
+
+from sqlalchemy import and_, or_, update
+
+from db import SessionLocal, FitbitConnection
+
+# ---- Configuration ----
+# SYNC_WORKER_ID   name of this worker in fitbit_connections.lease_owner
+#                  (default: host:pid:random, unique per process)
+# SYNC_LEASE_TTL   seconds a claimed user stays reserved without a heartbeat;
+#                  after that another worker may take it (crashed worker)
+WORKER_ID = os.getenv("SYNC_WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+SYNC_LEASE_TTL = max(30.0, float(os.getenv("SYNC_LEASE_TTL", "900")))
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _claimable(now: datetime, due_only: bool = False):
+    """
+    Free or expired (and due, with due_only). A lease the claimer already
+    holds is not claimable again: claims are not re-entrant, so two jobs of
+    one process (e.g. a scheduled sync and a push sync in the daemon) never
+    run for the same user, and one's release cannot drop the other's lease.
+    """
+    free = or_(
+        FitbitConnection.lease_owner.is_(None),
+        FitbitConnection.lease_expires_at.is_(None),
+        FitbitConnection.lease_expires_at < now,
+    )
+    if not due_only:
+        return free
+    return and_(free, or_(FitbitConnection.next_sync_at.is_(None), FitbitConnection.next_sync_at <= now))
+
+
+def claim(user_ids: Optional[Iterable[str]] = None, limit: Optional[int] = None,
+          due_only: bool = False, owner: str = WORKER_ID, ttl: float = SYNC_LEASE_TTL) -> List[str]:
+    """
+    Lease users for `owner` and return the ones obtained.
+
+    Candidates are `user_ids` (default: every connection; with due_only,
+    those whose next_sync_at has passed, least recently due first). Each
+    row is taken with a compare-and-set UPDATE guarded by the lease
+    condition, so two workers racing for a user cannot both get it, on
+    any database.
+    """
+    now = _utcnow()
+    db = SessionLocal()
+    try:
+        q = db.query(FitbitConnection.user_id).filter(_claimable(now, due_only))
+        if user_ids is not None:
+            q = q.filter(FitbitConnection.user_id.in_(list(user_ids)))
+        if due_only:
+            q = q.order_by(FitbitConnection.next_sync_at.is_not(None), FitbitConnection.next_sync_at)
+        # A few spare candidates for the ones another worker takes meanwhile
+        candidates = [uid for (uid,) in (q.limit(limit * 2) if limit else q)]
+
+        claimed: List[str] = []
+        expires = now + timedelta(seconds=ttl)
+        for uid in candidates:
+            if limit and len(claimed) >= limit:
+                break
+            result = db.execute(
+                update(FitbitConnection)
+                .where(and_(FitbitConnection.user_id == uid, _claimable(now, due_only)))
+                .values(lease_owner=owner, lease_expires_at=expires)
+            )
+            db.commit()
+            if result.rowcount == 1:
+                claimed.append(uid)
+        return claimed
+    finally:
+        db.close()
+
+
+def renew(user_ids: Iterable[str], owner: str = WORKER_ID, ttl: float = SYNC_LEASE_TTL) -> int:
+    """Extend `owner`'s leases (heartbeat). Returns how many are still held."""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return 0
+    db = SessionLocal()
+    try:
+        result = db.execute(
+            update(FitbitConnection)
+            .where(and_(FitbitConnection.user_id.in_(user_ids), FitbitConnection.lease_owner == owner))
+            .values(lease_expires_at=_utcnow() + timedelta(seconds=ttl))
+        )
+        db.commit()
+        return result.rowcount
+    finally:
+        db.close()
+
+
+def release(user_ids: Iterable[str], next_sync_in: Optional[float] = None,
+            owner: str = WORKER_ID) -> None:
+    """
+    Give `owner`'s leases back; with next_sync_in, the users are not due
+    again (for due_only claims) before that many seconds.
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    values = {"lease_owner": None, "lease_expires_at": None}
+    if next_sync_in is not None:
+        values["next_sync_at"] = _utcnow() + timedelta(seconds=next_sync_in)
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(FitbitConnection)
+            .where(and_(FitbitConnection.user_id.in_(user_ids), FitbitConnection.lease_owner == owner))
+            .values(**values)
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+class Heartbeat:
+    """
+    Renews the leases held by this worker every ttl/3 seconds in a daemon
+    thread, so a long sync keeps its users while a crashed worker's leases
+    expire after at most `ttl`.
+    """
+
+    def __init__(self, owner: str = WORKER_ID, ttl: float = SYNC_LEASE_TTL):
+        self.owner = owner
+        self.ttl = ttl
+        self.held: Set[str] = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, user_ids: Iterable[str]) -> None:
+        with self._lock:
+            self.held.update(user_ids)
+
+    def remove(self, user_ids: Iterable[str]) -> None:
+        with self._lock:
+            self.held.difference_update(user_ids)
+
+    def snapshot(self) -> List[str]:
+        """The users currently held (safe to call from other threads)."""
+        with self._lock:
+            return list(self.held)
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.ttl / 3):
+            try:
+                renew(self.snapshot(), owner=self.owner, ttl=self.ttl)
+            except Exception as e:
+                print(f"[ERROR] Lease heartbeat failed: {e}")
+
+    def start(self) -> "Heartbeat":
+        self._thread = threading.Thread(target=self._loop, name="lease-heartbeat", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def __enter__(self) -> "Heartbeat":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
@@ -2,9 +2,11 @@
 
 import os
 import sys
-import json
-from datetime import datetime, timedelta, timezone
-from typing import Optional
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
 # Make sure imports work whether you run from project root or jobs/
 CURRENT_DIR = os.path.dirname(__file__)
@@ -12,200 +14,657 @@ PROJECT_ROOT = os.path.dirname(CURRENT_DIR)
 if PROJECT_ROOT not in sys.path:
     sys.path.insert(0, PROJECT_ROOT)
 
+from sqlalchemy.exc import IntegrityError
+
 # Env loading
 from dotenv import load_dotenv
 load_dotenv()  # loads .env from project root
 
 # Local modules
-from db import SessionLocal, FitbitConnection
-from fitbit.oauth import refresh_tokens
-from fitbit.sync import (
-    get_profile,
-    get_sleep,
-    get_steps,
-    get_heartrate,
-)
-
-# Optional: posting to mindLAMP
-import requests
-
-LAMP_BASE: Optional[str] = os.getenv("LAMP_BASE")  # e.g. https://api.mind.momonia.net or with /api
-LAMP_AUTH: Optional[str] = os.getenv("LAMP_AUTH")  # e.g. "Basic XXX" or "Bearer YYY"
-
-# ---- Frequency configuration ----
-# You can change these in your .env if you want minute-level instead of hourly:
+import metrics
+from db import SessionLocal, FitbitConnection, FitbitDeviceState, PendingSync, SyncWatermark, init_db
+from fitbit import cache
+from fitbit.tokens import tokens
+from fitbit.ratelimit import RateLimitExceeded
+from fitbit.sync import get_devices, get_profile, last_upload
+# Metrics synced (FITBIT_METRICS) and the engine that fetches them
+from fitbit.registry import ENABLED, by_collection, groups, iter_group
+from fitbit.resample import freq_seconds, local_datetime
+
+# Posting to mindLAMP (outbox + batched, pooled flush)
+from jobs.lamp import LAMP_OUTBOX, deliver_streams, flush_all, outbox_size, prune_digests
+# Leases on fitbit_connections: several workers/hosts on one DATABASE_URL
+from jobs.leases import Heartbeat, claim, release
+
+# ---- Metrics and frequencies ----
+# Which measures are synced, and at what frequency, is declared in
+# fitbit/registry.py: FITBIT_METRICS (default steps,sleep,heartrate) and
+# FITBIT_<METRIC>_FREQ, e.g. for minute-level instead of hourly:
 # FITBIT_STEPS_FREQ=1min
 # FITBIT_HR_FREQ=1min
-STEPS_FREQ = os.getenv("FITBIT_STEPS_FREQ", "1h")  # "1h" or "1min"
-HR_FREQ = os.getenv("FITBIT_HR_FREQ", "1h")        # "1h" or "1min"
-SLEEP_FREQ = "daily"  # kept for clarity; get_sleep ignores it but expects a freq param
+# Any bucket that divides a day works: 1min, 5min, 15min, 1h, 1d...
+
+# ---- Parallelism ----
+# Number of users synced at the same time (1 = sequential, like before).
+SYNC_WORKERS = max(1, int(os.getenv("SYNC_WORKERS", "1")))
+# Users that hit the Fitbit rate limit are requeued within the same run as
+# long as their quota resets less than SYNC_REQUEUE_WINDOW seconds after the
+# run started; the others are left for the next run.
+SYNC_REQUEUE_WINDOW = float(os.getenv("SYNC_REQUEUE_WINDOW", "900"))
+# Seconds between two syncs of the same user (daemon / --worker mode).
+SYNC_INTERVAL = max(60, int(os.getenv("SYNC_INTERVAL", "3600")))
+# --worker mode: users claimed per round, and pause (s) when none is due.
+SYNC_CLAIM_CHUNK = max(1, int(os.getenv("SYNC_CLAIM_CHUNK", "20")))
+SYNC_WORKER_POLL = max(1.0, float(os.getenv("SYNC_WORKER_POLL", "30")))
+
+# ---- Upload pre-check ----
+# Users whose devices have not uploaded to Fitbit since their last complete
+# sync are skipped (1 devices call instead of profile + sleep + intraday).
+SYNC_SKIP_IDLE = os.getenv("SYNC_SKIP_IDLE", "1") == "1"
+# The profile (name, UTC offset) rarely changes: reuse it for this long (s).
+PROFILE_TTL = float(os.getenv("FITBIT_PROFILE_TTL", "86400"))
+# A devices check is reused for this long (s), e.g. between run_once's
+# pre-check pass and the user's sync.
+UPLOAD_CHECK_TTL = float(os.getenv("FITBIT_UPLOAD_CHECK_TTL", "300"))
+# Intraday buckets after the device's last upload are zero-filled by Fitbit
+# until the data arrives, so watermarks stop at lastSyncTime. Without one
+# (no tracker, phone only...) they stay this many seconds behind now.
+SYNC_LATE_LOOKBACK = float(os.getenv("SYNC_LATE_LOOKBACK", "21600"))
+
+
+# ---- Device state (profile cache + last upload) ----
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _device_state(db, user_id: str) -> FitbitDeviceState:
+    state = db.get(FitbitDeviceState, user_id)
+    if state is None:
+        try:
+            db.add(FitbitDeviceState(user_id=user_id, offset_ms=0))
+            db.commit()
+        except IntegrityError:
+            # Created by another worker in the meantime.
+            db.rollback()
+        state = db.get(FitbitDeviceState, user_id)
+    return state
 
 
-# ---- Helpers ----
+def _fresh(fetched_at: Optional[datetime], ttl: float) -> bool:
+    return fetched_at is not None and (_utcnow() - fetched_at).total_seconds() < ttl
 
-def token_expired(row: FitbitConnection) -> bool:
-    """Return True if the access token is expired."""
-    expires_at = row.expires_at
-    if expires_at is None:
-        # Si on n'a pas d'info, on considère le token comme expiré
-        return True
 
-    # Si la valeur en DB est naive → on la convertit en aware UTC
-    if expires_at.tzinfo is None:
-        expires_at = expires_at.replace(tzinfo=timezone.utc)
+def _cached_profile(db, state: FitbitDeviceState, access_token: str) -> Tuple[str, int]:
+    """(display name, offsetFromUTCMillis), from Fitbit at most every PROFILE_TTL."""
+    if not _fresh(state.profile_fetched_at, PROFILE_TTL):
+        user = get_profile(access_token, user_id=state.user_id).get("user", {})
+        state.display_name = user.get("displayName")
+        state.offset_ms = int(user.get("offsetFromUTCMillis", 0))
+        state.profile_fetched_at = _utcnow()
+        db.commit()
+    return state.display_name or "<unknown>", state.offset_ms
+
+
+def _check_upload(db, state: FitbitDeviceState, access_token: str) -> Optional[datetime]:
+    """Latest device upload (lastSyncTime), re-read at most every UPLOAD_CHECK_TTL."""
+    if not _fresh(state.checked_at, UPLOAD_CHECK_TTL):
+        state.last_upload = last_upload(get_devices(access_token, user_id=state.user_id))
+        state.checked_at = _utcnow()
+        db.commit()
+    return state.last_upload
+
 
-    now = datetime.now(timezone.utc)
-    return now >= expires_at
+def _final_until(device_upload: Optional[datetime], now_local: datetime) -> datetime:
+    """Intraday data is final only up to the device's last upload (user local time)."""
+    if device_upload is not None:
+        return min(device_upload, now_local)
+    return now_local - timedelta(seconds=SYNC_LATE_LOOKBACK)
+
+
+def _bucket_floor(dt: datetime, freq: str) -> datetime:
+    """Start of the wall-clock `freq` bucket containing dt."""
+    midnight = datetime.combine(dt.date(), datetime.min.time())
+    into = int((dt - midnight).total_seconds())
+    return midnight + timedelta(seconds=into - into % freq_seconds(freq))
+
+
+def _has_new_upload(state: FitbitDeviceState) -> bool:
+    # No device info (never checked, no tracker, phone app only...) → sync.
+    if state.last_upload is None or state.synced_upload is None:
+        return True
+    return state.last_upload > state.synced_upload
 
 
-def send_to_lamp(user_id: str, sensor: str, payload_data) -> None:
+def check_user(user_id: str) -> Optional[float]:
     """
-    Envoie à mindLAMP un payload déjà 'prêt' (payload_data = UNE mesure).
-    1 appel = 1 sensor_event = 1 mesure (dans data).
+    Pre-check one user: None when nothing was uploaded since the last
+    complete sync, else how much unsynced upload time is pending (seconds,
+    inf when unknown) so users can be prioritized by staleness.
     """
-    if not (LAMP_BASE and LAMP_AUTH):
-        print("[WARN] LAMP_BASE or LAMP_AUTH not set. Skipping send.")
-        return
+    db = SessionLocal()
+    try:
+        access_token = tokens.get(user_id)
+        state = _device_state(db, user_id)
+        _check_upload(db, state, access_token)
+        if not _has_new_upload(state):
+            return None
+        if state.last_upload is None or state.synced_upload is None:
+            return float("inf")
+        return (state.last_upload - state.synced_upload).total_seconds()
+    finally:
+        db.close()
 
-    if not payload_data:
-        print(f"[{user_id}] skip {sensor}: nothing to send.")
+
+# ---- Watermarks ----
+
+def _load_watermarks(db, user_id: str) -> Dict[str, datetime]:
+    rows = db.query(SyncWatermark).filter_by(user_id=user_id).all()
+    return {w.sensor: w.synced_through for w in rows}
+
+
+def _save_watermarks(db, user_id: str, marks: Dict[str, datetime]) -> None:
+    """Stage every sensor's new watermark (one SELECT); the caller commits."""
+    if not marks:
         return
+    rows = {w.sensor: w for w in db.query(SyncWatermark).filter_by(user_id=user_id)
+            .filter(SyncWatermark.sensor.in_(list(marks)))}
+    now = _utcnow()
+    for sensor, synced_through in marks.items():
+        row = rows.get(sensor)
+        if row is None:
+            db.add(SyncWatermark(user_id=user_id, sensor=sensor,
+                                 synced_through=synced_through, updated_at=now))
+        else:
+            row.synced_through = synced_through
+            row.updated_at = now
+
+
+# ---- Per-user sync ----
+
+def sync_user(user_id: str, sensors: Optional[Iterable[str]] = None,
+              since_day: Optional[date] = None) -> bool:
+    """
+    Sync one participant end to end (token, fetch, send, watermarks).
 
-    # Optional: show a tiny sample so you can see what is being sent
-    try:
-        print(f"[{user_id}] {sensor} sample → {json.dumps(payload_data, ensure_ascii=False)[:400]}")
-    except Exception:
-        pass
+    Every enabled metric (fitbit/registry.py) is synced; metrics read from
+    the same Fitbit source share its requests. Each one starts from its own
+    watermark (the start of the last bucket it delivered, in the user's
+    local time), so the hourly run only fetches the minutes since then, and
+    a failure in one source does not make the others start over.
+
+    sensors / since_day narrow a targeted sync (e.g. after a Fitbit
+    subscription notification): only those sensors are synced, starting no
+    later than since_day so late uploads for a past day are picked up.
 
-    payload = {
-        "timestamp": int(datetime.now(timezone.utc).timestamp() * 1000),
-        "sensor": f"fitbit_{sensor}",
-        "data": payload_data,
-    }
+    Opens its own DB session so it can run in a worker thread next to other
+    users. Returns True when every sensor was synced, False when one of them
+    failed (already logged). Raises RateLimitExceeded when the user's Fitbit
+    quota is spent, so the caller can requeue it.
+
+    The duration goes to the sync_user_seconds metric; the sync of
+    SYNC_PROFILE_USER runs under cProfile (metrics.profiled).
+    """
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        with metrics.profiled(f"sync-{user_id}", enabled=user_id == metrics.SYNC_PROFILE_USER):
+            ok = _sync_user(user_id, sensors, since_day)
+        outcome = "ok" if ok else "failed"
+        return ok
+    except RateLimitExceeded:
+        outcome = "deferred"
+        raise
+    finally:
+        metrics.SYNC_SECONDS.observe(time.perf_counter() - started, outcome=outcome)
 
-    url = f"{LAMP_BASE}/participant/{user_id}/sensor_event"
-    headers = {
-        "Authorization": LAMP_AUTH,
-        "Content-Type": "application/json",
-    }
 
-    print(f"POST {url}")
+def _sync_user(user_id: str, sensors: Optional[Iterable[str]], since_day: Optional[date]) -> bool:
+    """sync_user() body (timed and optionally profiled by the wrapper)."""
+    db = SessionLocal()
     try:
-        r = requests.post(url, json=payload, headers=headers, timeout=30)
-        print(f"LAMP POST {sensor} for {user_id} → {r.status_code} {r.text[:200]}")
-    except Exception as e:
-        print(f"[WARN] Failed to POST {sensor} to LAMP for {user_id}: {e}")
+        row = db.query(FitbitConnection).filter_by(user_id=user_id).one_or_none()
+        if row is None:
+            print(f"[WARN] No Fitbit connection for {user_id}, skipping.")
+            return False
+
+        # 1) Token valide pour toute la durée du sync (renouvelé en amont par
+        #    run_once / le refresher ; sinon ici, sous le verrou du user)
+        try:
+            access_token = tokens.get(user_id)
+        except Exception as e:
+            print(f"[ERROR] Token refresh failed for {row.user_id}: {e}")
+            return False
+
+        # 2) Rien de nouveau côté appareil depuis le dernier sync complet ?
+        #    (pas pour un sync ciblé : la notification dit déjà qu'il y a du neuf)
+        #    Puis profil (cache) : nom + fuseau horaire (les heures Fitbit sont locales)
+        state = _device_state(db, user_id)
+        full = sensors is None
+        try:
+            device_upload = _check_upload(db, state, access_token)
+            upload = device_upload if full and SYNC_SKIP_IDLE else None
+            if full and SYNC_SKIP_IDLE and not _has_new_upload(state):
+                print(f"[{row.user_id}] no device upload since {state.synced_upload:%Y-%m-%d %H:%M}, skipped")
+                return True
+            name, offset_ms = _cached_profile(db, state, access_token)
+        except RateLimitExceeded:
+            raise
+        except Exception as e:
+            print(f"[ERROR] Fitbit API error for {row.user_id}: {e}")
+            return False
+
+        print(f"[{row.user_id}] profile: {name}")
+        offset = timedelta(milliseconds=offset_ms)
+        now_local = (datetime.now(timezone.utc) + offset).replace(tzinfo=None, second=0, microsecond=0)
+        today = now_local.date()
+        final_until = _final_until(device_upload, now_local)
+
+        # 3) Point de départ par capteur
+        #    - watermark du capteur s'il existe (on refait le dernier bucket,
+        #      qui pouvait être incomplet) ;
+        #    - sinon last_synced_at (ancien fonctionnement) ;
+        #    - sinon premier sync : les 7 derniers jours.
+        watermarks = _load_watermarks(db, user_id)
+        db.commit()  # no transaction stays open while Fitbit is fetched
+        if row.last_synced_at is not None:
+            default_start = datetime.combine(row.last_synced_at.date(), datetime.min.time())
+        else:
+            default_start = datetime.combine(today - timedelta(days=7), datetime.min.time())
+
+        def _start(sensor: str) -> datetime:
+            start = min(watermarks.get(sensor, default_start), now_local)
+            if since_day is not None:
+                start = min(start, datetime.combine(since_day, datetime.min.time()))
+            return start
+
+        # 4) Métriques activées, groupées par source Fitbit : une seule
+        #    requête par fenêtre (intraday) ou par plage (daily) pour toutes
+        #    les métriques d'une source, chacune depuis son watermark. En
+        #    streaming : le jour N+1 est téléchargé pendant l'envoi du jour N.
+        wanted = None if full else set(sensors)
+        specs = [s for s in ENABLED if wanted is None or s.name in wanted]
+
+        all_ok = True
+        marks: Dict[str, datetime] = {}
+        completed = False
+        try:
+            for group in groups(specs):
+                names = [s.name for s in group]
+                starts = {name: _start(name) for name in names}
+                try:
+                    # 1 sensor_event par mesure ; dans l'outbox (livrée par le flush)
+                    delivered = deliver_streams(row.user_id, names,
+                                                iter_group(group, access_token, starts, now_local, user_id,
+                                                           device_upload))
+                except RateLimitExceeded:
+                    raise
+                except Exception as e:
+                    print(f"[ERROR] Fitbit API error for {row.user_id} ({', '.join(names)}): {e}")
+                    all_ok = False
+                    continue
+
+                for spec in group:
+                    stats = delivered[spec.name]
+                    print(stats.summary(row.user_id))
+                    # Le watermark n'avance que si tout le capteur a été livré (ou mis
+                    # dans l'outbox, qui s'occupe ensuite des retries)
+                    if stats.failed_points:
+                        all_ok = False
+                    elif stats.last_timestamp is not None:
+                        if spec.daily:
+                            # daily timestamps are UTC midnights of the day
+                            marks[spec.name] = datetime.fromtimestamp(stats.last_timestamp / 1000, timezone.utc).replace(tzinfo=None)
+                        else:
+                            # wall-clock start of the last bucket (inverse of fitbit.resample),
+                            # pas au-delà du dernier upload : les buckets suivants, remplis de
+                            # zéros, seront refaits quand les données arriveront
+                            marks[spec.name] = min(local_datetime(stats.last_timestamp),
+                                                   _bucket_floor(final_until, spec.freq))
+            completed = True
+        finally:
+            # 5) Une seule écriture par user : les watermarks (même si un
+            #    capteur suivant a levé RateLimitExceeded), last_synced_at =
+            #    dernier run où tous les capteurs sont passés, et l'upload vu
+            #    au début, couvert jusqu'au prochain
+            _save_watermarks(db, user_id, marks)
+            if completed and all_ok and full:
+                row.last_synced_at = datetime.now(timezone.utc)
+                if upload is not None:
+                    state.synced_upload = upload
+            with metrics.STAGE_SECONDS.time(stage="db_commit"):
+                db.commit()
+        return all_ok
+    finally:
+        db.close()
+
 
+# ---- Push-triggered syncs (Fitbit subscriptions) ----
+
+# Fitbit collection → enabled metrics synced for it
+COLLECTION_SENSORS = by_collection(ENABLED)
+
+
+def pending_syncs(limit: int = 1000) -> Dict[str, Tuple[List[int], Set[str], date]]:
+    """
+    Read queued notifications, grouped per user:
+    {user_id: (pending row ids, sensors to sync, earliest changed day)}.
+    """
+    db = SessionLocal()
+    try:
+        rows = db.query(PendingSync).order_by(PendingSync.created_at).limit(limit).all()
+    finally:
+        db.close()
 
-def send_points_one_by_one(user_id: str, sensor_name: str, points: list) -> None:
+    grouped: Dict[str, Tuple[List[int], Set[str], date]] = {}
+    for r in rows:
+        day = date.fromisoformat(r.day)
+        ids, sensors, since = grouped.get(r.user_id, ([], set(), day))
+        ids.append(r.id)
+        sensors.update(COLLECTION_SENSORS.get(r.collection, ()))
+        grouped[r.user_id] = (ids, sensors, min(since, day))
+    return grouped
+
+
+def sync_pending_user(user_id: str, ids: List[int], sensors: Set[str], since_day: date) -> bool:
+    """Targeted sync for one user's notifications; drops them once delivered."""
+    done = not sensors or sync_user(user_id, sensors=sensors, since_day=since_day)
+    if done:
+        db = SessionLocal()
+        try:
+            db.query(PendingSync).filter(PendingSync.id.in_(ids)).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+    return done
+
+
+def run_pending(workers: Optional[int] = None, flush: bool = True) -> None:
+    """Process the notification queue once (cron alternative to the daemon)."""
+    workers = max(1, workers or SYNC_WORKERS)
+    init_db()
+    grouped = pending_syncs()
+    if not grouped:
+        print("No pending notifications.")
+        return
+    # Users being synced elsewhere keep their notifications for the next pass
+    user_ids = claim(grouped)
+    with Heartbeat() as hb:
+        hb.add(user_ids)
+        try:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="push") as pool:
+                futures = {pool.submit(sync_pending_user, uid, *grouped[uid]): uid for uid in user_ids}
+                for fut in as_completed(futures):
+                    try:
+                        fut.result()
+                    except Exception as e:
+                        print(f"[ERROR] Targeted sync failed for {futures[fut]}: {e}")
+            if flush:
+                _flush_outbox(user_ids)
+        finally:
+            release(user_ids)
+    metrics.write_file()
+
+
+def _flush_outbox(user_ids: List[str]) -> None:
     """
-    1 point = 1 événement → chaque mesure devient un sensor_event séparé.
+    Deliver what the sync queued for `user_ids` (retries of earlier failures
+    included). flush_outbox claims the rows it posts, so a concurrent flush
+    of the same users (daemon, jobs/flush_outbox.py) never posts them twice.
     """
-    for point in points:
-        send_to_lamp(user_id, sensor_name, point)
+    if not LAMP_OUTBOX:
+        return
+    started = time.monotonic()
+    delivered, failed = 0, 0
+    for uid in user_ids:
+        d, f = flush_all(user_id=uid)
+        delivered, failed = delivered + d, failed + f
+    print(f"Outbox: {delivered} points delivered, {failed} failed, {outbox_size()} waiting "
+          f"({time.monotonic() - started:.1f}s)")
 
 
 # ---- Main job ----
 
-def run_once() -> None:
-    db = SessionLocal()
-    try:
-        rows = db.query(FitbitConnection).all()
-        if not rows:
-            print("No Fitbit connections found. Run the auth flow first.")
+def _sync_batch(user_ids: List[str], workers: int) -> Tuple[int, int, List[Tuple[float, str]]]:
+    """
+    Sync `user_ids` with `workers` threads.
+
+    Returns (ok, failed, deferred) where deferred holds (ready_at, user_id)
+    for users that hit the rate limit; ready_at is a time.monotonic() value.
+    """
+    ok, failed = 0, 0
+    deferred: List[Tuple[float, str]] = []
+
+    def _outcome(user_id: str, call) -> None:
+        nonlocal ok, failed
+        try:
+            done = call()
+        except RateLimitExceeded as e:
+            print(f"[{user_id}] deferred: {e}")
+            deferred.append((time.monotonic() + e.retry_in, user_id))
             return
+        except Exception as e:
+            print(f"[ERROR] Unexpected error while syncing {user_id}: {e}")
+            done = False
+        if done:
+            ok += 1
+        else:
+            failed += 1
+
+    if workers == 1:
+        for user_id in user_ids:
+            _outcome(user_id, lambda: sync_user(user_id))
+    else:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sync") as pool:
+            futures = {pool.submit(sync_user, uid): uid for uid in user_ids}
+            for fut in as_completed(futures):
+                _outcome(futures[fut], fut.result)
+
+    return ok, failed, deferred
+
+
+def _prioritize(user_ids: List[str], workers: int) -> List[str]:
+    """
+    Devices pre-check for every user (in parallel): drop users with no new
+    upload and order the rest most-stale first, so the API budget goes to
+    users who actually have new data. Users whose check fails are kept, last;
+    their sync will report (or defer) the error.
+    """
+    staleness: Dict[str, float] = {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="check") as pool:
+        futures = {pool.submit(check_user, uid): uid for uid in user_ids}
+        for fut in as_completed(futures):
+            uid = futures[fut]
+            try:
+                pending = fut.result()
+            except Exception as e:
+                print(f"[{uid}] pre-check failed: {e}")
+                pending = -1.0
+            if pending is not None:
+                staleness[uid] = pending
+    return sorted(staleness, key=staleness.get, reverse=True)
 
-        # Date "fin" commune à tous : aujourd'hui (en UTC)
-        today = datetime.now(timezone.utc).date()
-        end_ymd = today.isoformat()
 
-        for row in rows:
-            # 1) Rafraîchir le token si besoin
-            if token_expired(row):
-                try:
-                    new = refresh_tokens(row.refresh_token)
-                    row.access_token = new["access_token"]
-                    row.refresh_token = new["refresh_token"]
-                    # new["expires_at"] est isoformat() sans tz → naive
-                    row.expires_at = datetime.fromisoformat(new["expires_at"])
-                    db.commit()
-                    print(f"[{row.user_id}] token refreshed")
-                except Exception as e:
-                    print(f"[ERROR] Token refresh failed for {row.user_id}: {e}")
-                    continue
+def run_once(workers: Optional[int] = None, flush: bool = True) -> None:
+    """
+    Sync every connected user.
 
-            access_token = row.access_token
+    workers: number of users synced concurrently (defaults to SYNC_WORKERS).
+    With 1 worker users are processed one after another, as before. Each
+    user runs in its own thread with its own DB session; an exception or a
+    slow participant only affects that user's future.
 
-            # 2) Déterminer la date de début en fonction de last_synced_at
-            if row.last_synced_at is None:
-                # Premier sync : on prend les 7 derniers jours
-                start_date = today - timedelta(days=7)
-            else:
-                # Sync incrémental : on reprend à partir de la dernière sync
-                # (tu peux reculer d'1 jour si tu veux être ultra safe)
-                start_date = row.last_synced_at.date()
+    Users that run out of Fitbit quota are requeued and retried once their
+    budget resets, as long as that happens within SYNC_REQUEUE_WINDOW.
 
-            start_ymd = start_date.isoformat()
+    With SYNC_SKIP_IDLE, users whose devices have not uploaded since their
+    last complete sync are skipped and the others run most-stale first.
 
-            # 3) Récupérer les données Fitbit sur [start_ymd, end_ymd]
-            try:
-                profile = get_profile(access_token)
+    Points go to the LAMP outbox; with flush (default) it is delivered at
+    the end of the run, otherwise leave it to jobs/flush_outbox.py.
 
-                # Sleep: daily durations
-                sleep_raw = get_sleep(access_token, start_ymd, end_ymd, SLEEP_FREQ)
+    Only users this process can lease are synced, so concurrent runs (or
+    --worker processes) against the same DB never sync a user twice.
+    """
+    workers = max(1, workers or SYNC_WORKERS)
+    init_db()  # creates any table added since the DB was first initialized
 
-                # Steps: hourly or per-minute totals
-                steps_raw = get_steps(access_token, start_ymd, end_ymd, STEPS_FREQ)
+    db = SessionLocal()
+    try:
+        user_ids = [uid for (uid,) in db.query(FitbitConnection.user_id).all()]
+    finally:
+        db.close()
 
-                # HR: hourly or per-minute averages
-                hr_raw = get_heartrate(access_token, start_ymd, end_ymd, HR_FREQ)
-            except Exception as e:
-                print(f"[ERROR] Fitbit API error for {row.user_id}: {e}")
-                continue
+    if not user_ids:
+        print("No Fitbit connections found. Run the auth flow first.")
+        return
 
-            # 4) Transformer le sleep (date → timestamp) pour avoir "une mesure"
-            sleep_points = []
-            for s in sleep_raw:
-                # s = {"date": "YYYY-MM-DD", "duration_minutes": float}
+    # Users leased by another worker (or another run_once) are theirs
+    total = len(user_ids)
+    user_ids = claim(user_ids)
+    if len(user_ids) < total:
+        print(f"{total - len(user_ids)} users are being synced by another worker, skipped")
+    with Heartbeat() as hb:
+        hb.add(user_ids)
+        try:
+            _run_claimed(user_ids, total, workers, flush)
+        finally:
+            release(user_ids, next_sync_in=SYNC_INTERVAL)
+    prune_digests()
+    cache.prune()
+    outbox_size()  # refreshes the lamp_outbox_points gauge
+    metrics.write_file()
+
+
+def _run_claimed(user_ids: List[str], total: int, workers: int, flush: bool) -> None:
+    """run_once() body, on the users it holds a lease for."""
+    # Renouveler en lot les tokens qui expirent bientôt, avant de lancer les
+    # workers : aucun refresh sur le chemin critique d'un sync.
+    refreshed, refresh_failed = tokens.refresh_due(user_ids, limit=len(user_ids))
+    if refreshed or refresh_failed:
+        print(f"Tokens: {refreshed} refreshed, {refresh_failed} failed")
+
+    started = time.monotonic()
+    deadline = started + SYNC_REQUEUE_WINDOW
+
+    claimed = user_ids
+    if SYNC_SKIP_IDLE:
+        user_ids = _prioritize(user_ids, workers)
+        print(f"Pre-check: {len(user_ids)} of {len(claimed)} users have new device uploads")
+
+    ok, failed, deferred = _sync_batch(user_ids, workers)
+    while deferred:
+        deferred.sort()
+        ready_at = deferred[0][0]
+        if ready_at > deadline:
+            break
+        batch = [uid for (t, uid) in deferred if t <= ready_at + 60]
+        deferred = [(t, uid) for (t, uid) in deferred if t > ready_at + 60]
+        time.sleep(max(0.0, ready_at - time.monotonic()))
+        print(f"Requeue: retrying {len(batch)} rate-limited users")
+        b_ok, b_failed, b_deferred = _sync_batch(batch, workers)
+        ok, failed = ok + b_ok, failed + b_failed
+        deferred.extend(b_deferred)
+
+    if flush:
+        _flush_outbox(claimed)
+
+    if deferred:
+        print(f"{len(deferred)} users still rate-limited, left for the next run: "
+              f"{', '.join(uid for (_, uid) in deferred)}")
+    print(
+        f"Sync finished: {ok} ok, {failed} failed, {len(deferred)} deferred, "
+        f"{len(claimed) - len(user_ids)} idle, {total - len(claimed)} leased elsewhere out of {total} users in {time.monotonic() - started:.1f}s ({workers} workers)"
+    )
+
+
+def run_worker(workers: Optional[int] = None, chunk: int = SYNC_CLAIM_CHUNK,
+               flush: bool = True) -> None:
+    """
+    Long-running worker: repeatedly lease up to `chunk` users that are due
+    (next_sync_at passed), sync them and release them until SYNC_INTERVAL
+    later. Start as many as needed, on one host or several sharing
+    DATABASE_URL; the leases split the users between them, and users of a
+    crashed worker are picked up once its leases expire (SYNC_LEASE_TTL).
+    """
+    workers = max(1, workers or SYNC_WORKERS)
+    init_db()
+    hb = Heartbeat()
+    # Only the users leased by this worker: never another worker's tokens
+    refresher = tokens.start_background(hb.snapshot)
+    metrics.serve()
+    print(f"Worker started: {workers} threads, chunks of {chunk} users")
+    try:
+        with hb:
+            while True:
+                user_ids = claim(limit=chunk, due_only=True)
+                if not user_ids:
+                    time.sleep(SYNC_WORKER_POLL)
+                    continue
+                hb.add(user_ids)
                 try:
-                    d = datetime.strptime(s["date"], "%Y-%m-%d").date()
-                    dt = datetime(d.year, d.month, d.day, tzinfo=timezone.utc)
-                    ts = int(dt.timestamp() * 1000)
-                    sleep_points.append({
-                        "timestamp": ts,
-                        "duration_minutes": s["duration_minutes"],
-                    })
-                except Exception as e:
-                    print(f"[WARN] Failed to parse sleep entry {s}: {e}")
-
-            # steps_raw and hr_raw are already lists of points with timestamp
-            steps_points = steps_raw          # [{"timestamp":..., "steps":...}, ...]
-            hr_points = hr_raw                # [{"timestamp":..., "heartrate":...}, ...]
-
-            # 5) Petit résumé console
-            display_name = profile.get("user", {}).get("displayName", "<unknown>")
-            print(f"[{row.user_id}] profile: {display_name}")
-            print(
-                f"[{row.user_id}] counts → steps:{len(steps_points)} "
-                f"sleep:{len(sleep_points)} hr:{len(hr_points)}"
-            )
-
-            # 6) Envoyer 1 événement par mesure
-            if steps_points:
-                send_points_one_by_one(row.user_id, "steps", steps_points)
-            if sleep_points:
-                send_points_one_by_one(row.user_id, "sleep", sleep_points)
-            if hr_points:
-                send_points_one_by_one(row.user_id, "heartrate", hr_points)
-
-            # 7) Mettre à jour last_synced_at une fois les envois terminés
-            row.last_synced_at = datetime.now(timezone.utc)
-            db.commit()
+                    todo = _prioritize(user_ids, workers) if SYNC_SKIP_IDLE else user_ids
+                    ok, failed, deferred = _sync_batch(todo, workers)
+                    if flush:
+                        _flush_outbox(user_ids)
+                    retry = {uid: max(0.0, t - time.monotonic()) for (t, uid) in deferred}
+                    for uid, delay in retry.items():
+                        release([uid], next_sync_in=delay + 1)
+                    release([uid for uid in user_ids if uid not in retry], next_sync_in=SYNC_INTERVAL)
+                finally:
+                    hb.remove(user_ids)
+                    # No-op for the users released above; frees the chunk if the sync raised
+                    release(user_ids)
+                print(f"Chunk done: {ok} ok, {failed} failed, {len(deferred)} deferred, "
+                      f"{len(user_ids) - len(todo)} idle")
+                metrics.write_file()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        refresher.set()
+        release(hb.held)
 
+
+def profile_user(user_id: str, flush: bool = True) -> None:
+    """Sync one user under cProfile (dump in SYNC_PROFILE_DIR, top entries printed)."""
+    init_db()
+    if not claim([user_id]):
+        print(f"[{user_id}] is being synced by another worker, try again later")
+        return
+    try:
+        with metrics.profiled(f"sync-{user_id}"):
+            sync_user(user_id)
+            if flush:
+                _flush_outbox([user_id])
     finally:
-        db.close()
+        release([user_id])
+    metrics.write_file()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Sync Fitbit data to mindLAMP.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="users synced in parallel (default: SYNC_WORKERS or 1)")
+    parser.add_argument("--pending", action="store_true",
+                        help="only process queued Fitbit subscription notifications")
+    parser.add_argument("--no-flush", dest="flush", action="store_false",
+                        help="leave queued points to jobs/flush_outbox.py")
+    parser.add_argument("--worker", action="store_true",
+                        help="keep running, leasing due users in chunks (scale out with several)")
+    parser.add_argument("--chunk", type=int, default=SYNC_CLAIM_CHUNK,
+                        help="--worker: users leased per round (default: SYNC_CLAIM_CHUNK)")
+    parser.add_argument("--profile-user", metavar="USER_ID", default=None,
+                        help="sync only this user, under cProfile")
+    args = parser.parse_args(argv)
+    if args.profile_user:
+        profile_user(args.profile_user, flush=args.flush)
+    elif args.worker:
+        run_worker(workers=args.workers, chunk=max(1, args.chunk), flush=args.flush)
+    elif args.pending:
+        run_pending(workers=args.workers, flush=args.flush)
+    else:
+        run_once(workers=args.workers, flush=args.flush)
 
 
 if __name__ == "__main__":
-    run_once()
-
+    main()
@@ -0,0 +1,306 @@
+import os
+import io
+import abc
+import time
+import pstats
+import cProfile
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# ---- Configuration ----
+# METRICS_ENABLED      0 turns every instrument below into a no-op
+# METRICS_FILE         jobs write the registry there (Prometheus text format,
+#                      e.g. for node_exporter's textfile collector) at the end
+#                      of each run; use one file per job
+# METRICS_PORT         long-running workers (daemon, --worker) serve /metrics
+#                      on this port (0 = off); the Flask app has its own route
+# SYNC_PROFILE_USER    run that user's sync under cProfile (see profiled())
+# SYNC_PROFILE_DIR     where the .prof dumps go
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+METRICS_FILE = os.getenv("METRICS_FILE")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+SYNC_PROFILE_USER = os.getenv("SYNC_PROFILE_USER")
+SYNC_PROFILE_DIR = os.getenv("SYNC_PROFILE_DIR", ".")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds: from a cache hit to a slow LAMP POST / whole user sync
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SYNC_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+LabelKey = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+# ---- Instruments ----
+
+class _Metric(abc.ABC):
+    """A metric family: one value (or histogram) per combination of labels."""
+
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelKey:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def _label_str(self, key: LabelKey, extra: Sequence[Tuple[str, str]] = ()) -> str:
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+    @abc.abstractmethod
+    def samples(self) -> List[str]:
+        """The family's sample lines, without the HELP/TYPE header."""
+
+    def render(self) -> List[str]:
+        lines = self.samples()
+        if not lines:
+            return []
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"] + lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = ()):
+        super().__init__(name, doc, labels)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        if not METRICS_ENABLED or not amount:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{self._label_str(k)} {_format(v)}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # per label set: [count per bucket..., sum]
+        self._values: Dict[LabelKey, List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0.0] * (len(self.buckets) + 1)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+                    break
+            row[-1] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe the duration of the `with` block (also when it raises)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels: str) -> float:
+        row = self._values.get(self._key(labels))
+        return sum(row[:-1]) if row else 0
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        lines = []
+        for key, row in items:
+            cumulative = 0.0
+            for bound, n in zip(self.buckets, row):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{self._label_str(key, [('le', _format(bound))])} "
+                             f"{_format(cumulative)}")
+            lines.append(f"{self.name}_sum{self._label_str(key)} {row[-1]!r}")
+            lines.append(f"{self.name}_count{self._label_str(key)} {_format(cumulative)}")
+        return lines
+
+
+# ---- Registry ----
+
+class Registry:
+    """Every metric of the process, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for m in metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str) -> None:
+        """Write atomically, so a collector never reads a half-written file."""
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, doc: str, labels: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, doc, labels))
+
+
+def gauge(name: str, doc: str, labels: Sequence[str] = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, doc, labels))
+
+
+def histogram(name: str, doc: str, labels: Sequence[str] = (),
+              buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, doc, labels, buckets))
+
+
+# ---- Sync pipeline metrics ----
+# Labels stay low-cardinality (endpoint, sensor, stage, outcome): no user ids.
+
+FITBIT_REQUESTS = counter("fitbit_requests_total", "Fitbit API responses", ("endpoint", "status"))
+FITBIT_LATENCY = histogram("fitbit_request_seconds", "Fitbit API round trip", ("endpoint",))
+FITBIT_CACHE_HITS = counter("fitbit_cache_hits_total", "Intraday days served from the response cache",
+                            ("endpoint",))
+FITBIT_RATE_REMAINING = histogram("fitbit_rate_limit_remaining", "Calls left in the user's hourly "
+                                  "budget, seen on each response", buckets=(0, 5, 10, 30, 75, 120, 150))
+FITBIT_RATE_LIMITED = counter("fitbit_rate_limited_total", "429s received (429) and syncs given back: "
+                              "budget spent (budget), 429 retries exhausted (429_retries)", ("reason",))
+TOKEN_REFRESHES = counter("fitbit_token_refreshes_total", "OAuth token refreshes", ("outcome",))
+STAGE_SECONDS = histogram("sync_stage_seconds", "Time spent per pipeline stage", ("stage",))
+POINTS = counter("lamp_points_total", "Points handed over for delivery", ("sensor", "outcome"))
+LAMP_REQUESTS = counter("lamp_requests_total", "sensor_event POSTs to mindLAMP", ("status",))
+LAMP_LATENCY = histogram("lamp_request_seconds", "mindLAMP POST round trip")
+NOTIFICATIONS = counter("fitbit_notifications_total", "Subscription notifications received",
+                        ("outcome",))
+OUTBOX_SIZE = gauge("lamp_outbox_points", "Points waiting in the LAMP outbox")
+SYNC_SECONDS = histogram("sync_user_seconds", "Duration of one user's sync", ("outcome",),
+                         buckets=SYNC_BUCKETS)
+DAEMON_QUEUE_DEPTH = gauge("daemon_queue_depth", "Daemon sync jobs due but waiting for a free worker")
+DAEMON_SYNC_LAG = gauge("daemon_sync_lag_seconds", "Daemon scheduling lag: last and longest start delay "
+                        "of a sync job, and how long the oldest waiting job has waited", ("kind",))
+
+
+# ---- Exposition ----
+
+def write_file(path: Optional[str] = None) -> None:
+    """Dump the registry to METRICS_FILE (no-op when unset)."""
+    path = path or METRICS_FILE
+    if not (path and METRICS_ENABLED):
+        return
+    try:
+        REGISTRY.write(path)
+    except OSError as e:
+        print(f"[WARN] Could not write metrics to {path}: {e}")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass  # one line per scrape is noise
+
+
+def serve(port: int = METRICS_PORT) -> Optional[ThreadingHTTPServer]:
+    """Serve /metrics from a daemon thread (port 0 = disabled)."""
+    if not (port and METRICS_ENABLED):
+        return None
+    server = ThreadingHTTPServer(("", port), _Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"Metrics on :{port}/metrics")
+    return server
+
+
+# ---- Profiling ----
+
+_profiling = threading.local()
+
+
+@contextmanager
+def profiled(name: str, enabled: bool = True, top: int = 25) -> Iterator[None]:
+    """
+    Run the block under cProfile, dump it to SYNC_PROFILE_DIR/<name>.prof
+    (snakeviz, pstats...) and print the `top` entries by cumulative time.
+    Only the calling thread is profiled: fetches done by the prefetch pool
+    show up as time waiting on their futures. Nested blocks are part of
+    the outer profile.
+    """
+    if not enabled or getattr(_profiling, "active", False):
+        yield
+        return
+    profile = cProfile.Profile()
+    _profiling.active = True
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        _profiling.active = False
+        path = os.path.join(SYNC_PROFILE_DIR, f"{name}.prof")
+        profile.dump_stats(path)
+        out = io.StringIO()
+        pstats.Stats(profile, stream=out).sort_stats("cumulative").print_stats(top)
+        print(f"[profile] {name} → {path}\n{out.getvalue()}")
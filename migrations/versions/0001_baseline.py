@@ -0,0 +1,37 @@
+"""baseline: fitbit_connections
+
+Revision ID: 0001
+Revises:
+Create Date: 2025-11-10
+
+The original schema. DBs created by the old create_all() already have the
+table, so it is only created when missing.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    if sa.inspect(op.get_bind()).has_table("fitbit_connections"):
+        return
+    op.create_table(
+        "fitbit_connections",
+        sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("user_id", sa.String(128), nullable=False, unique=True),
+        sa.Column("fitbit_user_id", sa.String(128), nullable=False),
+        sa.Column("access_token", sa.Text, nullable=False),
+        sa.Column("refresh_token", sa.Text, nullable=False),
+        sa.Column("scope", sa.String(512), nullable=False),
+        sa.Column("token_type", sa.String(32), nullable=False),
+        sa.Column("expires_at", sa.DateTime, nullable=False),
+        sa.Column("last_synced_at", sa.DateTime, nullable=True),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("fitbit_connections")
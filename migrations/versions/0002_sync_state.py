@@ -0,0 +1,122 @@
+"""sync state tables and lease columns
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+
+Response cache, delivery digests, watermarks, subscription queue, device
+state, backfill checkpoints, LAMP outbox, and the lease columns on
+fitbit_connections. Guarded: DBs that got some of them from create_all()
+before migrations existed only receive what they lack.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def _create(insp, name: str, *columns) -> None:
+    if not insp.has_table(name):
+        op.create_table(name, *columns)
+
+
+def upgrade() -> None:
+    insp = sa.inspect(op.get_bind())
+
+    present = {c["name"] for c in insp.get_columns("fitbit_connections")}
+    for column in (
+        sa.Column("lease_owner", sa.String(128), nullable=True),
+        sa.Column("lease_expires_at", sa.DateTime, nullable=True),
+        sa.Column("next_sync_at", sa.DateTime, nullable=True),
+    ):
+        if column.name not in present:
+            op.add_column("fitbit_connections", column)
+
+    _create(
+        insp, "fitbit_response_cache",
+        sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("user_id", sa.String(128), nullable=False),
+        sa.Column("resource", sa.String(32), nullable=False),
+        sa.Column("day", sa.String(10), nullable=False),
+        sa.Column("detail", sa.String(8), nullable=False),
+        sa.Column("payload", sa.Text, nullable=False),
+        sa.Column("fetched_at", sa.DateTime, nullable=False),
+        sa.UniqueConstraint("user_id", "resource", "day", "detail"),
+    )
+    _create(
+        insp, "lamp_delivery_digests",
+        sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("user_id", sa.String(128), nullable=False),
+        sa.Column("sensor", sa.String(32), nullable=False),
+        sa.Column("timestamp", sa.BigInteger, nullable=False),
+        sa.Column("digest", sa.String(16), nullable=False),
+        sa.UniqueConstraint("user_id", "sensor", "timestamp"),
+    )
+    _create(
+        insp, "lamp_outbox",
+        sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("user_id", sa.String(128), nullable=False),
+        sa.Column("sensor", sa.String(32), nullable=False),
+        sa.Column("timestamp", sa.BigInteger, nullable=False),
+        sa.Column("payload", sa.Text, nullable=False),
+        sa.Column("digest", sa.String(16), nullable=False),
+        sa.Column("attempts", sa.Integer, nullable=False),
+        sa.Column("next_attempt_at", sa.DateTime, nullable=False),
+        sa.Column("last_error", sa.Text, nullable=True),
+        sa.Column("created_at", sa.DateTime, nullable=False),
+        sa.UniqueConstraint("user_id", "sensor", "timestamp"),
+    )
+    _create(
+        insp, "sync_watermarks",
+        sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("user_id", sa.String(128), nullable=False),
+        sa.Column("sensor", sa.String(32), nullable=False),
+        sa.Column("synced_through", sa.DateTime, nullable=False),
+        sa.Column("updated_at", sa.DateTime, nullable=False),
+        sa.UniqueConstraint("user_id", "sensor"),
+    )
+    _create(
+        insp, "pending_syncs",
+        sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("user_id", sa.String(128), nullable=False),
+        sa.Column("collection", sa.String(32), nullable=False),
+        sa.Column("day", sa.String(10), nullable=False),
+        sa.Column("created_at", sa.DateTime, nullable=False),
+        sa.UniqueConstraint("user_id", "collection", "day"),
+    )
+    _create(
+        insp, "fitbit_device_state",
+        sa.Column("user_id", sa.String(128), primary_key=True),
+        sa.Column("display_name", sa.String(256), nullable=True),
+        sa.Column("offset_ms", sa.BigInteger, nullable=False),
+        sa.Column("profile_fetched_at", sa.DateTime, nullable=True),
+        sa.Column("last_upload", sa.DateTime, nullable=True),
+        sa.Column("synced_upload", sa.DateTime, nullable=True),
+        sa.Column("checked_at", sa.DateTime, nullable=True),
+    )
+    _create(
+        insp, "backfill_jobs",
+        sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("user_id", sa.String(128), nullable=False),
+        sa.Column("start_day", sa.String(10), nullable=False),
+        sa.Column("end_day", sa.String(10), nullable=False),
+        sa.Column("next_day", sa.String(10), nullable=False),
+        sa.Column("done_sensors", sa.String(64), nullable=False),
+        sa.Column("status", sa.String(16), nullable=False),
+        sa.Column("error", sa.Text, nullable=True),
+        sa.Column("created_at", sa.DateTime, nullable=False),
+        sa.Column("updated_at", sa.DateTime, nullable=False),
+        sa.UniqueConstraint("user_id", "start_day", "end_day"),
+    )
+
+
+def downgrade() -> None:
+    for name in ("backfill_jobs", "fitbit_device_state", "pending_syncs", "sync_watermarks",
+                 "lamp_outbox", "lamp_delivery_digests", "fitbit_response_cache"):
+        op.drop_table(name)
+    with op.batch_alter_table("fitbit_connections") as batch:
+        for column in ("next_sync_at", "lease_expires_at", "lease_owner"):
+            batch.drop_column(column)
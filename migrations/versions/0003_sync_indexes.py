@@ -0,0 +1,40 @@
+"""indexes for the sync-state queries
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+
+Webhook owner lookup, token refresh and lease claims on
+fitbit_connections; digest pruning; due outbox rows; notification queue;
+unfinished backfills.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+INDEXES = (
+    ("ix_fitbit_connections_fitbit_user_id", "fitbit_connections", ["fitbit_user_id"]),
+    ("ix_fitbit_connections_expires_at", "fitbit_connections", ["expires_at"]),
+    ("ix_fitbit_connections_next_sync_at", "fitbit_connections", ["next_sync_at"]),
+    ("ix_lamp_delivery_digests_timestamp", "lamp_delivery_digests", ["timestamp"]),
+    ("ix_lamp_outbox_next_attempt_at", "lamp_outbox", ["next_attempt_at"]),
+    ("ix_lamp_outbox_user_due", "lamp_outbox", ["user_id", "next_attempt_at"]),
+    ("ix_pending_syncs_created_at", "pending_syncs", ["created_at"]),
+    ("ix_backfill_jobs_status", "backfill_jobs", ["status"]),
+)
+
+
+def upgrade() -> None:
+    insp = sa.inspect(op.get_bind())
+    for name, table, columns in INDEXES:
+        if name not in {ix["name"] for ix in insp.get_indexes(table)}:
+            op.create_index(name, table, columns)
+
+
+def downgrade() -> None:
+    for name, table, _ in INDEXES:
+        op.drop_index(name, table_name=table)
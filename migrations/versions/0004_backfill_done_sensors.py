@@ -0,0 +1,29 @@
+"""widen backfill_jobs.done_sensors
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+
+The checkpoint lists the metrics of a window already delivered; with the
+metric registry (FITBIT_METRICS) that can be far more than the original
+steps,sleep,heartrate.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("backfill_jobs") as batch:
+        batch.alter_column("done_sensors", existing_type=sa.String(64), type_=sa.String(512),
+                           existing_nullable=False)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("backfill_jobs") as batch:
+        batch.alter_column("done_sensors", existing_type=sa.String(512), type_=sa.String(64),
+                           existing_nullable=False)
@@ -0,0 +1,26 @@
+"""lamp_outbox.claimed_by
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17
+
+Outbox rows are claimed by the flush that posts them, so several
+processes flushing the same database never post a row twice.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("lamp_outbox") as batch:
+        batch.add_column(sa.Column("claimed_by", sa.String(32), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("lamp_outbox") as batch:
+        batch.drop_column("claimed_by")
@@ -0,0 +1,26 @@
+"""index for response cache pruning
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17
+
+fitbit.cache.prune() deletes responses by fetched_at.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    insp = sa.inspect(op.get_bind())
+    if "ix_fitbit_response_cache_fetched_at" in {ix["name"] for ix in insp.get_indexes("fitbit_response_cache")}:
+        return
+    op.create_index("ix_fitbit_response_cache_fetched_at", "fitbit_response_cache", ["fetched_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_fitbit_response_cache_fetched_at", table_name="fitbit_response_cache")
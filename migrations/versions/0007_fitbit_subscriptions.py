@@ -0,0 +1,32 @@
+"""fitbit_subscriptions
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17
+
+Subscription ids are short hashes (Fitbit caps them at 50 characters);
+this table maps each one back to its user and collection.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    if sa.inspect(op.get_bind()).has_table("fitbit_subscriptions"):
+        return
+    op.create_table(
+        "fitbit_subscriptions",
+        sa.Column("subscription_id", sa.String(50), primary_key=True),
+        sa.Column("user_id", sa.String(128), nullable=False),
+        sa.Column("collection", sa.String(32), nullable=False),
+        sa.Column("created_at", sa.DateTime, nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("fitbit_subscriptions")
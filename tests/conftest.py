@@ -0,0 +1,16 @@
+# tests/conftest.py
+#
+# Shared setup: the project root on sys.path (the tests import it as the
+# jobs do), and one throwaway SQLite file for the whole run (never
+# fitbit.db): a file rather than sqlite:// so the worker threads of a flush
+# or a sync see the same database.
+
+import os
+import sys
+import tempfile
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp(prefix='fitbit-tests-')}/test.db")
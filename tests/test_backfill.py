@@ -0,0 +1,91 @@
+# tests/test_backfill.py
+#
+# jobs.backfill.run_job: a job interrupted mid-window resumes from its
+# checkpoint (next_day + done_sensors), and windows stop at the last day
+# the device has fully uploaded, the rest of the job staying pending.
+
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+from db import Base, SessionLocal, BackfillJob, FitbitConnection, FitbitDeviceState, engine
+from fitbit import registry
+from fitbit.ratelimit import RateLimitExceeded
+from jobs import backfill
+from jobs.leases import claim, release
+
+UPLOAD = datetime(2025, 3, 12, 8, 30)
+
+
+@pytest.fixture
+def windows(monkeypatch):
+    """Stub Fitbit + LAMP; records (metric names, first day, last day, upload) per delivery."""
+    Base.metadata.create_all(engine)
+    db = SessionLocal()
+    for model in (BackfillJob, FitbitDeviceState, FitbitConnection):
+        db.query(model).delete()
+    db.add(FitbitConnection(user_id="u1", fitbit_user_id="Fu1", access_token="a", refresh_token="r",
+                            scope="activity", token_type="Bearer",
+                            expires_at=datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(hours=8)))
+    db.commit()
+    db.close()
+
+    seen = []
+    monkeypatch.setattr(backfill, "ENABLED", registry.select(["steps", "sleep"]))
+    monkeypatch.setattr(backfill.tokens, "get", lambda user_id: "token")
+    monkeypatch.setattr(backfill, "_check_upload", lambda db, state, access_token: UPLOAD)
+    monkeypatch.setattr(backfill, "_cached_profile", lambda db, state, access_token: ("Ann", 0))
+    monkeypatch.setattr(backfill, "flush_all", lambda user_id=None: None)
+    monkeypatch.setattr(backfill, "iter_group", lambda group, access_token, starts, end, user_id, uploaded: (
+        [s.name for s in group], min(starts.values()).date(), end.date(), uploaded))
+    monkeypatch.setattr(backfill, "deliver_streams", lambda user_id, names, chunks: seen.append(chunks) or {})
+    return seen
+
+
+def _job(job_id):
+    db = SessionLocal()
+    try:
+        return db.get(BackfillJob, job_id)
+    finally:
+        db.close()
+
+
+def test_resume_from_checkpoint_up_to_the_upload(windows, monkeypatch):
+    job_id = backfill.create_job("u1", date(2025, 3, 1), date(2025, 3, 20))
+
+    # A 429 on sleep, the second source of the first window
+    deliver = backfill.deliver_streams
+
+    def rate_limited(user_id, names, chunks):
+        if names == ["sleep"]:
+            raise RateLimitExceeded(user_id, 60)
+        return deliver(user_id, names, chunks)
+
+    monkeypatch.setattr(backfill, "deliver_streams", rate_limited)
+    with pytest.raises(RateLimitExceeded):
+        backfill.run_job(job_id, window_days=7)
+    job = _job(job_id)
+    assert (job.status, job.next_day, job.done_sensors) == ("pending", "2025-03-01", "steps")
+    assert claim(["u1"]) == ["u1"]   # the lease was released
+    release(["u1"])
+
+    # Resumed: sleep of the first window only, then windows up to the day before the upload
+    windows.clear()
+    monkeypatch.setattr(backfill, "deliver_streams", deliver)
+    with pytest.raises(backfill.AwaitingUpload):
+        backfill.run_job(job_id, window_days=7)
+    assert windows == [
+        (["sleep"], date(2025, 3, 1), date(2025, 3, 7), UPLOAD),
+        (["steps"], date(2025, 3, 8), date(2025, 3, 11), UPLOAD),
+        (["sleep"], date(2025, 3, 8), date(2025, 3, 11), UPLOAD),
+    ]
+    job = _job(job_id)
+    assert (job.status, job.next_day, job.done_sensors) == ("pending", "2025-03-12", "")
+
+
+def test_runner_leaves_a_job_waiting_for_an_upload_pending(windows):
+    job_id = backfill.create_job("u1", date(2025, 3, 10), date(2025, 3, 15))
+    assert backfill.run_backfill([job_id], workers=1, window_days=7) == (0, 0)
+    assert [w[1:3] for w in windows] == [(date(2025, 3, 10), date(2025, 3, 11))] * 2
+    assert _job(job_id).status == "pending"
+    assert backfill.unfinished_jobs() == [job_id]
@@ -0,0 +1,55 @@
+# tests/test_cache.py
+#
+# fitbit.sync._iter_intraday + fitbit.cache: a whole day is cached only once
+# the tracker has uploaded past it; the days up to the upload (zero-filled
+# by Fitbit until then) are fetched again on every sync.
+
+from datetime import datetime
+
+import pytest
+
+from db import Base, SessionLocal, FitbitResponseCache, engine
+from fitbit import cache, sync
+
+
+@pytest.fixture
+def fetched(monkeypatch):
+    Base.metadata.create_all(engine)
+    db = SessionLocal()
+    db.query(FitbitResponseCache).delete()
+    db.commit()
+    db.close()
+    monkeypatch.setattr(cache, "CACHE_ENABLED", True)
+
+    days = []
+
+    def fake_get(url, access_token, user_id=None, endpoint="other"):
+        day = url.split("/date/")[1][:10]
+        days.append(day)
+        return {"activities-steps-intraday": {"dataset": [{"time": "08:00:00", "value": 0}]}}
+
+    monkeypatch.setattr(sync, "_get", fake_get)
+    return days
+
+
+def _sync(uploaded):
+    list(sync._iter_intraday("steps", "token", "2025-03-01T00:00", "2025-03-04T23:59",
+                             "15min", "u1", uploaded=uploaded))
+
+
+def test_only_days_before_the_upload_are_cached(fetched):
+    _sync(datetime(2025, 3, 3, 7, 30))
+    assert cache.cached_days("u1", "steps", "15min", "2025-03-01", "2025-03-04") == {"2025-03-01", "2025-03-02"}
+
+    # The tracker uploads again: the days it covers are refetched, then cached
+    fetched.clear()
+    _sync(datetime(2025, 3, 5, 9, 0))
+    assert fetched == ["2025-03-03", "2025-03-04"]
+    assert len(cache.cached_days("u1", "steps", "15min", "2025-03-01", "2025-03-04")) == 4
+
+
+def test_nothing_is_cached_without_an_upload(fetched):
+    _sync(None)
+    _sync(None)
+    assert len(fetched) == 8
+    assert cache.cached_days("u1", "steps", "15min", "2025-03-01", "2025-03-04") == set()
@@ -0,0 +1,44 @@
+# tests/test_leases.py
+#
+# jobs.leases: a user is leased by one job at a time, even within one
+# process (claims are not re-entrant).
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from db import Base, SessionLocal, FitbitConnection, engine
+from jobs.leases import claim, release
+
+
+@pytest.fixture(autouse=True)
+def users():
+    Base.metadata.create_all(engine)
+    db = SessionLocal()
+    db.query(FitbitConnection).delete()
+    for uid in ("u0", "u1"):
+        db.add(FitbitConnection(user_id=uid, fitbit_user_id="F" + uid, access_token="a", refresh_token="r",
+                                scope="activity", token_type="Bearer",
+                                expires_at=datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(hours=8)))
+    db.commit()
+    db.close()
+
+
+def test_claim_is_not_reentrant():
+    assert claim(["u0"], owner="w1") == ["u0"]
+    assert claim(["u0"], owner="w1") == []
+    assert claim(["u0"], owner="w2") == []
+    assert claim(owner="w1") == ["u1"]
+
+
+def test_release_frees_the_lease():
+    assert claim(["u0"], owner="w1") == ["u0"]
+    release(["u0"], owner="w2")  # not the holder: no effect
+    assert claim(["u0"], owner="w2") == []
+    release(["u0"], owner="w1")
+    assert claim(["u0"], owner="w2") == ["u0"]
+
+
+def test_expired_lease_is_claimable():
+    assert claim(["u0"], owner="w1", ttl=-1) == ["u0"]
+    assert claim(["u0"], owner="w2") == ["u0"]
@@ -0,0 +1,94 @@
+# tests/test_outbox.py
+#
+# jobs.lamp.flush_outbox: concurrent flushes never post the same outbox row
+# (rows are claimed before the POST). jobs.lamp.queue_points: re-queueing
+# only touches the pending rows whose value changed.
+
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+from db import Base, SessionLocal, LampDeliveryDigest, LampOutbox, engine
+from jobs import lamp
+
+
+@pytest.fixture(autouse=True)
+def outbox(monkeypatch):
+    Base.metadata.create_all(engine)
+    db = SessionLocal()
+    db.query(LampOutbox).delete()
+    db.query(LampDeliveryDigest).delete()
+    db.commit()
+    db.close()
+    monkeypatch.setattr(lamp, "LAMP_BASE", "http://lamp.test")
+    monkeypatch.setattr(lamp, "LAMP_AUTH", "Basic x")
+    monkeypatch.setattr(lamp, "LAMP_DEDUPE", False)
+    lamp.queue_points("u0", "steps", [{"timestamp": 1000 * i, "steps": i} for i in range(10)])
+    lamp.queue_points("u1", "steps", [{"timestamp": 1000 * i, "steps": i} for i in range(5)])
+
+
+def _remaining():
+    db = SessionLocal()
+    try:
+        return db.query(LampOutbox).all()
+    finally:
+        db.close()
+
+
+def test_concurrent_flush_posts_each_row_once(monkeypatch):
+    posted = []
+    nested = []
+
+    def post(user_id, events):
+        if not nested:
+            # another flusher runs while this batch is in flight
+            nested.append(lamp.flush_outbox())
+        posted.extend((user_id, e["data"]["timestamp"]) for e in events)
+
+    monkeypatch.setattr(lamp, "_post_events", post)
+    assert lamp.flush_outbox(concurrency=1) == (15, 0)
+    assert nested == [(0, 0)]
+    assert len(posted) == len(set(posted)) == 15
+    assert _remaining() == []
+
+
+def test_failed_rows_are_released_with_backoff(monkeypatch):
+    monkeypatch.setattr(lamp, "_post_events", lambda user_id, events: "HTTP 503")
+    assert lamp.flush_outbox() == (0, 15)
+    rows = _remaining()
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    assert all(r.claimed_by is None and r.attempts == 1 and r.next_attempt_at > now for r in rows)
+    assert lamp.flush_outbox() == (0, 0)  # not due again before the backoff
+
+
+def _pending(user_id="u0"):
+    return {r.timestamp: r for r in _remaining() if r.user_id == user_id}
+
+
+def test_requeueing_a_pending_point_keeps_its_backoff(monkeypatch):
+    monkeypatch.setattr(lamp, "_post_events", lambda user_id, events: "HTTP 503")
+    lamp.flush_outbox()
+    before = _pending()
+
+    stats = lamp.queue_points("u0", "steps", [{"timestamp": 1000 * i, "steps": i} for i in range(10)])
+    assert (stats.queued, stats.unchanged) == (0, 10)
+    after = _pending()
+    assert [(r.id, r.attempts, r.next_attempt_at) for r in after.values()] == \
+           [(r.id, r.attempts, r.next_attempt_at) for r in before.values()]
+
+    # A new value replaces the pending one and is due now
+    stats = lamp.queue_points("u0", "steps", [{"timestamp": 2000, "steps": 42}])
+    assert stats.queued == 1
+    row = _pending()[2000]
+    assert (json.loads(row.payload)["steps"], row.attempts) == (42, 0)
+
+
+def test_value_back_to_the_delivered_one_drops_the_pending_row():
+    delivered = {"timestamp": 3000, "steps": 7}
+    lamp._record_digests("u0", "steps", {3000: lamp._digest(delivered)})
+    assert json.loads(_pending()[3000].payload)["steps"] == 3   # a newer value is waiting
+
+    stats = lamp.queue_points("u0", "steps", [delivered], dedupe=True)
+    assert (stats.queued, stats.unchanged) == (0, 1)
+    assert 3000 not in _pending() and len(_pending()) == 9
@@ -0,0 +1,76 @@
+# tests/test_ratelimit.py
+#
+# fitbit.ratelimit.RateLimiter: a spent budget is waited out when the reset
+# is close and given back (RateLimitExceeded) otherwise; a 429 is retried
+# after its Retry-After, then given back once the retries are spent.
+
+import pytest
+import requests
+
+import metrics
+from fitbit import ratelimit
+from fitbit.ratelimit import RateLimiter, RateLimitExceeded
+
+
+def _response(status=200, **headers):
+    r = requests.Response()
+    r.status_code = status
+    r.headers.update({k.replace("_", "-"): str(v) for k, v in headers.items()})
+    return r
+
+
+@pytest.fixture
+def slept(monkeypatch):
+    waits = []
+    monkeypatch.setattr(ratelimit.time, "sleep", waits.append)
+    return waits
+
+
+def _limited(reason):
+    return metrics.FITBIT_RATE_LIMITED.value(reason=reason)
+
+
+def test_spent_budget_waits_for_a_close_reset(slept):
+    limiter = RateLimiter(reserve=0, max_wait=60, retries=0, jitter=0)
+    limiter.request("u1", lambda: _response(**{"Fitbit_Rate_Limit_Remaining": 0, "Fitbit_Rate_Limit_Reset": 30}))
+    assert limiter.remaining("u1") == 0
+
+    assert limiter.request("u1", _response).status_code == 200
+    assert len(slept) == 1 and 29 < slept[0] <= 30
+    assert limiter.remaining("u1") is None   # budget unknown again after the reset
+
+
+def test_spent_budget_with_a_far_reset_is_given_back(slept):
+    limiter = RateLimiter(reserve=5, max_wait=60, retries=0, jitter=0)
+    limiter.request("u1", lambda: _response(**{"Fitbit_Rate_Limit_Remaining": 5, "Fitbit_Rate_Limit_Reset": 1800}))
+    before = _limited("budget")
+
+    with pytest.raises(RateLimitExceeded) as e:
+        limiter.request("u1", pytest.fail)   # nothing is sent
+    assert 1790 < e.value.retry_in <= 1800
+    assert _limited("budget") == before + 1
+    assert slept == []
+    assert limiter.remaining("u2") is None   # budgets are per user
+
+
+def test_429_is_retried_after_retry_after(slept):
+    limiter = RateLimiter(reserve=0, max_wait=60, retries=3, jitter=0)
+    responses = iter([_response(429, Retry_After=20), _response(200)])
+    before = _limited("429")
+
+    assert limiter.request("u1", lambda: next(responses)).status_code == 200
+    assert len(slept) == 1 and 19 < slept[0] <= 20
+    assert _limited("429") == before + 1
+
+
+def test_429_retries_exhausted(slept):
+    limiter = RateLimiter(reserve=0, max_wait=60, retries=2, jitter=0)
+    sent = []
+    before = {reason: _limited(reason) for reason in ("429", "429_retries", "budget")}
+
+    with pytest.raises(RateLimitExceeded):
+        limiter.request("u1", lambda: sent.append(1) or _response(429, Retry_After=5))
+    assert len(sent) == 3 and len(slept) == 2
+    assert _limited("429") == before["429"] + 3
+    assert _limited("429_retries") == before["429_retries"] + 1
+    assert _limited("budget") == before["budget"]
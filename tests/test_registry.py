@@ -0,0 +1,60 @@
+# tests/test_registry.py
+#
+# fitbit.registry: metrics are grouped by Fitbit source (one fetch each),
+# daily endpoints are read in ranges of at most max_days, and every metric
+# only gets the days from its own start.
+
+from datetime import date, datetime, timezone
+
+import pytest
+
+from fitbit import registry
+
+
+def _utc_ms(day: str) -> int:
+    d = date.fromisoformat(day)
+    return int(datetime(d.year, d.month, d.day, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def test_groups_follow_the_source():
+    specs = registry.select(["steps", "sleep", "heartrate", "sleep_efficiency", "calories", "hrv"])
+    assert [[s.name for s in g] for g in registry.groups(specs)] == [
+        ["steps"], ["sleep", "sleep_efficiency"], ["heartrate"], ["calories"], ["hrv"],
+    ]
+    assert registry.by_collection(specs) == {
+        "activities": ("steps", "heartrate", "calories"),
+        "sleep": ("sleep", "sleep_efficiency", "hrv"),
+    }
+
+
+def test_select_rejects_unknown_metrics():
+    assert [s.name for s in registry.select(["sleep", "steps", "sleep"])] == ["sleep", "steps"]
+    with pytest.raises(ValueError, match="stepz"):
+        registry.select(["steps", "stepz"])
+
+
+def test_daily_group_shares_range_calls(monkeypatch):
+    urls = []
+    logs = {
+        "2025-02-27": (400 * 60_000, 91), "2025-03-01": (420 * 60_000, 88), "2025-03-02": (390 * 60_000, 93),
+    }
+
+    def fake_get(url, access_token, user_id=None, endpoint="other"):
+        urls.append(url.split("/date/")[1])
+        first, last = url.split("/date/")[1][:-len(".json")].split("/")
+        return {"sleep": [{"dateOfSleep": d, "duration": ms, "efficiency": eff, "isMainSleep": True}
+                          for d, (ms, eff) in logs.items() if first <= d <= last]}
+
+    monkeypatch.setattr(registry, "_get", fake_get)
+    sleep, efficiency = registry.select(["sleep", "sleep_efficiency"])
+    source = registry.Daily("sleep", sleep.source.url, max_days=3)
+    specs = [registry.MetricSpec(s.name, s.field, source, s.collection, s.value) for s in (sleep, efficiency)]
+    starts = {"sleep": datetime(2025, 2, 26), "sleep_efficiency": datetime(2025, 3, 2)}
+
+    chunks = list(registry.iter_group(specs, "token", starts, datetime(2025, 3, 2, 23, 59)))
+
+    assert urls == ["2025-02-26/2025-02-28.json", "2025-03-01/2025-03-02.json"]
+    assert len(chunks) == 1
+    assert chunks[0]["sleep"] == [{"timestamp": _utc_ms(d), "duration_minutes": ms / 60_000}
+                                  for d, (ms, _) in sorted(logs.items())]
+    assert chunks[0]["sleep_efficiency"] == [{"timestamp": _utc_ms("2025-03-02"), "efficiency": 93}]
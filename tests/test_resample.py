@@ -0,0 +1,76 @@
+# tests/test_resample.py
+#
+# Timestamps from fitbit.resample must match the per-point naive → local
+# conversion (datetime(...).timestamp()), including on DST transition days,
+# and the serialized values are pinned (numbers and int/float types), so a
+# NumPy upgrade that changes them fails here.
+
+import json
+import os
+import time
+from datetime import datetime
+
+import pytest
+
+from fitbit.resample import dataset_to_arrays, local_datetime, resample_day
+
+
+@pytest.fixture(autouse=True)
+def new_york():
+    old = os.environ.get("TZ")
+    os.environ["TZ"] = "America/New_York"
+    time.tzset()
+    yield
+    if old is None:
+        del os.environ["TZ"]
+    else:
+        os.environ["TZ"] = old
+    time.tzset()
+
+
+def _dataset():
+    return [{"time": f"{m // 60:02d}:{m % 60:02d}:00", "value": m % 7} for m in range(1440)]
+
+
+@pytest.mark.parametrize("day", ["2024-03-10", "2024-11-03", "2024-03-12"])
+def test_points_use_local_offset_of_their_hour(day):
+    dataset = _dataset()
+    ts, _ = dataset_to_arrays(day, dataset)
+    expected = [int(datetime.fromisoformat(f"{day}T{e['time']}").timestamp() * 1000) for e in dataset]
+    assert ts.tolist() == expected
+
+
+@pytest.mark.parametrize("day", ["2024-03-10", "2024-11-03", "2024-03-12"])
+def test_hourly_buckets_follow_wall_clock(day):
+    hourly = {}
+    for e in _dataset():
+        hour = datetime.fromisoformat(f"{day}T{e['time']}").replace(minute=0)
+        hourly[hour] = hourly.get(hour, 0) + e["value"]
+
+    series = resample_day(day, _dataset(), "1h", "sum", "steps")
+    assert series.timestamps.tolist() == [int(h.timestamp() * 1000) for h in sorted(hourly)]
+    assert series.values.tolist() == [hourly[h] for h in sorted(hourly)]
+    # the watermark inverse lands back on the wall-clock hour
+    assert local_datetime(int(series.timestamps[-1])) == datetime.fromisoformat(f"{day}T23:00")
+
+
+_MIXED = [{"time": "08:00:00", "value": 3}, {"time": "08:20:00", "value": 4},
+          {"time": "08:40:00", "value": 10}, {"time": "09:05:00", "value": 7}]
+
+
+@pytest.mark.parametrize("reducer, expected", [
+    ("sum", '[{"timestamp": 1710244800000, "v": 17}, {"timestamp": 1710248400000, "v": 7}]'),
+    ("mean", '[{"timestamp": 1710244800000, "v": 5.666666666666667}, {"timestamp": 1710248400000, "v": 7.0}]'),
+    ("min", '[{"timestamp": 1710244800000, "v": 3}, {"timestamp": 1710248400000, "v": 7}]'),
+    ("max", '[{"timestamp": 1710244800000, "v": 10}, {"timestamp": 1710248400000, "v": 7}]'),
+    ("count", '[{"timestamp": 1710244800000, "v": 3}, {"timestamp": 1710248400000, "v": 1}]'),
+])
+def test_serialized_values_are_pinned(reducer, expected):
+    assert json.dumps(resample_day("2024-03-12", _MIXED, "1h", reducer, "v").to_points()) == expected
+
+
+@pytest.mark.parametrize("reducer, expected", [("sum", 1.3), ("mean", 0.325)])
+def test_float_buckets_are_pinned(reducer, expected):
+    dataset = [{"time": f"10:0{i}:00", "value": v} for i, v in enumerate([0.1, 0.2, 0.3, 0.7])]
+    series = resample_day("2024-03-12", dataset, "15min", reducer, "km")
+    assert series.to_points() == [{"timestamp": 1710252000000, "km": expected}]
@@ -0,0 +1,148 @@
+# tests/test_sync_detail.py
+#
+# The registry engine (fitbit.registry.iter_group, the path run_once takes)
+# fetches each Fitbit source once, at the coarsest detail level its metrics
+# allow (MetricSpec.detail), and its output matches the native 1min data.
+
+import re
+import zlib
+from dataclasses import replace
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from fitbit import registry, sync
+from fitbit.resample import local_epoch_ms
+
+_URL_RE = re.compile(r"/activities/(?P<resource>steps|heart)/date/(?P<d1>[\d-]+)/(?P<d2>1d|[\d-]+)"
+                     r"/(?P<detail>1min|15min)(?:/time/(?P<st>\d\d:\d\d)/(?P<et>\d\d:\d\d))?\.json$")
+
+STEPS = registry.SPECS["steps"]
+HEART = replace(registry.SPECS["heartrate"], freq="1h", reducer="mean", approx=False)
+
+
+def _minutes(resource: str, day: str) -> np.ndarray:
+    """Synthetic per-minute data of `day`: steps (walking bursts) or heart rate (NaN = no reading)."""
+    rng = np.random.default_rng(zlib.crc32(f"{resource}:{day}".encode()))
+    minute = np.arange(1440)
+    if resource == "steps":
+        walking = (minute >= 7 * 60) & (minute < 22 * 60) & (rng.random(1440) < 0.3)
+        return np.where(walking, rng.integers(1, 140, 1440), 0).astype(float)
+    bpm = rng.integers(55, 120, 1440).astype(float)
+    bpm[rng.random(1440) < 0.1] = np.nan   # off-wrist minutes
+    return bpm
+
+
+def _dataset(resource: str, day: str, detail: str, first: int, last: int):
+    values = _minutes(resource, day)
+    size = 15 if detail == "15min" else 1
+    out = []
+    for start in range(first - first % size, last + 1, size):
+        chunk = values[max(start, first):min(start + size, last + 1)]
+        chunk = chunk[~np.isnan(chunk)]
+        if chunk.size == 0:
+            continue
+        value = float(chunk.mean()) if resource == "heart" else int(chunk.sum())
+        out.append({"time": f"{start // 60:02d}:{start % 60:02d}:00", "value": value})
+    return out
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Stub Fitbit intraday (1min data or its 15min sums / means); records (resource, detail)."""
+    seen = []
+
+    def fake_get(url, access_token, user_id=None, endpoint="other"):
+        m = _URL_RE.search(url)
+        assert m, url
+        resource, d1, detail = m["resource"], m["d1"], m["detail"]
+        seen.append((resource, detail))
+        first = int(m["st"][:2]) * 60 + int(m["st"][3:]) if m["st"] else 0
+        last = int(m["et"][:2]) * 60 + int(m["et"][3:]) if m["et"] else 1439
+        if m["d2"] in ("1d", d1):
+            dataset = _dataset(resource, d1, detail, first, last)
+        else:
+            dataset = _dataset(resource, d1, detail, first, 1439) + _dataset(resource, m["d2"], detail, 0, last)
+        return {f"activities-{resource}-intraday": {"dataset": dataset}}
+
+    monkeypatch.setattr(sync, "_get", fake_get)
+    return seen
+
+
+def _expected(resource: str, start: datetime, end: datetime):
+    """(epoch ms, value) of the hourly sums (steps) or means (heart) of the minutes in [start, end]."""
+    out = []
+    day = start.date()
+    while day <= end.date():
+        values = _minutes(resource, day.isoformat())
+        midnight = datetime.combine(day, datetime.min.time())
+        for hour in range(24):
+            lo = max(start, midnight + timedelta(hours=hour))
+            hi = min(end + timedelta(minutes=1), midnight + timedelta(hours=hour + 1))
+            if lo >= hi:
+                continue
+            chunk = values[int((lo - midnight).total_seconds() // 60):int((hi - midnight).total_seconds() // 60)]
+            chunk = chunk[~np.isnan(chunk)]
+            if chunk.size == 0:
+                continue
+            ts = int(local_epoch_ms(day.isoformat(), np.array([hour * 3_600_000]))[0])
+            out.append((ts, chunk.sum() if resource == "steps" else chunk.mean()))
+        day += timedelta(days=1)
+    return out
+
+
+def _run(specs, starts, end):
+    """{metric: [(epoch ms, value), ...]} from one iter_group() over `specs`."""
+    fields = {s.name: s.field for s in specs}
+    out = {s.name: [] for s in specs}
+    for chunk in registry.iter_group(specs, "token", starts, end, user_id=None):
+        for name, series in chunk.items():
+            out[name].extend((p["timestamp"], p[fields[name]]) for p in series)
+    return out
+
+
+def test_detail_levels():
+    assert STEPS.detail() == "15min"                              # hourly sums from 15min sums
+    assert replace(STEPS, freq="5min").detail() == "5min"
+    assert replace(STEPS, reducer="max").detail() == "1min"       # a max needs the minutes
+    assert HEART.detail() == "1min"                               # mean of means is approximate
+    assert replace(HEART, approx=True).detail() == "15min"
+
+
+@pytest.mark.parametrize("start, end", [
+    ("2025-03-01T00:00", "2025-03-03T23:59"),       # whole days
+    ("2025-03-01T09:00", "2025-03-01T17:44"),       # time window within a day
+    ("2025-03-01T20:00", "2025-03-02T06:59"),       # window crossing midnight
+])
+def test_hourly_steps_from_15min_match_the_minutes(calls, start, end):
+    start, end = datetime.fromisoformat(start), datetime.fromisoformat(end)
+    got = _run([STEPS], {"steps": start}, end)["steps"]
+    assert got and got == [(ts, int(v)) for ts, v in _expected("steps", start, end)]
+    assert {detail for _, detail in calls} == {"15min"}
+
+
+def test_steps_and_heart_are_fetched_once_per_source(calls):
+    start, end = datetime(2025, 3, 1, 20, 0), datetime(2025, 3, 2, 6, 59)
+    specs = [STEPS, HEART]
+    out = {}
+    for group in registry.groups(specs):
+        out.update(_run(group, {s.name: start for s in group}, end))
+
+    assert [[s.name for s in g] for g in registry.groups(specs)] == [["steps"], ["heartrate"]]
+    assert sorted(calls) == [("heart", "1min"), ("steps", "15min")]  # one window each
+    assert out["steps"] == [(ts, int(v)) for ts, v in _expected("steps", start, end)]
+    assert out["heartrate"] == pytest.approx(_expected("heart", start, end))
+
+
+def test_metrics_of_one_source_keep_their_own_start(calls):
+    heart_max = registry.MetricSpec("heart_max", "heartrate_max", registry.HEART, "activities",
+                                    freq="1h", reducer="max")
+    end = datetime(2025, 3, 1, 23, 59)
+    starts = {"heartrate": datetime(2025, 3, 1, 6, 0), "heart_max": datetime(2025, 3, 1, 18, 0)}
+    out = _run([HEART, heart_max], starts, end)
+
+    assert calls == [("heart", "1min")]       # one fetch, from the earliest start
+    assert out["heartrate"] == pytest.approx(_expected("heart", starts["heartrate"], end))
+    first_max = datetime.fromtimestamp(out["heart_max"][0][0] / 1000)
+    assert first_max == starts["heart_max"] and len(out["heart_max"]) == 6
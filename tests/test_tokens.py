@@ -0,0 +1,42 @@
+# tests/test_tokens.py
+#
+# fitbit.tokens.refresh_due only spends the refresh tokens of the users it
+# is given (the ones this process holds leases for).
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from db import Base, SessionLocal, FitbitConnection, engine
+from fitbit import tokens as tokens_module
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+@pytest.fixture(autouse=True)
+def expiring(monkeypatch):
+    Base.metadata.create_all(engine)
+    db = SessionLocal()
+    db.query(FitbitConnection).delete()
+    for uid in ("u0", "u1", "u2"):
+        db.add(FitbitConnection(user_id=uid, fitbit_user_id="F" + uid, access_token="old", refresh_token="r-" + uid,
+                                scope="activity", token_type="Bearer", expires_at=_now() + timedelta(minutes=5)))
+    db.commit()
+    db.close()
+
+
+def test_refresh_due_only_touches_given_users(monkeypatch):
+    spent = []
+
+    def refresh(refresh_token):
+        spent.append(refresh_token)
+        return {"access_token": "new", "refresh_token": refresh_token + "'",
+                "expires_at": (_now() + timedelta(hours=8)).isoformat()}
+
+    monkeypatch.setattr(tokens_module, "refresh_tokens", refresh)
+    manager = tokens_module.TokenManager(margin=1800)
+    assert manager.refresh_due(["u1"]) == (1, 0)
+    assert manager.refresh_due([]) == (0, 0)
+    assert spent == ["r-u1"]
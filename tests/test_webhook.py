@@ -0,0 +1,102 @@
+# tests/test_webhook.py
+#
+# POST /fitbit/webhook: unsigned notifications are refused; signed ones
+# queue one targeted sync per (user, collection, day), the user resolved
+# from our hashed subscription id (or the Fitbit ownerId for older
+# subscriptions).
+
+import base64
+import hashlib
+import hmac
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import app as webapp
+import metrics
+from db import Base, SessionLocal, FitbitConnection, FitbitSubscription, PendingSync, engine
+from fitbit import subscriptions
+
+LONG_USER = "participant-" + "x" * 60   # subscription id "<user>-<collection>" would exceed 50
+
+
+@pytest.fixture
+def client(monkeypatch):
+    Base.metadata.create_all(engine)
+    db = SessionLocal()
+    for model in (PendingSync, FitbitSubscription, FitbitConnection):
+        db.query(model).delete()
+    for uid, fitbit_id in ((LONG_USER, "FLONG"), ("u2", "F2")):
+        db.add(FitbitConnection(user_id=uid, fitbit_user_id=fitbit_id, access_token="a", refresh_token="r",
+                                scope="activity", token_type="Bearer",
+                                expires_at=datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(hours=8)))
+    db.commit()
+    db.close()
+    monkeypatch.setattr(subscriptions, "CLIENT_SECRET", "s3cret")
+    return webapp.app.test_client()
+
+
+def _post(client, notifications, signature=None):
+    body = json.dumps(notifications).encode()
+    if signature is None:
+        digest = hmac.new(b"s3cret&", body, hashlib.sha1).digest()
+        signature = base64.b64encode(digest).decode()
+    return client.post("/fitbit/webhook", data=body, content_type="application/json",
+                       headers={"X-Fitbit-Signature": signature})
+
+
+def _queued():
+    db = SessionLocal()
+    try:
+        return sorted((p.user_id, p.collection, p.day) for p in db.query(PendingSync).all())
+    finally:
+        db.close()
+
+
+def _notified(outcome):
+    return metrics.NOTIFICATIONS.value(outcome=outcome)
+
+
+def test_subscription_ids_are_short_and_mapped(client, monkeypatch):
+    created = []
+    monkeypatch.setattr(subscriptions, "create_subscription",
+                        lambda access_token, collection, sid, user_id=None: created.append(sid) or True)
+    monkeypatch.setattr(subscriptions, "SUBSCRIPTION_COLLECTIONS", ["activities", "sleep"])
+
+    assert subscriptions.subscribe_user("token", LONG_USER) == ["activities", "sleep"]
+    assert len(set(created)) == 2 and all(len(sid) <= 50 for sid in created)
+    assert created == [subscriptions.subscription_id(LONG_USER, c) for c in ("activities", "sleep")]
+    assert subscriptions.subscribed_users(created) == dict.fromkeys(created, LONG_USER)
+    subscriptions.subscribe_user("token", LONG_USER)   # resubscribing keeps one mapping per id
+    assert len(subscriptions.subscribed_users(created)) == 2
+
+
+def test_bad_signature_is_refused(client):
+    before = _notified("bad_signature")
+    note = [{"ownerId": "F2", "collectionType": "sleep", "date": "2025-03-01"}]
+    assert _post(client, note, signature="bm9wZQ==").status_code == 404
+    assert client.post("/fitbit/webhook", json=note).status_code == 404   # no signature
+    assert _notified("bad_signature") == before + 2
+    assert _queued() == []
+
+
+def test_signed_notifications_are_queued_once(client, monkeypatch):
+    monkeypatch.setattr(subscriptions, "create_subscription", lambda *args, **kwargs: True)
+    subscriptions.subscribe_user("token", LONG_USER)
+    notes = [
+        # ownerId not ours any more (reconnected account): the subscription id decides
+        {"ownerId": "F-old", "collectionType": "activities", "date": "2025-03-01",
+         "subscriptionId": subscriptions.subscription_id(LONG_USER, "activities")},
+        {"ownerId": "F2", "collectionType": "sleep", "date": "2025-03-01", "subscriptionId": "u2-sleep"},
+        {"ownerId": "F-unknown", "collectionType": "sleep", "date": "2025-03-01"},
+        {"ownerId": "F2", "collectionType": "sleep", "date": "not-a-day"},
+    ]
+    before = {o: _notified(o) for o in ("queued", "duplicate", "unknown_owner")}
+
+    assert _post(client, notes).status_code == 204
+    assert _post(client, notes[:2]).status_code == 204   # Fitbit retries: already queued
+    assert _queued() == [(LONG_USER, "activities", "2025-03-01"), ("u2", "sleep", "2025-03-01")]
+    assert _notified("queued") == before["queued"] + 2
+    assert _notified("duplicate") == before["duplicate"] + 2
+    assert _notified("unknown_owner") == before["unknown_owner"] + 1
@@ -0,0 +1,104 @@
+# tests/test_windows.py
+#
+# fitbit.sync intraday planning: ranges are cut into windows of at most 24h
+# (whole days on their own), a window crossing midnight is split back into
+# its two days, and the split still holds on DST transition days (Fitbit
+# times are wall-clock, converted to epoch ms per day afterwards).
+
+import os
+import time
+from datetime import datetime
+
+import pytest
+
+from fitbit import sync
+from fitbit.resample import dataset_to_arrays
+from fitbit.sync import _intraday_windows, _split_window, _window_url
+
+BASE = f"{sync.API}/1/user/-/activities/steps/date"
+
+
+@pytest.fixture
+def new_york():
+    old = os.environ.get("TZ")
+    os.environ["TZ"] = "America/New_York"
+    time.tzset()
+    yield
+    if old is None:
+        del os.environ["TZ"]
+    else:
+        os.environ["TZ"] = old
+    time.tzset()
+
+
+def _dt(value: str) -> datetime:
+    return datetime.fromisoformat(value)
+
+
+def _minutes(first: str, last: str):
+    """Wall-clock dataset entries for every minute of [first, last] (HH:MM, may wrap past midnight)."""
+    lo, hi = (int(t[:2]) * 60 + int(t[3:]) for t in (first, last))
+    span = range(lo, hi + 1) if lo <= hi else list(range(lo, 1440)) + list(range(0, hi + 1))
+    return [{"time": f"{m // 60:02d}:{m % 60:02d}:00", "value": m} for m in span]
+
+
+def test_window_across_midnight_is_one_request():
+    windows = _intraday_windows(_dt("2025-03-01T20:00"), _dt("2025-03-02T06:59"))
+    assert windows == [(_dt("2025-03-01T20:00"), _dt("2025-03-02T06:59"))]
+    assert _window_url("steps", *windows[0], "1min") == f"{BASE}/2025-03-01/2025-03-02/1min/time/20:00/06:59.json"
+
+
+def test_long_ranges_are_cut_on_day_boundaries():
+    windows = _intraday_windows(_dt("2025-03-01T10:00"), _dt("2025-03-04T08:29"))
+    assert windows == [
+        (_dt("2025-03-01T10:00"), _dt("2025-03-01T23:59")),
+        (_dt("2025-03-02T00:00"), _dt("2025-03-02T23:59")),
+        (_dt("2025-03-03T00:00"), _dt("2025-03-03T23:59")),
+        (_dt("2025-03-04T00:00"), _dt("2025-03-04T08:29")),
+    ]
+    assert [_window_url("steps", *w, "15min") for w in windows] == [
+        f"{BASE}/2025-03-01/1d/15min/time/10:00/23:59.json",
+        f"{BASE}/2025-03-02/1d/15min.json",
+        f"{BASE}/2025-03-03/1d/15min.json",
+        f"{BASE}/2025-03-04/1d/15min/time/00:00/08:29.json",
+    ]
+    # Exactly 24h is two windows: Fitbit serves under 24h per request
+    assert len(_intraday_windows(_dt("2025-03-01T10:00"), _dt("2025-03-02T10:00"))) == 2
+    assert _intraday_windows(_dt("2025-03-02T10:00"), _dt("2025-03-01T10:00")) == []
+
+
+def test_split_window_across_midnight():
+    w_start, w_end = _dt("2025-03-01T22:30"), _dt("2025-03-02T01:15")
+    (d1, first), (d2, second) = _split_window(_minutes("22:30", "01:15"), w_start, w_end)
+    assert (d1, first[0]["time"], first[-1]["time"], len(first)) == ("2025-03-01", "22:30:00", "23:59:00", 90)
+    assert (d2, second[0]["time"], second[-1]["time"], len(second)) == ("2025-03-02", "00:00:00", "01:15:00", 76)
+
+
+@pytest.mark.parametrize("start, end", [
+    ("2024-03-09T21:00", "2024-03-10T05:59"),   # into spring forward (02:xx skipped)
+    ("2024-11-02T21:00", "2024-11-03T05:59"),   # into fall back (01:xx twice)
+    ("2024-03-10T21:00", "2024-03-11T05:59"),   # out of spring forward
+])
+def test_dst_nights_keep_each_minute_on_its_day(new_york, monkeypatch, start, end):
+    urls = []
+
+    def fake_get(url, access_token, user_id=None, endpoint="other"):
+        urls.append(url)
+        return {"activities-steps-intraday": {"dataset": _minutes(start[11:], end[11:])}}
+
+    monkeypatch.setattr(sync, "_get", fake_get)
+    days = list(sync._iter_intraday("steps", "token", start, end, "1min"))
+
+    assert len(urls) == 1
+    assert [day for day, _ in days] == [start[:10], end[:10]]
+    assert sum(len(entries) for _, entries in days) == 9 * 60
+    for day, entries in days:
+        ts, _ = dataset_to_arrays(day, entries)
+        assert ts.tolist() == [int(_dt(f"{day}T{e['time']}").timestamp() * 1000) for e in entries]
+
+
+def test_coarse_detail_starts_on_a_bucket(monkeypatch):
+    urls = []
+    monkeypatch.setattr(sync, "_get", lambda url, *args, **kwargs: urls.append(url) or {})
+    list(sync._iter_intraday("steps", "token", "2025-03-01T20:07", "2025-03-02T06:59", "15min"))
+    assert urls == [f"{BASE}/2025-03-01/2025-03-02/15min/time/20:00/06:59.json"]
@@ -0,0 +1,73 @@
+# tools/fitbit_notify.py
+#
+# Local stand-in for Fitbit's Subscription API: signs and posts a
+# notification to the webhook the way Fitbit does, so the push path can be
+# exercised without a public HTTPS endpoint.
+#
+#   python -m tools.fitbit_notify --verify
+#   python -m tools.fitbit_notify --owner 7ABCDE --collection activities --date 2024-05-01
+
+import os
+import sys
+import json
+import hmac
+import base64
+import hashlib
+import argparse
+from datetime import date
+
+CURRENT_DIR = os.path.dirname(__file__)
+PROJECT_ROOT = os.path.dirname(CURRENT_DIR)
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import requests
+
+WEBHOOK_URL = os.getenv("FITBIT_WEBHOOK_URL", "http://localhost:5000/fitbit/webhook")
+
+
+def sign(body: bytes, client_secret: str) -> str:
+    key = f"{client_secret}&".encode()
+    return base64.b64encode(hmac.new(key, body, hashlib.sha1).digest()).decode()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Post a signed Fitbit notification to the webhook.")
+    parser.add_argument("--url", default=WEBHOOK_URL)
+    parser.add_argument("--verify", action="store_true",
+                        help="only run the subscriber verification handshake")
+    parser.add_argument("--owner", help="Fitbit user id (fitbit_connections.fitbit_user_id)")
+    parser.add_argument("--collection", default="activities")
+    parser.add_argument("--date", default=date.today().isoformat())
+    parser.add_argument("--secret", default=os.getenv("FITBIT_CLIENT_SECRET", ""))
+    args = parser.parse_args(argv)
+
+    if args.verify:
+        code = os.getenv("FITBIT_SUBSCRIBER_VERIFY_CODE", "")
+        good = requests.get(args.url, params={"verify": code}, timeout=10).status_code
+        bad = requests.get(args.url, params={"verify": code + "x"}, timeout=10).status_code
+        print(f"correct code → {good} (want 204), wrong code → {bad} (want 404)")
+        return 0 if (good, bad) == (204, 404) else 1
+
+    if not args.owner:
+        parser.error("--owner is required")
+    body = json.dumps([{
+        "collectionType": args.collection,
+        "date": args.date,
+        "ownerId": args.owner,
+        "ownerType": "user",
+        "subscriptionId": f"local-{args.collection}",
+    }]).encode()
+    r = requests.post(args.url, data=body, timeout=10, headers={
+        "Content-Type": "application/json",
+        "X-Fitbit-Signature": sign(body, args.secret),
+    })
+    print(f"{r.status_code} (want 204)")
+    return 0 if r.status_code == 204 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())